@@ -5,7 +5,6 @@
 # Development Kit License (20191101-BDSDK-SL).
 
 import argparse
-from vtk.util import numpy_support
 import google.protobuf.timestamp_pb2
 import math
 import numpy as np
@@ -13,7 +12,6 @@ import numpy.linalg
 import os
 import sys
 import time
-import vtk
 
 from bosdyn.api.graph_nav import map_pb2
 from bosdyn.api import geometry_pb2
@@ -21,91 +19,50 @@ from bosdyn.client.frame_helpers import *
 from bosdyn.client.math_helpers import *
 import bosdyn.client.util
 
+from utils.costmap import Costmap
 from utils.graph_nav_helper import GraphNavInterface
-
-def load_map(path):
+from utils.map_cache import MapCache
+from utils.map_loader import get_map_loader
+from utils.mission_queue import MissionQueue
+from utils.route_planner import RoutePlanner
+from utils.rpc_tracing import RpcTracer
+from utils.spatial_index import AnchoringIndex
+
+def load_map(path, use_cache=True):
     """
     Load a map from the given file path.
-    :param path: Path to the root directory of the map.
-    :return: the graph, waypoints, waypoint snapshots and edge snapshots.
+    :param path: Path to the root directory of the map, or to a map container file.
+    :param use_cache: Read the anchored world objects from the map cache next to the map. The
+        snapshots are then returned as mappings that are only parsed when accessed.
+    :return: the graph, waypoints, waypoint snapshots, edge snapshots, anchors and anchored world
+        objects. With use_cache the snapshots are read-only LazySnapshotDict mappings
+        (utils/map_loader.py), otherwise dicts.
     """
-    with open(os.path.join(path, "graph"), "rb") as graph_file:
-        # Load the graph file and deserialize it. The graph file is a protobuf containing only the waypoints and the
-        # edges between them.
-        data = graph_file.read()
-        current_graph = map_pb2.Graph()
-        current_graph.ParseFromString(data)
-
-        # Set up maps from waypoint ID to waypoints, edges, snapshots, etc.
-        current_waypoints = {}
-        current_waypoint_snapshots = {}
-        current_edge_snapshots = {}
-        current_anchors = {}
-        current_anchored_world_objects = {}
-
-        # Load the anchored world objects first so we can look in each waypoint snapshot as we load it.
-        for anchored_world_object in current_graph.anchoring.objects:
-            current_anchored_world_objects[anchored_world_object.id] = (anchored_world_object,)
-        # For each waypoint, load any snapshot associated with it.
-        for waypoint in current_graph.waypoints:
-            current_waypoints[waypoint.id] = waypoint
-
-            if len(waypoint.snapshot_id) == 0:
-                continue
-            # Load the snapshot. Note that snapshots contain all of the raw data in a waypoint and may be large.
-            file_name = os.path.join(path, "waypoint_snapshots", waypoint.snapshot_id)
-            if not os.path.exists(file_name):
-                continue
-            with open(file_name, "rb") as snapshot_file:
-                waypoint_snapshot = map_pb2.WaypointSnapshot()
-                waypoint_snapshot.ParseFromString(snapshot_file.read())
-                current_waypoint_snapshots[waypoint_snapshot.id] = waypoint_snapshot
-
-                for fiducial in waypoint_snapshot.objects:
-                    if not fiducial.HasField("apriltag_properties"):
-                        continue
-
-                    str_id = str(fiducial.apriltag_properties.tag_id)
-                    if (str_id in current_anchored_world_objects and
-                            len(current_anchored_world_objects[str_id]) == 1):
-
-                        # Replace the placeholder tuple with a tuple of (wo, waypoint, fiducial).
-                        anchored_wo = current_anchored_world_objects[str_id][0]
-                        current_anchored_world_objects[str_id] = (anchored_wo, waypoint, fiducial)
-
-        # Similarly, edges have snapshot data.
-        for edge in current_graph.edges:
-            if len(edge.snapshot_id) == 0:
-                continue
-            file_name = os.path.join(path, "edge_snapshots", edge.snapshot_id)
-            if not os.path.exists(file_name):
-                continue
-            with open(file_name, "rb") as snapshot_file:
-                edge_snapshot = map_pb2.EdgeSnapshot()
-                edge_snapshot.ParseFromString(snapshot_file.read())
-                current_edge_snapshots[edge_snapshot.id] = edge_snapshot
-        for anchor in current_graph.anchoring.anchors:
-            current_anchors[anchor.id] = anchor
-        print("Loaded graph with {} waypoints, {} edges, {} anchors, and {} anchored world objects".
-              format(len(current_graph.waypoints), len(current_graph.edges),
-                     len(current_graph.anchoring.anchors), len(current_graph.anchoring.objects)))
-        return (current_graph, current_waypoints, current_waypoint_snapshots,
-                current_edge_snapshots, current_anchors, current_anchored_world_objects)
-
-
-def nav_to_fiducial(graph_nav_interface,fiducial,map_path):
-    # Load the map from the given file.
-    (current_graph, current_waypoints, current_waypoint_snapshots, current_edge_snapshots,
-     current_anchors, current_anchored_world_objects) = load_map(map_path)
-
-    #### seed_tform_object gives pose of fiducial in seed frame, as protobug
-    seed_tform_fiducial_pb = current_anchored_world_objects[fiducial][0].seed_tform_object
-    
-    #Turn protobuf SE3Pose into math SE3Pose
-    seed_tform_fiducial = SE3Pose(x=seed_tform_fiducial_pb.position.x,
-                            y=seed_tform_fiducial_pb.position.y,
-                            z=seed_tform_fiducial_pb.position.z,
-                            rot=seed_tform_fiducial_pb.rotation)
+    # The graph is parsed once per map and shared with GraphNavInterface.
+    map_loader = get_map_loader(path)
+    if use_cache:
+        map_index = MapCache(path).get(map_loader)
+        current_anchored_world_objects = map_index.anchored_world_objects(map_loader.graph)
+        current_waypoint_snapshots = map_loader.waypoint_snapshots
+        current_edge_snapshots = map_loader.edge_snapshots
+    else:
+        # The snapshots contain all of the raw data in a waypoint and may be large.
+        map_loader.load_all()
+        current_anchored_world_objects = dict(map_loader.anchored_world_objects())
+        current_waypoint_snapshots = dict(map_loader.waypoint_snapshots)
+        current_edge_snapshots = dict(map_loader.edge_snapshots)
+    map_loader.print_summary()
+    return (map_loader.graph, dict(map_loader.waypoints), current_waypoint_snapshots,
+            current_edge_snapshots, dict(map_loader.anchors), current_anchored_world_objects)
+
+
+def approach_pose(map_index, fiducial):
+    """Return the SE3Pose, in seed frame, from which to approach an anchored fiducial."""
+    #### seed_tform_object gives pose of fiducial in seed frame, as [x, y, z, qw, qx, qy, qz]
+    x, y, z, qw, qx, qy, qz = map_index.anchored_objects[fiducial]["seed_tform_object"]
+
+    #Turn it into math SE3Pose
+    seed_tform_fiducial = SE3Pose(x=x, y=y, z=z, rot=Quat(w=qw, x=qx, y=qy, z=qz))
 
     #Construct SE3 pose relative to fiducial we want for approach
     fiducial_tform_approach = SE3Pose(x=0,
@@ -113,60 +70,163 @@ def nav_to_fiducial(graph_nav_interface,fiducial,map_path):
                             z=1.25,
                             rot=Quat(w=1,x=0,y=0,z=0))
     
-    seed_tfrom_approach = seed_tform_fiducial.mult(fiducial_tform_approach)
+    return seed_tform_fiducial.mult(fiducial_tform_approach)
+
+
+def free_approach_pose(map_index, fiducial, costmap, distances=(1.25, 1.0, 1.5, 1.75, 2.0),
+                       angles=(0, 15, -15, 30, -30, 45, -45)):
+    """
+    Return an approach pose of an anchored fiducial that the costmap observed as collision free.
+    Candidates are the nominal approach pose moved to other distances from the fiducial and rotated
+    around the vertical axis through it, facing the fiducial the same way.
+    :param map_index: MapIndex (utils/map_cache.py) of the map the fiducial is anchored in.
+    :param fiducial: Id of the fiducial.
+    :param costmap: Costmap of the map, None to skip the check.
+    :param distances: Horizontal distances from the fiducial to try, in meters.
+    :param angles: Rotations of the approach around the fiducial to try, in degrees.
+    :return: SE3Pose in seed frame, the nominal approach pose if no candidate is free.
+    """
+    seed_tform_approach = approach_pose(map_index, fiducial)
+    if costmap is None or costmap.is_free(seed_tform_approach.x, seed_tform_approach.y):
+        return seed_tform_approach
+    fiducial_x, fiducial_y = map_index.anchored_objects[fiducial]["seed_tform_object"][:2]
+    dx = seed_tform_approach.x - fiducial_x
+    dy = seed_tform_approach.y - fiducial_y
+    nominal_distance = math.hypot(dx, dy)
+    if nominal_distance < 1e-3:
+        # The fiducial faces up or down, there is no direction to move the approach along.
+        return seed_tform_approach
+    yaw = seed_tform_approach.rot.to_yaw()
+    for distance in distances:
+        for angle in angles:
+            cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+            scale = distance / nominal_distance
+            x = fiducial_x + (cos * dx - sin * dy) * scale
+            y = fiducial_y + (sin * dx + cos * dy) * scale
+            if costmap.is_free(x, y):
+                return SE3Pose(x, y, seed_tform_approach.z,
+                               Quat.from_yaw(yaw + math.radians(angle)))
+    print("No collision free approach pose found for fiducial {}.".format(fiducial))
+    return seed_tform_approach
+
+
+def nearest_waypoint(graph, seed_tform_pose):
+    """Return the id of the anchored waypoint closest to a pose in seed frame."""
+    waypoint_id, _ = AnchoringIndex.for_graph(graph).waypoints.nearest(seed_tform_pose.x,
+                                                                       seed_tform_pose.y)[0]
+    return waypoint_id
+
+
+def order_tour(map_loader, map_index, fiducials, start_waypoint=None, costmap=None):
+    """
+    Order the fiducials of a tour so the route between their approach poses is short.
+    :param map_loader: MapLoader of the map the fiducials are anchored in.
+    :param map_index: MapIndex of the same map.
+    :param fiducials: Ids of the fiducials to visit.
+    :param start_waypoint: Waypoint the tour starts from, by default the first fiducial.
+    :param costmap: Costmap the approach poses are checked against, None to skip the check.
+    :return: list of (fiducial, seed_tform_approach) in visiting order.
+    """
+    planner = RoutePlanner.for_graph(map_loader.graph)
+    approaches = [free_approach_pose(map_index, fiducial, costmap) for fiducial in fiducials]
+    # Each approach pose is reached through the graph at the waypoint nearest to it.
+    stops = [nearest_waypoint(map_loader.graph, approach) for approach in approaches]
+    order = planner.order_stops(stops, start=start_waypoint or None)
+    return [(fiducials[i], approaches[i]) for i in order]
+
+
+def nav_to_fiducial(graph_nav_interface,fiducial,map_path):
+    # The anchored fiducial pose comes from the map cache, so the snapshots are not parsed.
+    map_index = MapCache(map_path).get(get_map_loader(map_path))
+    seed_tfrom_approach = free_approach_pose(map_index, fiducial, Costmap.for_map(map_path))
     print(seed_tfrom_approach)
     print(seed_tfrom_approach.rotation.to_yaw())
 
     graph_nav_interface._navigate_to_anchor([seed_tfrom_approach.position.x, seed_tfrom_approach.position.y, seed_tfrom_approach.rotation.to_yaw()])
 
+def visit_fiducials(robot, path, fiducials):
+    """
+    Upload a map to the robot, localize on the nearest fiducial and navigate to the approach pose
+    of every fiducial, in the order that makes the tour shortest.
+    :param robot: Robot to drive, e.g. a utils.fake_robot.FakeRobot to run without a robot.
+    :param path: Path to the root directory of the map.
+    :param fiducials: Ids of the fiducials to visit, all anchored in the map.
+    :return: list of (fiducial, seed_tform_approach) in visiting order.
+    """
+    map_loader = get_map_loader(path)
+    map_index = MapCache(path).get(map_loader)
+    # The robot connection, lease, map upload and localization are shared by the whole tour.
+    graph_nav_interface = GraphNavInterface(robot, path)
+
+    #Upload map
+    graph_nav_interface._upload_graph_and_snapshots()
+    #Localize robot based on nearest fiducials
+    graph_nav_interface._set_initial_localization_fiducial()
+
+    #Visit the fiducials, starting from the waypoint the robot localized to
+    localization_id = graph_nav_interface._graph_nav_client.get_localization_state(
+    ).localization.waypoint_id
+    # The costmap is kept in the map cache directory too, and only rebuilt for changed snapshots.
+    costmap = Costmap.for_map(path)
+    tour = order_tour(map_loader, map_index, fiducials, localization_id, costmap)
+    print("Tour: {}".format(" -> ".join(fiducial for fiducial, _ in tour)))
+    # The approach poses are driven back to back, the robot stays powered on between them.
+    # The approach z is the height of the fiducial, not of the body, so every goal leaves z out
+    # and takes the height of the robot when its leg starts.
+    mission = MissionQueue(graph_nav_interface)
+    for fiducial, seed_tfrom_approach in tour:
+        print(seed_tfrom_approach)
+        print(seed_tfrom_approach.rotation.to_yaw())
+        mission.add_anchor([seed_tfrom_approach.position.x, seed_tfrom_approach.position.y, seed_tfrom_approach.rotation.to_yaw()])
+    #Navigate to the approach poses!
+    print(mission.run())
+
+    #Give up lease
+    graph_nav_interface._on_quit()
+    return tour
+
 def main(argv):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--path', type=str, help='Map to draw.')
-    parser.add_argument('--fiducial', type=str, help='Fiducial to approach')
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument('--fiducial', type=str, help='Fiducial to approach')
+    targets.add_argument('--tour', type=str, nargs='+',
+                         help='Fiducials to approach one after the other, in the order that makes '
+                         'the tour shortest.')
     parser.add_argument('-a', '--anchoring', action='store_true',
                         help='Draw the map according to the anchoring (in seed frame).')
+    parser.add_argument('--trace', type=str,
+                        help='Write a Chrome trace of the RPCs and waits of the tour to this file.')
     bosdyn.client.util.add_base_arguments(parser)
     options = parser.parse_args(argv)
 
-    ### Get approach pose for fiducial in seed frame
-    # Load the map from the given file.
-    (current_graph, current_waypoints, current_waypoint_snapshots, current_edge_snapshots,
-     current_anchors, current_anchored_world_objects) = load_map(options.path)
-
-    #### seed_tform_object gives pose of fiducial in seed frame, as protobug
-    seed_tform_fiducial_pb = current_anchored_world_objects[options.fiducial][0].seed_tform_object
-    
-    #Turn protobuf SE3Pose into math SE3Pose
-    seed_tform_fiducial = SE3Pose(x=seed_tform_fiducial_pb.position.x,
-                            y=seed_tform_fiducial_pb.position.y,
-                            z=seed_tform_fiducial_pb.position.z,
-                            rot=seed_tform_fiducial_pb.rotation)
+    fiducials = options.tour if options.tour else [options.fiducial]
 
-    #Construct SE3 pose relative to fiducial we want for approach
-    fiducial_tform_approach = SE3Pose(x=0,
-                            y=0,
-                            z=1.25,
-                            rot=Quat(w=1,x=0,y=0,z=0))
-    
-    seed_tfrom_approach = seed_tform_fiducial.mult(fiducial_tform_approach)
-    print(seed_tfrom_approach)
-    print(seed_tfrom_approach.rotation.to_yaw())
+    ### Get approach pose for fiducial in seed frame
+    # Load the map from the given file. Snapshots are parsed later, only if the robot needs them.
+    map_index = MapCache(options.path).get(get_map_loader(options.path))
+    for fiducial in fiducials:
+        if fiducial not in map_index.anchored_objects:
+            print("Fiducial {} is not anchored in the map.".format(fiducial))
+            return False
 
     ### Load nav stack and move to 
     sdk = bosdyn.client.create_standard_sdk('GraphNavClient')
     robot = sdk.create_robot(options.hostname)
+    tracer = RpcTracer().start() if options.trace else None
+    if tracer is not None:
+        tracer.instrument_robot(robot)
     bosdyn.client.util.authenticate(robot)
 
-    graph_nav_interface = GraphNavInterface(robot, options.path)
-
-    #Upload map
-    graph_nav_interface._upload_graph_and_snapshots()
-    #Localize robot based on nearest fiducials
-    graph_nav_interface._set_initial_localization_fiducial()
-    #Navigate to approach pose!
-    graph_nav_interface._navigate_to_anchor([seed_tfrom_approach.position.x, seed_tfrom_approach.position.y, seed_tfrom_approach.rotation.to_yaw()])
+    try:
+        visit_fiducials(robot, options.path, fiducials)
+    finally:
+        if tracer is not None:
+            tracer.stop()
+            tracer.print_summary()
+            tracer.write_chrome_trace(options.trace)
+    return True
 
-    #Give up lease
-    graph_nav_interface._on_quit()
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    if not main(sys.argv[1:]):
+        sys.exit(1)
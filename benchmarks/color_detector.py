@@ -0,0 +1,110 @@
+"""Benchmark finding the handle red in a hand camera image.
+
+Compares the original per-pixel loop of open_drawer.best_red with ColorTargetDetector, at full
+resolution and downsampled, on a synthetic frame with a red patch on a gray background. Both
+must find the same pixel at full resolution, and every detector a pixel of the patch.
+
+    python -m benchmarks.color_detector --rows 480 --cols 640
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.color_detector import RED_BGR, ColorTargetDetector
+
+
+def red_distance(p):
+    red = np.array([35, 29, 206])
+    p = np.array(p)
+    return np.sqrt(np.sum(np.square(red - p)))
+
+
+def best_red_loop(spot_image):
+    """The per-pixel loop best_red used to run."""
+    best_x = None
+    best_y = None
+    best_dist = 1000000000
+    for x in range(spot_image.shape[0]):
+        for y in range(spot_image.shape[1]):
+            red_val = red_distance(spot_image[x, y])
+            if red_val < best_dist:
+                best_x = x
+                best_y = y
+                best_dist = red_val
+    return best_x, best_y, best_dist
+
+
+def red_patch(rows, cols):
+    """Return the (row_min, col_min, row_max, col_max) of the red patch of synthetic_frame."""
+    return rows // 3, cols // 2, rows // 3 + 20, cols // 2 + 30
+
+
+def synthetic_frame(rows, cols, seed=0):
+    """Return a BGR frame of gray sensor noise with a slightly off red patch in it.
+
+    The noise is low enough that no background pixel comes closer to the red than the patch.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.clip(rng.normal(128, 8, size=(rows, cols, 3)), 0, 255).astype(np.uint8)
+    row_min, col_min, row_max, col_max = red_patch(rows, cols)
+    patch = np.array((40, 30, 200)) + rng.integers(-3, 4, size=(row_max - row_min,
+                                                                 col_max - col_min, 3))
+    image[row_min:row_max, col_min:col_max] = patch
+    return image
+
+
+def time_call(func, repeat):
+    """Return the best wall clock time of repeat calls to func, in seconds, and its result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=480, help='Image height.')
+    parser.add_argument('--cols', type=int, default=640, help='Image width.')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of runs per detector.')
+    options = parser.parse_args(argv)
+
+    image = synthetic_frame(options.rows, options.cols)
+    # The loop takes seconds per frame, a single run is enough.
+    loop, expected = time_call(lambda: best_red_loop(image), 1)
+    detectors = (
+        ("vectorized bgr", ColorTargetDetector([RED_BGR])),
+        ("vectorized bgr /2", ColorTargetDetector([RED_BGR], downsample=2)),
+        ("vectorized bgr /4", ColorTargetDetector([RED_BGR], downsample=4)),
+        ("vectorized hsv", ColorTargetDetector([RED_BGR], metric="hsv")),
+    )
+
+    print("{:<24}{:>12}{:>10}  {}".format("detector", "best (ms)", "speedup", "result"))
+    print("{:<24}{:>12.2f}{:>9.1f}x  {}".format("loop", loop * 1000, 1.0, expected[:2]))
+    results = [("loop", expected)]
+    for name, detector in detectors:
+        seconds, result = time_call(lambda: detector.best(image), options.repeat)
+        print("{:<24}{:>12.2f}{:>9.1f}x  {}".format(name, seconds * 1000, loop / seconds,
+                                                    result[:2]))
+        results.append((name, result))
+    row_min, col_min, row_max, col_max = red_patch(options.rows, options.cols)
+    missed = [(name, result[:2]) for name, result in results
+              if not (row_min <= result[0] < row_max and col_min <= result[1] < col_max)]
+    for name, pixel in missed:
+        print("{} found {}, outside of the red patch {}".format(
+            name, pixel, (row_min, col_min, row_max, col_max)))
+    if missed:
+        return 1
+    found = ColorTargetDetector([RED_BGR]).best(image)
+    if found[:2] != expected[:2] or abs(found[2] - expected[2]) > 1e-9:
+        print("Vectorized detector disagrees with the loop: {} != {}".format(found, expected))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
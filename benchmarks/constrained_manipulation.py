@@ -0,0 +1,49 @@
+"""Benchmark building constrained manipulation commands.
+
+Compares building the RobotCommand from scratch every time (as the construct_*_task helpers used
+to), copying the prototype cached by TaskRegistry, and updating one command in place with
+set_velocity, as a closed loop re-issuing the command at a high rate does.
+
+    python -m benchmarks.constrained_manipulation --iterations 20000
+"""
+import argparse
+import sys
+import time
+
+from utils.constrained_manipulation_helper import TASK_REGISTRY
+
+
+def rebuild(name, velocity):
+    definition = TASK_REGISTRY.definition(name)
+    force_limit, torque_limit = definition.limits(40, 5)
+    command = definition.build(force_limit, torque_limit)
+    request = command.full_body_command.constrained_manipulation_request
+    request.tangential_speed = velocity * definition.speed_limit(force_limit, torque_limit)
+    return command
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000, help='Commands built per case.')
+    parser.add_argument('--task-type', default='drawer', choices=TASK_REGISTRY.names)
+    options = parser.parse_args(argv)
+
+    command = TASK_REGISTRY.command(options.task_type, 0.0)
+    cases = [
+        ("rebuild", lambda velocity: rebuild(options.task_type, velocity)),
+        ("cached prototype", lambda velocity: TASK_REGISTRY.command(options.task_type, velocity)),
+        ("update in place",
+         lambda velocity: TASK_REGISTRY.set_velocity(command, options.task_type, velocity)),
+    ]
+    print("{:<20}{:>14}".format("command", "us/command"))
+    for name, build in cases:
+        start = time.perf_counter()
+        for i in range(options.iterations):
+            build(-0.5 + (i % 100) / 100.0)
+        micros = 1e6 * (time.perf_counter() - start) / options.iterations
+        print("{:<20}{:>14.2f}".format(name, micros))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+"""Benchmark opening simulated drawers open loop and with ConstrainedManipulationController.
+
+The open loop run is what run_constrained_manipulation does: one command with a 10 s end time,
+then a 2 s sleep. The closed loop run streams the robot state and stops on the travel target, a
+stuck arm or a stall. Each scenario is a SimulatedDrawer; the table shows the time each run
+took, how far the drawer opened and whether the arm was still pulling at the end.
+
+    python -m benchmarks.drawer_controller --latency 0.01 --trace-dir /tmp/traces
+"""
+import argparse
+import os
+import sys
+import time
+
+from utils.constrained_manipulation_controller import ConstrainedManipulationController
+from utils.constrained_manipulation_helper import TASK_REGISTRY
+from utils.simulated_manipulation import SimulatedDrawer
+
+SCENARIOS = [
+    # name, SimulatedDrawer arguments, controller arguments
+    ("free drawer", dict(), dict()),
+    ("heavy drawer", dict(friction=30.0), dict()),
+    ("open 0.2 m", dict(), dict(travel_target=0.2)),
+    ("locked drawer", dict(friction=60.0), dict()),
+    ("handle slips", dict(lose_grasp_at=0.1), dict()),
+]
+
+
+def open_loop(drawer, velocity=-0.5):
+    start = time.perf_counter()
+    command = TASK_REGISTRY.command("drawer", velocity, force_limit=40,
+                                    end_time=drawer.time_sync.robot_timestamp_from_local_secs(
+                                        time.time() + 10))
+    drawer.command_client().robot_command_async(command)
+    time.sleep(2.0)
+    state = drawer.state_client().get_robot_state()
+    return time.perf_counter() - start, "slept 2 s", state
+
+
+def closed_loop(drawer, trace_path=None, **kwargs):
+    controller = ConstrainedManipulationController(drawer.command_client(),
+                                                   drawer.state_client(), drawer.time_sync,
+                                                   **kwargs)
+    start = time.perf_counter()
+    result = controller.run()
+    seconds = time.perf_counter() - start
+    if trace_path is not None:
+        result.trace.save(trace_path)
+    return seconds, result.reason, drawer.state_client().get_robot_state()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every simulated call.')
+    parser.add_argument('--trace-dir', default=None,
+                        help='Directory to save the closed loop traces to, as .npz files.')
+    options = parser.parse_args(argv)
+
+    print("{:<16}{:<14}{:>10}{:>12}{:>12}  {}".format("scenario", "run", "time (s)",
+                                                      "opened (m)", "force (N)", "stopped on"))
+    for name, drawer_args, controller_args in SCENARIOS:
+        for run in ("open loop", "closed loop"):
+            drawer = SimulatedDrawer(latency=options.latency, **drawer_args)
+            try:
+                if run == "open loop":
+                    seconds, reason, state = open_loop(drawer)
+                else:
+                    trace_path = None
+                    if options.trace_dir:
+                        os.makedirs(options.trace_dir, exist_ok=True)
+                        trace_path = os.path.join(options.trace_dir,
+                                                  name.replace(" ", "_") + ".npz")
+                    seconds, reason, state = closed_loop(drawer, trace_path, **controller_args)
+            finally:
+                drawer.shutdown()
+            force = state.manipulator_state.estimated_end_effector_force_in_hand.x
+            print("{:<16}{:<14}{:>10.2f}{:>12.3f}{:>12.1f}  {}".format(
+                name, run, seconds, drawer.opening, force, reason))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
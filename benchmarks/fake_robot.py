@@ -0,0 +1,232 @@
+"""Benchmark the robot-facing code end to end against a fake robot, without a robot.
+
+Every run starts a FakeRobotServer (utils/fake_robot.py) on localhost and drives it with the
+real SDK clients through FakeRobot:
+
+  - graph nav: GraphNavInterface uploads the map, localizes on a fiducial and navigates to a
+    waypoint, optionally with injected snapshot upload failures,
+  - seed localization: GraphNavInterface localizes to the anchored waypoint nearest to a seed
+    frame position, then to a waypoint by id, as option (3) of the command line does,
+  - fiducial tour: approach_fiducials.visit_fiducials visits the fiducials of the map,
+  - waypoint goals: four waypoints one navigate to command after the other, powering off after
+    each goal, or as one utils.mission_queue.MissionQueue,
+  - async session: utils.async_graph_nav.AsyncGraphNavSession uploads the map, localizes and
+    navigates to a waypoint while streaming the robot state in the same event loop,
+  - open drawer: open_drawer_skill, pipelined and sequential, from a standing robot.
+
+The table shows the time each run took and the number of RPCs it made. With --trace, the RPCs and
+waits of every run are traced (see utils/rpc_tracing.py), summarized and written to one Chrome
+trace file, every run in a span of its name:
+
+    python -m benchmarks.fake_robot --path maps/cit121/downloaded_graph --latency 0.005
+    python -m benchmarks.fake_robot --trace fake_robot.trace.json
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from bosdyn.client.image import ImageClient
+from bosdyn.client.lease import LeaseClient, LeaseKeepAlive
+from bosdyn.client.manipulation_api_client import ManipulationApiClient
+from bosdyn.client.robot_command import RobotCommandClient, blocking_stand
+from bosdyn.client.robot_state import RobotStateClient
+
+import approach_fiducials
+import open_drawer
+from utils.async_graph_nav import AsyncGraphNavSession
+from utils.fake_graph_nav import FakeGraphNavServicer
+from utils.fake_robot import FakeRobot, FakeRobotServer, SimulatedRobot
+from utils.graph_nav_helper import GraphNavInterface
+from utils.image_stream import ImageStream
+from utils.map_loader import get_map_loader
+from utils.mission_queue import MissionQueue
+from utils.rpc_tracing import RpcTracer
+
+
+def drawer_options(**overrides):
+    """Return the options open_drawer.main passes to the skill, with overrides."""
+    options = argparse.Namespace(force_top_down_grasp=False, force_45_angle_grasp=False,
+                                 force_squeeze_grasp=False, force_horizontal_grasp=True,
+                                 torque_limit=5.0, force_limit=40, manipulation_seconds=2.0,
+                                 travel_target=None, sequential=False, depth_grasp=False,
+                                 task_velocity=-0.5, image_source="hand_color_image",
+                                 task_type="drawer")
+    for name, value in overrides.items():
+        setattr(options, name, value)
+    return options
+
+
+def graph_nav(robot, path):
+    graph_nav_interface = GraphNavInterface(robot, path)
+    graph_nav_interface._upload_graph_and_snapshots()
+    graph_nav_interface._set_initial_localization_fiducial()
+    waypoint_id = graph_nav_interface._graph_nav_client.get_localization_state(
+    ).localization.waypoint_id
+    graph_nav_interface._navigate_to([waypoint_id])
+    graph_nav_interface._on_quit()
+
+
+def seed_localization(robot, path):
+    """Localize to a seed frame position and to a waypoint id, checking where the robot ends up."""
+    map_loader = get_map_loader(path)
+    anchor = map_loader.graph.anchoring.anchors[len(map_loader.graph.anchoring.anchors) // 2]
+    waypoint_id = map_loader.graph.waypoints[0].id
+    graph_nav_interface = GraphNavInterface(robot, path)
+    graph_nav_interface._upload_graph_and_snapshots()
+    position = anchor.seed_tform_waypoint.position
+    for args, expected in (([str(position.x + 0.1), str(position.y), "0.5"], anchor.id),
+                           ([waypoint_id], waypoint_id)):
+        graph_nav_interface._set_initial_localization_waypoint(args)
+        localized = graph_nav_interface._graph_nav_client.get_localization_state(
+        ).localization.waypoint_id
+        if localized != expected:
+            raise RuntimeError("Localized to {} instead of {}.".format(localized, expected))
+    graph_nav_interface._on_quit()
+
+
+def fiducial_tour(robot, path):
+    fiducials = sorted(get_map_loader(path).anchored_objects)
+    approach_fiducials.visit_fiducials(robot, path, fiducials)
+
+
+def waypoint_goals(robot, path, queued=False, num_goals=4):
+    """Navigate to waypoints spread over the map, one command at a time or as one mission."""
+    waypoint_ids = [waypoint.id for waypoint in get_map_loader(path).graph.waypoints]
+    goals = waypoint_ids[::max(1, len(waypoint_ids) // num_goals)][:num_goals]
+    graph_nav_interface = GraphNavInterface(robot, path)
+    graph_nav_interface._upload_graph_and_snapshots()
+    graph_nav_interface._set_initial_localization_fiducial()
+    if queued:
+        mission = MissionQueue(graph_nav_interface)
+        for waypoint_id in goals:
+            mission.add_waypoint(waypoint_id)
+        print(mission.run())
+    else:
+        for waypoint_id in goals:
+            graph_nav_interface._navigate_to([waypoint_id])
+    graph_nav_interface._on_quit()
+
+
+async def _async_navigation(robot, path, lease):
+    session = AsyncGraphNavSession.for_robot(robot)
+    map_loader = get_map_loader(path)
+    report = await session.upload(map_loader, lease=lease.lease_proto)
+    if not report.complete:
+        raise RuntimeError("Upload incomplete: {}".format(report))
+    await session.localize_fiducial()
+    if not await session.power_on():
+        raise RuntimeError("The robot did not power on.")
+    navigation = asyncio.ensure_future(session.navigate_to(map_loader.graph.waypoints[-1].id))
+    states = 0
+    async for _ in session.stream_robot_state(period=0.1):
+        states += 1
+        if navigation.done():
+            break
+    metrics = await navigation
+    await session.power_off()
+    print("{}, {} robot states streamed".format(metrics, states))
+    if not metrics.reached_goal or states < 2:
+        raise RuntimeError("The async navigation did not reach its goal while streaming states.")
+
+
+def async_session(robot, path):
+    """Navigate with an AsyncGraphNavSession while streaming the robot state."""
+    lease_client = robot.ensure_client(LeaseClient.default_service_name)
+    with LeaseKeepAlive(lease_client, must_acquire=True, return_at_exit=True):
+        asyncio.run(_async_navigation(robot, path, lease_client.lease_wallet.get_lease()))
+
+
+def open_drawer_skill(robot, sequential=False):
+    """Run the open drawer skill the way open_drawer.main does, once the robot stands."""
+    options = drawer_options(sequential=sequential)
+    lease_client = robot.ensure_client(LeaseClient.default_service_name)
+    robot_state_client = robot.ensure_client(RobotStateClient.default_service_name)
+    image_client = robot.ensure_client(ImageClient.default_service_name)
+    manipulation_api_client = robot.ensure_client(ManipulationApiClient.default_service_name)
+    command_client = robot.ensure_client(RobotCommandClient.default_service_name)
+    with LeaseKeepAlive(lease_client, must_acquire=True, return_at_exit=True):
+        blocking_stand(command_client, timeout_sec=10, update_frequency=20)
+        if sequential:
+            open_drawer.open_drawer_skill_sequential(options, None, robot, lease_client,
+                                                     robot_state_client, image_client,
+                                                     manipulation_api_client, command_client)
+            return True
+        with ImageStream(image_client, [options.image_source], max_in_flight=1,
+                         period=open_drawer.IMAGE_STREAM_PERIOD) as image_stream:
+            report = open_drawer.open_drawer_skill(options, None, robot, lease_client,
+                                                   robot_state_client, image_client,
+                                                   manipulation_api_client, command_client,
+                                                   image_stream)
+        return report.complete
+
+
+def runs(options):
+    """Return (name, server arguments, function of the FakeRobot) of every run."""
+    return [
+        ("graph nav", dict(), lambda robot: graph_nav(robot, options.path)),
+        ("graph nav, 5 failed uploads",
+         dict(failures={"UploadWaypointSnapshot": 5}),
+         lambda robot: graph_nav(robot, options.path)),
+        ("seed localization", dict(), lambda robot: seed_localization(robot, options.path)),
+        ("fiducial tour", dict(), lambda robot: fiducial_tour(robot, options.path)),
+        ("waypoint goals, one by one", dict(), lambda robot: waypoint_goals(robot, options.path)),
+        ("waypoint goals, mission queue", dict(),
+         lambda robot: waypoint_goals(robot, options.path, queued=True)),
+        ("async session", dict(), lambda robot: async_session(robot, options.path)),
+        ("open drawer, pipelined", dict(robot=SimulatedRobot(powered_on=True)),
+         lambda robot: open_drawer_skill(robot)),
+        ("open drawer, sequential", dict(robot=SimulatedRobot(powered_on=True)),
+         lambda robot: open_drawer_skill(robot, sequential=True)),
+    ]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='maps/cit121/downloaded_graph',
+                        help='Map uploaded to the fake robot.')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds added to every RPC.')
+    parser.add_argument('--navigation-seconds', type=float, default=1.0,
+                        help='Seconds every simulated navigation command takes.')
+    parser.add_argument('--trace', default=None,
+                        help='Chrome trace file to write the RPCs and waits of the runs to.')
+    options = parser.parse_args(argv)
+
+    tracer = RpcTracer() if options.trace else None
+    results = []
+    for name, server_args, run in runs(options):
+        robot_state = server_args.pop('robot', None) or SimulatedRobot()
+        graph_nav_servicer = FakeGraphNavServicer(latency=options.latency,
+                                                  navigation_duration=options.navigation_seconds,
+                                                  kinematic_state=robot_state.kinematic_state)
+        with FakeRobotServer(robot_state, graph_nav_servicer, latency=options.latency,
+                             **server_args) as server:
+            robot = FakeRobot(server.address)
+            if tracer is not None:
+                tracer.instrument_robot(robot)
+                tracer.start()
+            start = time.perf_counter()
+            try:
+                run(robot)
+            finally:
+                seconds = time.perf_counter() - start
+                robot.shutdown()
+                if tracer is not None:
+                    tracer.stop()
+                    tracer.record(name, "run", start, seconds)
+            results.append((name, seconds, sum(server.call_counts.values())))
+
+    print()
+    print("{:<30}{:>10}{:>8}".format("run", "time (s)", "RPCs"))
+    for name, seconds, calls in results:
+        print("{:<30}{:>10.2f}{:>8}".format(name, seconds, calls))
+    if tracer is not None:
+        print()
+        tracer.print_summary()
+        tracer.write_chrome_trace(options.trace)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
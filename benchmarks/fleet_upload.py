@@ -0,0 +1,87 @@
+"""Benchmark uploading a map to a fleet of simulated robots.
+
+Starts one local fake GraphNav server per robot, each adding a fixed latency to every RPC, then
+uploads the map to the robots one after another (as running the command line once per robot
+does) and with FleetUploader. With --failing, the last robots drop every snapshot upload after
+the first few, to show the retries and the summary report.
+
+    python -m benchmarks.fleet_upload --robots 8 --latency 0.1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from utils.fake_graph_nav import FakeGraphNavServer, FakeGraphNavServicer
+from utils.fleet_uploader import FleetRobot, FleetUploader
+from utils.map_loader import MapLoader
+from utils.snapshot_uploader import SnapshotUploader, UploadManifest
+
+
+def _quiet(*args):
+    pass
+
+
+def start_fleet(num_robots, latency, num_failing=0):
+    """Return started fake servers, the last num_failing of which fail snapshot uploads."""
+    servers = []
+    for i in range(num_robots):
+        failing = i >= num_robots - num_failing
+        servicer = FakeGraphNavServicer(latency=latency,
+                                        fail_snapshot_uploads_after=5 if failing else None)
+        servers.append(FakeGraphNavServer(servicer).start())
+    return servers
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', type=str, default='maps/cit121/downloaded_graph',
+                        help='Map to upload.')
+    parser.add_argument('--robots', type=int, default=8, help='Number of simulated robots.')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='Seconds added to every RPC by the simulated robots.')
+    parser.add_argument('--failing', type=int, default=0,
+                        help='Number of robots whose snapshot uploads fail.')
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        servers = start_fleet(options.robots, options.latency)
+        try:
+            manifest = UploadManifest(os.path.join(tmp_dir, "sequential.json"))
+            map_loader = MapLoader(options.path)
+            start = time.perf_counter()
+            for i, server in enumerate(servers):
+                SnapshotUploader(server.create_client(), map_loader, "robot-{}".format(i),
+                                 manifest=manifest, progress=_quiet).upload()
+            sequential = time.perf_counter() - start
+        finally:
+            for server in servers:
+                server.stop()
+
+        servers = start_fleet(options.robots, options.latency, options.failing)
+        try:
+            robots = [
+                FleetRobot("robot-{}".format(i), server.create_client())
+                for i, server in enumerate(servers)
+            ]
+            uploader = FleetUploader(MapLoader(options.path),
+                                     UploadManifest(os.path.join(tmp_dir, "fleet.json")),
+                                     max_retries=1, snapshot_retry_delay=0.05, retry_delay=0.1,
+                                     progress=_quiet)
+            start = time.perf_counter()
+            report = uploader.upload(robots)
+            fleet = time.perf_counter() - start
+        finally:
+            for server in servers:
+                server.stop()
+
+    print(report)
+    print("{:<24}{:>10}".format("upload", "time (s)"))
+    print("{:<24}{:>10.2f}".format("one robot at a time", sequential))
+    print("{:<24}{:>10.2f}".format("fleet", fleet))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
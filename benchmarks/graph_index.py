@@ -0,0 +1,110 @@
+"""Benchmark waypoint resolution and edge lookup on large synthetic graphs.
+
+Compares the original scans of graph_nav_util.find_unique_waypoint_id and
+GraphNavInterface._match_edge with the GraphIndex lookups, resolving every waypoint of a route
+by short code and matching every edge along it.
+
+    python -m benchmarks.graph_index --waypoints 10000 50000
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+
+from bosdyn.api.graph_nav import map_pb2
+
+import graph_nav_util
+
+
+def synthetic_graph(num_waypoints, extra_edges_per_waypoint=0.5, seed=0):
+    """Return a graph with a chain of waypoints plus random shortcuts between them."""
+    rng = random.Random(seed)
+    graph = map_pb2.Graph()
+    ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(num_waypoints)]
+    for i, waypoint_id in enumerate(ids):
+        waypoint = graph.waypoints.add(id=waypoint_id)
+        waypoint.annotations.name = "waypoint_{}".format(i)
+        waypoint.annotations.creation_time.seconds = i
+    for i in range(1, num_waypoints):
+        edge = graph.edges.add()
+        edge.id.from_waypoint, edge.id.to_waypoint = ids[i - 1], ids[i]
+    for _ in range(int(num_waypoints * extra_edges_per_waypoint)):
+        edge = graph.edges.add()
+        edge.id.from_waypoint, edge.id.to_waypoint = rng.sample(ids, 2)
+    return graph, ids
+
+
+def find_unique_waypoint_id_scan(short_code, graph):
+    """Short code resolution as find_unique_waypoint_id used to do it."""
+    ret = short_code
+    for waypoint in graph.waypoints:
+        if short_code == graph_nav_util.id_to_short_code(waypoint.id):
+            if ret != short_code:
+                return short_code
+            ret = waypoint.id
+    return ret
+
+
+def match_edge_scan(current_edges, waypoint1, waypoint2):
+    """Edge lookup as _match_edge used to do it."""
+    for edge_to_id in current_edges:
+        for edge_from_id in current_edges[edge_to_id]:
+            if (waypoint1 == edge_to_id) and (waypoint2 == edge_from_id):
+                return map_pb2.Edge.Id(from_waypoint=waypoint2, to_waypoint=waypoint1)
+            elif (waypoint2 == edge_to_id) and (waypoint1 == edge_from_id):
+                return map_pb2.Edge.Id(from_waypoint=waypoint1, to_waypoint=waypoint2)
+    return None
+
+
+def time_call(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--waypoints', type=int, nargs='+', default=[10000],
+                        help='Number of waypoints of each synthetic graph.')
+    parser.add_argument('--route-length', type=int, default=50,
+                        help='Number of waypoints of the route that is resolved.')
+    options = parser.parse_args(argv)
+
+    print("{:>10}{:>10}  {:<22}{:>12}{:>12}{:>10}".format("waypoints", "edges", "operation",
+                                                         "scan (ms)", "index (ms)", "speedup"))
+    for num_waypoints in options.waypoints:
+        graph, ids = synthetic_graph(num_waypoints)
+        # The end of the chain, so the scans cannot stop early.
+        route = ids[-options.route_length:]
+        short_codes = [graph_nav_util.id_to_short_code(waypoint_id) for waypoint_id in route]
+        _, current_edges = graph_nav_util.update_waypoints_and_edges(graph, None, do_print=False)
+
+        build, graph_index = time_call(lambda: graph_nav_util.GraphIndex(graph))
+        graph_nav_util.GraphIndex._last = graph_index
+        rows = []
+        scan, expected = time_call(
+            lambda: [find_unique_waypoint_id_scan(code, graph) for code in short_codes])
+        index, found = time_call(lambda: [
+            graph_nav_util.find_unique_waypoint_id(code, graph, graph_index.name_to_id)
+            for code in short_codes
+        ])
+        assert found == expected
+        rows.append(("resolve short codes", scan, index))
+        pairs = list(zip(route[:-1], route[1:]))
+        scan, expected = time_call(
+            lambda: [match_edge_scan(current_edges, a, b) for a, b in pairs])
+        index, found = time_call(lambda: [graph_index.match_edge(a, b) for a, b in pairs])
+        assert found == expected
+        rows.append(("match route edges", scan, index))
+
+        print("{:>10}{:>10}  {:<22}{:>12}{:>12.2f}".format(num_waypoints, len(graph.edges),
+                                                          "build index", "", build * 1000))
+        for name, scan, index in rows:
+            print("{:>10}{:>10}  {:<22}{:>12.2f}{:>12.3f}{:>9.0f}x".format(
+                num_waypoints, len(graph.edges), name, scan * 1000, index * 1000, scan / index))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
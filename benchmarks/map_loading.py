@@ -0,0 +1,100 @@
+"""Benchmark loading a GraphNav map from disk.
+
+Compares the original sequential parse of every snapshot with the lazy map loader (graph only,
+as used by nav_to_fiducial) and its full load (as used by load_map without the map cache), from
+the map directory and from map containers packed from it. Only the lazy path is faster: the full
+load parses the same snapshots on one thread, as protobuf parsing holds the GIL.
+
+    python -m benchmarks.map_loading --path maps/cit121/downloaded_graph
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bosdyn.api.graph_nav import map_pb2
+
+from utils.map_container import COMPRESSION_NONE, COMPRESSION_ZLIB, pack_map
+from utils.map_loader import MapLoader
+
+
+def load_map_sequential(path):
+    """Parse the graph and every snapshot one after another, like load_map used to."""
+    with open(os.path.join(path, "graph"), "rb") as graph_file:
+        graph = map_pb2.Graph()
+        graph.ParseFromString(graph_file.read())
+    waypoint_snapshots = {}
+    for waypoint in graph.waypoints:
+        file_name = os.path.join(path, "waypoint_snapshots", waypoint.snapshot_id)
+        if not waypoint.snapshot_id or not os.path.exists(file_name):
+            continue
+        with open(file_name, "rb") as snapshot_file:
+            waypoint_snapshot = map_pb2.WaypointSnapshot()
+            waypoint_snapshot.ParseFromString(snapshot_file.read())
+            waypoint_snapshots[waypoint_snapshot.id] = waypoint_snapshot
+    edge_snapshots = {}
+    for edge in graph.edges:
+        file_name = os.path.join(path, "edge_snapshots", edge.snapshot_id)
+        if not edge.snapshot_id or not os.path.exists(file_name):
+            continue
+        with open(file_name, "rb") as snapshot_file:
+            edge_snapshot = map_pb2.EdgeSnapshot()
+            edge_snapshot.ParseFromString(snapshot_file.read())
+            edge_snapshots[edge_snapshot.id] = edge_snapshot
+    return graph, waypoint_snapshots, edge_snapshots
+
+
+def load_map_lazy(path):
+    """Parse only the graph."""
+    return MapLoader(path)
+
+
+def load_map_full(path):
+    """Parse the graph and every snapshot through the map loader."""
+    map_loader = MapLoader(path)
+    map_loader.load_all()
+    return map_loader
+
+
+def time_call(func, repeat):
+    """Return the best wall clock time of repeat calls to func, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', type=str, default='maps/cit121/downloaded_graph',
+                        help='Map to load.')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of runs per loader.')
+    options = parser.parse_args(argv)
+
+    sequential = time_call(lambda: load_map_sequential(options.path), options.repeat)
+    results = [("sequential", sequential)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sources = [("", options.path)]
+        for compression in (COMPRESSION_NONE, COMPRESSION_ZLIB):
+            container = os.path.join(tmp_dir, "map_{}.gnmap".format(compression))
+            sources.append((", {} container".format(compression),
+                            pack_map(options.path, container, compression)))
+        for suffix, path in sources:
+            results.append(("lazy (graph only{})".format(suffix),
+                            time_call(lambda: load_map_lazy(path), options.repeat)))
+            results.append(("full (all{})".format(suffix),
+                            time_call(lambda: load_map_full(path), options.repeat)))
+
+    print("{:<36}{:>12}{:>10}".format("loader", "best (ms)", "speedup"))
+    for name, seconds in results:
+        print("{:<36}{:>12.2f}{:>9.1f}x".format(name, seconds * 1000, sequential / seconds))
+    print("Only the lazy loads save time; a full load parses every snapshot on one thread, "
+          "like the sequential one, and from a zlib container also decompresses each of them.")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
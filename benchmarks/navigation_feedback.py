@@ -0,0 +1,66 @@
+"""Benchmark how quickly a finished navigation goal is noticed, against a simulated GraphNav.
+
+Compares the original loop (1 s command, sleep 0.5 s, then poll the feedback) with
+NavigationDriver. For each goal the simulated service reaches STATUS_REACHED_GOAL after a given
+duration; the detection latency is the time between that moment and the client returning.
+
+    python -m benchmarks.navigation_feedback
+"""
+import argparse
+import sys
+import time
+
+from bosdyn.api.graph_nav import graph_nav_pb2
+
+from utils.fake_graph_nav import FakeGraphNavServer, FakeGraphNavServicer
+from utils.navigation_driver import NavigationDriver
+
+
+def navigate_to_sleep_loop(graph_nav_client, destination_waypoint):
+    """The original navigation loop, returning (commands, feedback polls)."""
+    nav_to_cmd_id = None
+    commands = 0
+    polls = 0
+    is_finished = False
+    while not is_finished:
+        nav_to_cmd_id = graph_nav_client.navigate_to(destination_waypoint, 1.0,
+                                                     command_id=nav_to_cmd_id)
+        commands += 1
+        time.sleep(.5)
+        status = graph_nav_client.navigation_feedback(nav_to_cmd_id).status
+        polls += 1
+        is_finished = status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_REACHED_GOAL
+    return commands, polls
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[1.3, 2.7, 4.1, 6.2],
+                        help='Seconds each simulated goal takes.')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Simulated RPC latency in seconds.')
+    options = parser.parse_args(argv)
+
+    print("{:<14}{:>10}{:>14}{:>10}{:>8}".format("loop", "goal (s)", "latency (ms)", "commands",
+                                                 "polls"))
+    for duration in options.durations:
+        servicer = FakeGraphNavServicer(latency=options.latency, navigation_duration=duration)
+        with FakeGraphNavServer(servicer) as server:
+            graph_nav_client = server.create_client()
+
+            commands, polls = navigate_to_sleep_loop(graph_nav_client, "waypoint")
+            latency = time.time() - servicer.navigation_end_times[1]
+            print("{:<14}{:>10.1f}{:>14.0f}{:>10}{:>8}".format("sleep 0.5 s", duration,
+                                                               latency * 1000, commands, polls))
+
+            metrics = NavigationDriver(graph_nav_client).navigate_to("waypoint")
+            latency = metrics.end_time - servicer.navigation_end_times[2]
+            print("{:<14}{:>10.1f}{:>14.0f}{:>10}{:>8}".format("driver", duration,
+                                                               latency * 1000,
+                                                               metrics.commands_sent,
+                                                               metrics.feedback_polls))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,50 @@
+"""Benchmark building the merged point cloud of a map.
+
+Processes the waypoint snapshots of the map, and of a replicated copy of it with about a thousand
+waypoints, in this process and in a process pool.
+
+    python -m benchmarks.point_cloud --path maps/cit121/downloaded_graph --factor 34
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_map import replicate_map
+from utils.map_loader import MapLoader
+from utils.point_cloud import build_map_cloud
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', type=str, default='maps/cit121/downloaded_graph',
+                        help='Map to process.')
+    parser.add_argument('--factor', type=int, default=34,
+                        help='Number of copies of the map in the replicated map.')
+    parser.add_argument('--voxel-size', type=float, default=0.05, help='Voxel size in meters.')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Processes used by the process pool.')
+    options = parser.parse_args(argv)
+
+    print("cpus: {}".format(os.cpu_count()))
+    print("{:>10}  {:<14}{:>12}{:>12}".format("waypoints", "processing", "time (s)", "points"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [options.path]
+        if options.factor > 1:
+            paths.append(replicate_map(options.path, options.factor,
+                                       os.path.join(tmp_dir, "replicated")))
+        for path in paths:
+            num_waypoints = len(MapLoader(path).graph.waypoints)
+            for name, max_workers in (("in process", 1), ("process pool", options.max_workers)):
+                map_loader = MapLoader(path)
+                start = time.perf_counter()
+                cloud = build_map_cloud(path, options.voxel_size, max_workers, map_loader)
+                seconds = time.perf_counter() - start
+                print("{:>10}  {:<14}{:>12.2f}{:>12}".format(num_waypoints, name, seconds,
+                                                            len(cloud)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
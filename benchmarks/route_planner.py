@@ -0,0 +1,84 @@
+"""Benchmark planning routes on large synthetic anchored graphs.
+
+Plans a patrol through random stops of a grid shaped map with Dijkstra, with A* and, for the
+repeated patrol, from the planner's cache. All must find routes of the same cost.
+
+    python -m benchmarks.route_planner --side 100 --stops 20
+"""
+import argparse
+import random
+import sys
+import time
+
+from bosdyn.api.graph_nav import map_pb2
+
+from utils.route_planner import RoutePlanner
+
+
+def grid_graph(side, drop_fraction=0.2, seed=0):
+    """Return an anchored side x side grid of waypoints 1m apart, with some edges missing."""
+    rng = random.Random(seed)
+    graph = map_pb2.Graph()
+    ids = [["waypoint-{}-{}".format(row, col) for col in range(side)] for row in range(side)]
+    for row in range(side):
+        for col in range(side):
+            graph.waypoints.add(id=ids[row][col])
+            anchor = graph.anchoring.anchors.add(id=ids[row][col])
+            anchor.seed_tform_waypoint.position.x = col + rng.uniform(-0.2, 0.2)
+            anchor.seed_tform_waypoint.position.y = row + rng.uniform(-0.2, 0.2)
+            anchor.seed_tform_waypoint.rotation.w = 1.0
+    for row in range(side):
+        for col in range(side):
+            for next_row, next_col in ((row + 1, col), (row, col + 1)):
+                # Keep the first row and column complete so the graph stays connected.
+                if next_row >= side or next_col >= side or (
+                        row and col and rng.random() < drop_fraction):
+                    continue
+                edge = graph.edges.add()
+                edge.id.from_waypoint = ids[row][col]
+                edge.id.to_waypoint = ids[next_row][next_col]
+                edge.annotations.cost.value = 1.0 + rng.uniform(0.0, 0.5)
+    return graph, [waypoint_id for row in ids for waypoint_id in row]
+
+
+def plan_patrol(planner, stops):
+    start = time.perf_counter()
+    cost = sum(planner.plan_waypoints(a, b)[1] for a, b in zip(stops[:-1], stops[1:]))
+    return time.perf_counter() - start, cost
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--side', type=int, nargs='+', default=[100],
+                        help='Number of waypoints per side of each grid.')
+    parser.add_argument('--stops', type=int, default=20, help='Number of stops of the patrol.')
+    options = parser.parse_args(argv)
+
+    print("{:>10}  {:<28}{:>12}{:>12}".format("waypoints", "planner", "time (ms)", "cost"))
+    for side in options.side:
+        graph, ids = grid_graph(side)
+        stops = random.Random(1).sample(ids, options.stops)
+        stops.append(stops[0])
+
+        dijkstra = RoutePlanner(graph)
+        dijkstra.heuristic_scale = 0.0
+        astar = RoutePlanner(graph)
+        rows = [("dijkstra", ) + plan_patrol(dijkstra, stops),
+                ("a*", ) + plan_patrol(astar, stops),
+                ("a*, repeated patrol", ) + plan_patrol(astar, stops)]
+        start = time.perf_counter()
+        trees = RoutePlanner(graph)
+        trees.precompute(stops)
+        rows.append(("shortest path trees of stops", time.perf_counter() - start, None))
+        rows.append(("from the trees", ) + plan_patrol(trees, stops))
+
+        for name, seconds, cost in rows:
+            print("{:>10}  {:<28}{:>12.2f}{:>12}".format(
+                len(ids), name, seconds * 1000, "{:.2f}".format(cost) if cost else ""))
+        costs = [cost for _, _, cost in rows if cost is not None]
+        assert max(costs) - min(costs) < 1e-6, costs
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
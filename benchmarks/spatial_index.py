@@ -0,0 +1,59 @@
+"""Benchmark nearest anchor queries against a linear scan of the anchors.
+
+    python -m benchmarks.spatial_index --anchors 1000 100000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.spatial_index import SpatialIndex
+
+
+def nearest_scan(ids, positions, x, y):
+    """Nearest anchor as found by looping over every anchor."""
+    best_id, best_distance = None, float("inf")
+    for anchor_id, (anchor_x, anchor_y) in zip(ids, positions):
+        distance = ((anchor_x - x)**2 + (anchor_y - y)**2)**0.5
+        if distance < best_distance:
+            best_id, best_distance = anchor_id, distance
+    return best_id
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--anchors', type=int, nargs='+', default=[1000, 100000],
+                        help='Number of anchors of each synthetic map.')
+    parser.add_argument('--queries', type=int, default=100, help='Number of nearest queries.')
+    options = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    print("{:>10}{:>12}{:>14}{:>12}{:>10}".format("anchors", "build (ms)", "scan (ms/q)",
+                                                  "grid (ms/q)", "speedup"))
+    for num_anchors in options.anchors:
+        # Waypoints are about a meter apart, so the map grows with the square root of their number.
+        side = num_anchors**0.5
+        positions = rng.uniform(0, side, size=(num_anchors, 2))
+        ids = ["anchor-{}".format(i) for i in range(num_anchors)]
+        queries = rng.uniform(0, side, size=(options.queries, 2))
+        position_list = positions.tolist()
+
+        start = time.perf_counter()
+        spatial_index = SpatialIndex(ids, positions)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = [nearest_scan(ids, position_list, x, y) for x, y in queries]
+        scan = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        found = [spatial_index.nearest(x, y)[0][0] for x, y in queries]
+        grid = (time.perf_counter() - start) / len(queries)
+        assert found == expected
+        print("{:>10}{:>12.2f}{:>14.3f}{:>12.3f}{:>9.0f}x".format(num_anchors, build * 1000,
+                                                                  scan * 1000, grid * 1000,
+                                                                  scan / grid))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,262 @@
+"""End-to-end benchmark suite over the cit121 map and synthetic maps 10 and 100 times its size.
+
+Times, at every map scale (see benchmarks/synthetic_map.py):
+
+  - load_map: approach_fiducials.load_map parsing the graph and every snapshot, without the map
+    cache; the graph file is touched before every repeat so the shared loader parses it again,
+  - upload: SnapshotUploader sending the whole map to a new FakeGraphNavServer,
+  - waypoint tables: graph_nav_util.update_waypoints_and_edges on a graph it has not indexed,
+  - short codes: find_unique_waypoint_id resolving the short code of every waypoint,
+  - route: a new RoutePlanner planning from the first waypoint to the last, and build_route,
+  - approach poses: free_approach_pose of every anchored fiducial against the map's costmap,
+
+and open_drawer.best_red on synthetic 640x480 frames. Every case runs --warmup times untimed,
+then --repeat times; the results are written as JSON with the median, minimum and maximum
+seconds of every case, and the threshold it is allowed to regress by, set per case: looser for
+the disk and gRPC bound load_map and upload, tight for the in-memory lookups. With --baseline, each median is compared to the baseline's
+and the suite fails (exit status 1) when one is above threshold times the baseline median plus
+--noise seconds:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --output results.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from bosdyn.api.graph_nav import map_pb2
+from bosdyn.client.graph_nav import GraphNavClient
+
+import approach_fiducials
+import graph_nav_util
+import open_drawer
+from benchmarks.color_detector import synthetic_frame
+from benchmarks.synthetic_map import replicate_map
+from utils.costmap import Costmap
+from utils.fake_graph_nav import FakeGraphNavServer, FakeGraphNavServicer
+from utils.map_cache import MapCache
+from utils.map_loader import get_map_loader
+from utils.route_planner import RoutePlanner
+from utils.snapshot_uploader import SnapshotUploader, UploadManifest
+
+
+class Case(object):
+    """One timed operation.
+
+    params:
+    + name: name of the case in the results
+    + run: function of the value returned by setup, the only part timed
+    + setup (optional): function called before every repeat, returning run's argument
+    + teardown (optional): function of the value returned by setup, called after every repeat
+    + threshold (optional): ratio to its baseline median above which the case regressed
+    """
+
+    def __init__(self, name, run, setup=None, teardown=None, threshold=None):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.teardown = teardown or (lambda value: None)
+        self.threshold = threshold
+
+    def measure(self, repeat, warmup=1):
+        """Return the seconds of repeat runs, after warmup runs that are not timed."""
+        times = []
+        for _ in range(warmup + repeat):
+            value = self.setup()
+            try:
+                # The code under test prints progress, which would add terminal time.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    self.run(value)
+                    times.append(time.perf_counter() - start)
+            finally:
+                self.teardown(value)
+        return times[warmup:]
+
+
+def _copy_graph(graph):
+    # A new object, so the indexes cached for the loaded graph are not reused.
+    copy = map_pb2.Graph()
+    copy.CopyFrom(graph)
+    return copy
+
+
+def map_cases(path, tmp_dir):
+    """Return the cases of the map at path; tmp_dir holds the fake robots' upload manifests."""
+    map_loader = get_map_loader(path)
+    graph = map_loader.graph
+    graph_file = os.path.join(path, "graph")
+    waypoint_ids = [waypoint.id for waypoint in graph.waypoints]
+    name_to_id, _ = graph_nav_util.update_waypoints_and_edges(graph, None, do_print=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        costmap = Costmap.for_map(path)
+        map_index = MapCache(path).get(map_loader)
+    fiducials = sorted(map_loader.anchored_objects)
+    uploads = iter(range(1000000))
+
+    def touch_graph():
+        # A new modification time makes the shared MapLoader stale.
+        now = time.time_ns()
+        os.utime(graph_file, ns=(now, now))
+
+    def start_server():
+        manifest = UploadManifest(os.path.join(tmp_dir, "upload-{}.json".format(next(uploads))))
+        return FakeGraphNavServer(FakeGraphNavServicer()).start(), manifest
+
+    def upload(value):
+        server, manifest = value
+        SnapshotUploader(server.create_client(), get_map_loader(path), "fake-robot",
+                         manifest=manifest, progress=lambda *args: None).upload()
+
+    def resolve_short_codes(_):
+        for waypoint_id in waypoint_ids:
+            short_code = graph_nav_util.id_to_short_code(waypoint_id) or waypoint_id
+            graph_nav_util.find_unique_waypoint_id(short_code, graph, name_to_id)
+
+    def build_route(graph_copy):
+        route_waypoints, route_edges = RoutePlanner.for_graph(graph_copy).plan(
+            waypoint_ids[0], waypoint_ids[-1])
+        GraphNavClient.build_route(route_waypoints, route_edges)
+
+    def approach_poses(_):
+        for fiducial in fiducials:
+            approach_fiducials.free_approach_pose(map_index, fiducial, costmap)
+
+    # Thresholds: the disk and gRPC bound cases vary most from run to run, the in-memory lookups
+    # least.
+    return [
+        Case("load_map", lambda _: approach_fiducials.load_map(path, use_cache=False),
+             setup=touch_graph, threshold=1.75),
+        Case("upload", upload, setup=start_server, teardown=lambda value: value[0].stop(),
+             threshold=2.0),
+        Case("waypoint tables",
+             lambda graph_copy: graph_nav_util.update_waypoints_and_edges(graph_copy, None,
+                                                                          do_print=False),
+             setup=lambda: _copy_graph(graph), threshold=1.25),
+        Case("short codes", resolve_short_codes, threshold=1.25),
+        Case("route", build_route, setup=lambda: _copy_graph(graph), threshold=1.3),
+        Case("approach poses", approach_poses, threshold=1.3),
+    ]
+
+
+def frame_cases(frames=10):
+    images = [synthetic_frame(480, 640, seed) for seed in range(frames)]
+
+    def best_red(_):
+        for image in images:
+            open_drawer.best_red(image)
+
+    return [Case("best_red x{}".format(frames), best_red, threshold=1.25)]
+
+
+def compare(results, baseline, default_threshold, noise):
+    """Add the baseline median, ratio and status of every result found in the baseline.
+
+    Returns the names of the results that regressed.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            result["status"] = "new"
+            continue
+        threshold = previous.get("threshold") or default_threshold
+        result["baseline_median"] = previous["median"]
+        result["ratio"] = result["median"] / previous["median"] if previous["median"] else None
+        if result["median"] > threshold * previous["median"] + noise:
+            result["status"] = "regressed"
+            regressions.append(name)
+        else:
+            result["status"] = "ok"
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='maps/cit121/downloaded_graph',
+                        help='Map the synthetic maps are replicated from.')
+    parser.add_argument('--factors', type=int, nargs='+', default=[1, 10, 100],
+                        help='Sizes of the synthetic maps, in copies of the map.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of every case.')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Runs of every case before the timed ones.')
+    parser.add_argument('--cases', nargs='+', default=None,
+                        help='Only run the cases whose name starts with one of these.')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to.')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON results of a previous run to check for regressions.')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='Ratio to the baseline median above which a case regressed, for '
+                        'cases the baseline has no threshold for.')
+    parser.add_argument('--noise', type=float, default=0.002,
+                        help='Seconds a case may be slower than its threshold allows.')
+    options = parser.parse_args(argv)
+
+    def selected(case_name):
+        return options.cases is None or any(case_name.startswith(prefix)
+                                            for prefix in options.cases)
+
+    results = dict()
+
+    def record(name, case, **info):
+        times = case.measure(options.repeat, options.warmup)
+        results[name] = dict(median=statistics.median(times), min=min(times), max=max(times),
+                             repeat=options.repeat, threshold=case.threshold or options.threshold,
+                             **info)
+        print("{:<28}{:>12.2f}{:>12.2f}".format(name, 1000 * results[name]["median"],
+                                                1000 * results[name]["min"]))
+
+    print("{:<28}{:>12}{:>12}".format("case", "median (ms)", "min (ms)"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for factor in options.factors:
+            # Every scale, the original map included, is a copy so touching it is harmless.
+            path = replicate_map(options.path, factor, os.path.join(tmp_dir, "x{}".format(factor)))
+            num_waypoints = len(get_map_loader(path).graph.waypoints)
+            cases = [case for case in map_cases(path, tmp_dir) if selected(case.name)]
+            for case in cases:
+                record("{} x{}".format(case.name, factor), case, factor=factor,
+                       waypoints=num_waypoints)
+        for case in frame_cases():
+            if selected(case.name):
+                record(case.name, case)
+
+    regressions = []
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.threshold, options.noise)
+        print()
+        print("{:<28}{:>14}{:>12}{:>8}  {}".format("case", "baseline (ms)", "median (ms)",
+                                                   "ratio", "status"))
+        for name, result in results.items():
+            if "baseline_median" not in result:
+                print("{:<28}{:>14}{:>12.2f}{:>8}  {}".format(name, "-",
+                                                              1000 * result["median"], "-",
+                                                              result["status"]))
+                continue
+            print("{:<28}{:>14.2f}{:>12.2f}{:>8.2f}  {}".format(
+                name, 1000 * result["baseline_median"], 1000 * result["median"],
+                result["ratio"] or 0.0, result["status"]))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(dict(created=datetime.datetime.now().isoformat(timespec="seconds"),
+                           python=platform.python_version(), platform=platform.platform(),
+                           map=options.path, results=results), f, indent=2, sort_keys=True)
+    if regressions:
+        print("Regressed: {}".format(", ".join(regressions)))
+    return not regressions
+
+
+if __name__ == '__main__':
+    if not main(sys.argv[1:]):
+        sys.exit(1)
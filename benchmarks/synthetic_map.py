@@ -0,0 +1,153 @@
+"""Build large synthetic GraphNav maps by replicating a recorded one.
+
+replicate_map writes factor copies of a map side by side along the seed frame x axis, each copy
+joined to the previous one by an edge, so the result is a single connected, anchored map with
+real snapshots. Fiducials are renumbered in every copy, in the anchored objects and in the
+apriltags the waypoint snapshots saw, so each copy's fiducials are found in its own snapshots:
+
+    python -m benchmarks.synthetic_map --path maps/cit121/downloaded_graph --factor 10 \
+        --output /tmp/cit121_x10
+"""
+import argparse
+import os
+import sys
+
+from bosdyn.api.graph_nav import map_pb2
+from bosdyn.client.math_helpers import SE3Pose
+
+from utils.map_loader import EDGE_SNAPSHOT_DIR, WAYPOINT_SNAPSHOT_DIR, MapLoader
+
+
+def _copy_id(original_id, copy):
+    return original_id if copy == 0 else "{}-copy{}".format(original_id, copy)
+
+
+def _copy_object_id(original_id, copy):
+    # Fiducial ids are numbers, keep them numbers.
+    if copy and original_id.isdigit():
+        return str(int(original_id) + 1000 * copy)
+    return _copy_id(original_id, copy)
+
+
+def _rename_frame(transforms_snapshot, old_name, new_name):
+    edges = transforms_snapshot.child_to_parent_edge_map
+    if old_name in edges:
+        edges[new_name].CopyFrom(edges[old_name])
+        del edges[old_name]
+    for edge in edges.values():
+        if edge.parent_frame_name == old_name:
+            edge.parent_frame_name = new_name
+
+
+def _copy_fiducials(waypoint_snapshot, copy):
+    """Renumber the apriltags of a waypoint snapshot like the anchored objects of the copy."""
+    for world_object in waypoint_snapshot.objects:
+        if not world_object.HasField("apriltag_properties"):
+            continue
+        properties = world_object.apriltag_properties
+        old_id = str(properties.tag_id)
+        new_id = _copy_object_id(old_id, copy)
+        if new_id == old_id:
+            continue
+        properties.tag_id = int(new_id)
+        world_object.name = world_object.name.replace(old_id, new_id)
+        for field in ("frame_name_fiducial", "frame_name_fiducial_filtered"):
+            old_name = getattr(properties, field)
+            if old_name:
+                new_name = old_name.replace(old_id, new_id)
+                setattr(properties, field, new_name)
+                _rename_frame(world_object.transforms_snapshot, old_name, new_name)
+
+
+def _copy_snapshots(snapshots, output, directory, message_type, factor):
+    os.makedirs(os.path.join(output, directory), exist_ok=True)
+    for snapshot_id in snapshots:
+        original = message_type()
+        original.ParseFromString(snapshots.raw(snapshot_id))
+        for copy in range(factor):
+            snapshot = message_type()
+            snapshot.CopyFrom(original)
+            snapshot.id = _copy_id(snapshot_id, copy)
+            if message_type is map_pb2.WaypointSnapshot:
+                _copy_fiducials(snapshot, copy)
+            with open(os.path.join(output, directory, snapshot.id), "wb") as f:
+                f.write(snapshot.SerializeToString())
+
+
+def replicate_map(path, factor, output, gap=2.0):
+    """Write factor copies of the map at path into output and return the output path.
+
+    params:
+    + path: root directory of the map to replicate
+    + factor: number of copies
+    + output: directory the new map is written to
+    + gap (optional): meters between the bounding boxes of consecutive copies
+    """
+    map_loader = MapLoader(path)
+    source = map_loader.graph
+    xs = [anchor.seed_tform_waypoint.position.x for anchor in source.anchoring.anchors]
+    offset = (max(xs) - min(xs) + gap) if xs else gap
+
+    graph = map_pb2.Graph()
+    for copy in range(factor):
+        for waypoint in source.waypoints:
+            new_waypoint = graph.waypoints.add()
+            new_waypoint.CopyFrom(waypoint)
+            new_waypoint.id = _copy_id(waypoint.id, copy)
+            if waypoint.snapshot_id:
+                new_waypoint.snapshot_id = _copy_id(waypoint.snapshot_id, copy)
+        for edge in source.edges:
+            new_edge = graph.edges.add()
+            new_edge.CopyFrom(edge)
+            new_edge.id.from_waypoint = _copy_id(edge.id.from_waypoint, copy)
+            new_edge.id.to_waypoint = _copy_id(edge.id.to_waypoint, copy)
+            if edge.snapshot_id:
+                new_edge.snapshot_id = _copy_id(edge.snapshot_id, copy)
+        for anchor in source.anchoring.anchors:
+            new_anchor = graph.anchoring.anchors.add()
+            new_anchor.CopyFrom(anchor)
+            new_anchor.id = _copy_id(anchor.id, copy)
+            new_anchor.seed_tform_waypoint.position.x += copy * offset
+        for anchored_object in source.anchoring.objects:
+            new_object = graph.anchoring.objects.add()
+            new_object.CopyFrom(anchored_object)
+            new_object.id = _copy_object_id(anchored_object.id, copy)
+            new_object.seed_tform_object.position.x += copy * offset
+
+    # Join consecutive copies through their first anchored waypoint.
+    if source.anchoring.anchors:
+        anchor = source.anchoring.anchors[0]
+        seed_tform_waypoint = SE3Pose.from_proto(anchor.seed_tform_waypoint)
+        for copy in range(1, factor):
+            seed_tform_next = SE3Pose.from_proto(anchor.seed_tform_waypoint)
+            seed_tform_next.x += offset
+            edge = graph.edges.add()
+            edge.id.from_waypoint = _copy_id(anchor.id, copy - 1)
+            edge.id.to_waypoint = _copy_id(anchor.id, copy)
+            edge.from_tform_to.CopyFrom((seed_tform_waypoint.inverse() * seed_tform_next).to_proto())
+            edge.annotations.cost.value = offset
+
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, "graph"), "wb") as f:
+        f.write(graph.SerializeToString())
+    _copy_snapshots(map_loader.waypoint_snapshots, output, WAYPOINT_SNAPSHOT_DIR,
+                    map_pb2.WaypointSnapshot, factor)
+    _copy_snapshots(map_loader.edge_snapshots, output, EDGE_SNAPSHOT_DIR, map_pb2.EdgeSnapshot,
+                    factor)
+    return output
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', type=str, default='maps/cit121/downloaded_graph',
+                        help='Map to replicate.')
+    parser.add_argument('--factor', type=int, default=10, help='Number of copies.')
+    parser.add_argument('--output', type=str, required=True, help='Directory of the new map.')
+    options = parser.parse_args(argv)
+    replicate_map(options.path, options.factor, options.output)
+    MapLoader(options.output).print_summary()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -6,6 +6,8 @@
 
 """Graph nav utility functions"""
 
+from bosdyn.api.graph_nav import map_pb2
+
 
 def id_to_short_code(id):
     """Convert a unique id to a 2 letter short code."""
@@ -39,98 +41,135 @@ def find_unique_waypoint_id(short_code, graph, name_to_id):
                 # Has an associated waypoint id!
                 return name_to_id[short_code]
             else:
-                print("The waypoint name %s is used for multiple different unique waypoints. Please use" + \
-                        "the waypoint id." % (short_code))
+                print(("The waypoint name %s is used for multiple different unique waypoints. Please use " + \
+                        "the waypoint id.") % (short_code))
                 return None
         # Also not a waypoint annotation name, so we will operate under the assumption that it is a
         # unique waypoint id.
         return short_code
 
-    ret = short_code
-    for waypoint in graph.waypoints:
-        if short_code == id_to_short_code(waypoint.id):
-            if ret != short_code:
-                return short_code  # Multiple waypoints with same short code.
-            ret = waypoint.id
-    return ret
+    waypoint_ids = GraphIndex.for_graph(graph).short_code_to_ids.get(short_code, [])
+    if len(waypoint_ids) != 1:
+        return short_code  # No or multiple waypoints with same short code.
+    return waypoint_ids[0]
 
 
 def update_waypoints_and_edges(graph, localization_id, do_print=True):
     """Update and print waypoint ids and edge ids."""
-    name_to_id = dict()
-    edges = dict()
-
-    short_code_to_count = {}
-    waypoint_to_timestamp = []
-    for waypoint in graph.waypoints:
-        # Determine the timestamp that this waypoint was created at.
-        timestamp = -1.0
-        try:
-            timestamp = waypoint.annotations.creation_time.seconds + waypoint.annotations.creation_time.nanos / 1e9
-        except:
-            # Must be operating on an older graph nav map, since the creation_time is not
-            # available within the waypoint annotations message.
-            pass
-        waypoint_to_timestamp.append((waypoint.id, timestamp, waypoint.annotations.name))
-
-        # Determine how many waypoints have the same short code.
-        short_code = id_to_short_code(waypoint.id)
-        if short_code not in short_code_to_count:
-            short_code_to_count[short_code] = 0
-        short_code_to_count[short_code] += 1
-
-        # Add the annotation name/id into the current dictionary.
-        waypoint_name = waypoint.annotations.name
-        if waypoint_name:
-            if waypoint_name in name_to_id:
-                # Waypoint name is used for multiple different waypoints, so set the waypoint id
-                # in this dictionary to None to avoid confusion between two different waypoints.
-                name_to_id[waypoint_name] = None
-            else:
-                # First time we have seen this waypoint annotation name. Add it into the dictionary
-                # with the respective waypoint unique id.
-                name_to_id[waypoint_name] = waypoint.id
-
-    # Sort the set of waypoints by their creation timestamp. If the creation timestamp is unavailable,
-    # fallback to sorting by annotation name.
-    waypoint_to_timestamp = sorted(waypoint_to_timestamp, key=lambda x: (x[1], x[2]))
+    graph_index = GraphIndex.for_graph(graph)
 
     # Print out the waypoints name, id, and short code in an ordered sorted by the timestamp from
     # when the waypoint was created.
     if do_print:
         print('%d waypoints:' % len(graph.waypoints))
-        for waypoint in waypoint_to_timestamp:
-            pretty_print_waypoints(waypoint[0], waypoint[2], short_code_to_count, localization_id)
-
-    for edge in graph.edges:
-        if edge.id.to_waypoint in edges:
-            if edge.id.from_waypoint not in edges[edge.id.to_waypoint]:
-                edges[edge.id.to_waypoint].append(edge.id.from_waypoint)
-        else:
-            edges[edge.id.to_waypoint] = [edge.id.from_waypoint]
-        if do_print:
+        for waypoint in graph_index.waypoints_chrono:
+            pretty_print_waypoints(waypoint[0], waypoint[2], graph_index.short_code_to_count,
+                                   localization_id)
+        for edge in graph.edges:
             print("(Edge) from waypoint {} to waypoint {} (cost {})".format(
                 edge.id.from_waypoint, edge.id.to_waypoint, edge.annotations.cost.value))
 
-    return name_to_id, edges
+    # The index is shared by every caller of the same graph, so hand out copies of its tables.
+    return dict(graph_index.name_to_id), {
+        to_waypoint: list(from_waypoints)
+        for to_waypoint, from_waypoints in graph_index.to_waypoint_to_from_waypoints.items()
+    }
 
 
 def sort_waypoints_chrono(graph):
     """Sort waypoints by time created."""
-    waypoint_to_timestamp = []
-    for waypoint in graph.waypoints:
-        # Determine the timestamp that this waypoint was created at.
-        timestamp = -1.0
-        try:
-            timestamp = waypoint.annotations.creation_time.seconds + waypoint.annotations.creation_time.nanos / 1e9
-        except:
-            # Must be operating on an older graph nav map, since the creation_time is not
-            # available within the waypoint annotations message.
-            pass
-        waypoint_to_timestamp.append((waypoint.id, timestamp, waypoint.annotations.name))
-
-    # Sort the set of waypoints by their creation timestamp. If the creation timestamp is unavailable,
-    # fallback to sorting by annotation name.
-    waypoint_to_timestamp = sorted(waypoint_to_timestamp, key=lambda x: (x[1], x[2]))
-
-    return waypoint_to_timestamp
+    return list(GraphIndex.for_graph(graph).waypoints_chrono)
+
+
+class GraphIndex(object):
+    """Lookup tables of a map_pb2.Graph, built once per graph.
+
+    Waypoint ids, short codes and annotation names resolve in O(1), and the edge between two
+    waypoints is found in O(1) whichever direction it was recorded in. Use GraphIndex.for_graph
+    to reuse the index of the last graph instead of rebuilding it.
+    """
+
+    # The most recently built index, returned again by for_graph for the same graph.
+    _last = None
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._size = (len(graph.waypoints), len(graph.edges))
+        self.waypoints = dict()  # maps waypoint id to waypoint
+        self.short_code_to_ids = dict()  # maps short code to list(waypoint id)
+        # Maps annotation name to waypoint id, or to None if several waypoints share the name.
+        self.name_to_id = dict()
+        # Maps waypoint id to its neighbors, whatever the direction of the edge.
+        self.adjacency = dict()
+        # Maps (waypoint id, waypoint id) in both orders to the edge between them.
+        self.edges = dict()
+        # Maps to_waypoint to list(from_waypoint), as returned by update_waypoints_and_edges.
+        self.to_waypoint_to_from_waypoints = dict()
+
+        waypoint_to_timestamp = []
+        for waypoint in graph.waypoints:
+            self.waypoints[waypoint.id] = waypoint
+            self.adjacency.setdefault(waypoint.id, set())
+            self.short_code_to_ids.setdefault(id_to_short_code(waypoint.id), []).append(waypoint.id)
+
+            # Determine the timestamp that this waypoint was created at.
+            timestamp = -1.0
+            try:
+                timestamp = waypoint.annotations.creation_time.seconds + waypoint.annotations.creation_time.nanos / 1e9
+            except:
+                # Must be operating on an older graph nav map, since the creation_time is not
+                # available within the waypoint annotations message.
+                pass
+            waypoint_to_timestamp.append((waypoint.id, timestamp, waypoint.annotations.name))
+
+            waypoint_name = waypoint.annotations.name
+            if waypoint_name:
+                if waypoint_name in self.name_to_id:
+                    # Waypoint name is used for multiple different waypoints, so set the waypoint id
+                    # to None to avoid confusion between two different waypoints.
+                    self.name_to_id[waypoint_name] = None
+                else:
+                    self.name_to_id[waypoint_name] = waypoint.id
+
+        # Sort the set of waypoints by their creation timestamp. If the creation timestamp is
+        # unavailable, fallback to sorting by annotation name.
+        self.waypoints_chrono = sorted(waypoint_to_timestamp, key=lambda x: (x[1], x[2]))
+
+        for edge in graph.edges:
+            from_waypoint, to_waypoint = edge.id.from_waypoint, edge.id.to_waypoint
+            # An edge recorded in the requested direction wins over the reverse one.
+            self.edges[(from_waypoint, to_waypoint)] = edge
+            self.edges.setdefault((to_waypoint, from_waypoint), edge)
+            self.adjacency.setdefault(from_waypoint, set()).add(to_waypoint)
+            self.adjacency.setdefault(to_waypoint, set()).add(from_waypoint)
+            from_waypoints = self.to_waypoint_to_from_waypoints.setdefault(to_waypoint, [])
+            if from_waypoint not in from_waypoints:
+                from_waypoints.append(from_waypoint)
+
+    @property
+    def short_code_to_count(self):
+        return {short_code: len(ids) for short_code, ids in self.short_code_to_ids.items()}
+
+    @classmethod
+    def for_graph(cls, graph):
+        """Return the index of graph, reusing the last one built if it is for the same graph."""
+        last = cls._last
+        if (last is None or last.graph is not graph or
+                last._size != (len(graph.waypoints), len(graph.edges))):
+            last = cls._last = cls(graph)
+        return last
+
+    def find_edge(self, waypoint1, waypoint2):
+        """Return the map_pb2.Edge between two waypoint ids, or None if they are not adjacent."""
+        return self.edges.get((waypoint1, waypoint2))
+
+    def match_edge(self, waypoint1, waypoint2):
+        """Return the map_pb2.Edge.Id between two waypoint ids, as recorded in the graph."""
+        edge = self.find_edge(waypoint1, waypoint2)
+        if edge is None:
+            return None
+        return map_pb2.Edge.Id(from_waypoint=edge.id.from_waypoint, to_waypoint=edge.id.to_waypoint)
+
+    def neighbors(self, waypoint_id):
+        """Return the ids of the waypoints sharing an edge with waypoint_id."""
+        return self.adjacency.get(waypoint_id, set())
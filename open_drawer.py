@@ -7,6 +7,7 @@
 """Tutorial to show how to use Spot's arm.
 """
 import argparse
+import contextlib
 import sys
 import time
 
@@ -25,15 +26,29 @@ from bosdyn.client.manipulation_api_client import ManipulationApiClient
 from bosdyn.client.robot_command import RobotCommandClient, blocking_stand
 from bosdyn.client.robot_state import RobotStateClient
 from utils.constrained_manipulation_helper import *
+from utils.color_detector import RED_BGR, ColorTargetDetector
+from utils.constrained_manipulation_controller import ConstrainedManipulationController
+from utils.grasp_targeting import (build_pick_object_request, capture_color_and_depth,
+                                   first_valid)
+from utils.image_decode import ImageDecoder
+from utils.image_stream import ImageStream
+from utils.rpc_tracing import RpcTracer, traced_sleep
+from utils.skill_executor import SkillExecutor, Stage, StageFailed, wait_until
 from bosdyn.api import robot_command_pb2
 from bosdyn.api.basic_command_pb2 import RobotCommandFeedbackStatus
-from bosdyn.api import arm_command_pb2, geometry_pb2
+from bosdyn.api import arm_command_pb2, basic_command_pb2, geometry_pb2, gripper_command_pb2
 from bosdyn.client import robot_command
 from bosdyn.client.frame_helpers import BODY_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME, ODOM_FRAME_NAME, get_a_tform_b, get_se2_a_tform_b
 from bosdyn.client.robot_command import (RobotCommandBuilder, RobotCommandClient,
                                          block_until_arm_arrives, blocking_stand)
 from bosdyn.client.robot_state import RobotStateClient
 
+_RED_DETECTOR = ColorTargetDetector(target_colors=[RED_BGR])
+_IMAGE_DECODER = ImageDecoder()
+# Seconds between two streamed images, the frame period of the hand camera; requesting faster only
+# returns the same frame again.
+IMAGE_STREAM_PERIOD = 1.0 / 15
+
 g_image_click = None
 g_image_display = None
 
@@ -58,42 +73,69 @@ def red_distance(p):
     return(np.sqrt(sum_sq))
 
 def best_red(spot_image):
-    best_x = None
-    best_y = None
-    best_dist = 1000000000
-    for x in range(spot_image.shape[0]):
-        for y in range(spot_image.shape[1]):
-            red_val = red_distance(spot_image[x,y])
-            if red_val < best_dist:
-                best_x = x
-                best_y = y
-                best_dist = red_val
-    return(best_x,best_y,best_dist)
+    """Return the (row, column, distance) of the pixel closest to the handle red."""
+    return _RED_DETECTOR.best(spot_image)
 
-def arm_object_grasp(config, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
-    """A simple example of using the Boston Dynamics API to command Spot's arm."""
+def decode_image(image):
+    """Return the pixels of an image_pb2.ImageResponse as a numpy array, see ImageDecoder."""
+    return _IMAGE_DECODER.decode(image)
 
-    # See hello_spot.py for an explanation of these lines.
 
-    # Take a picture with a camera
-    robot.logger.info('Getting an image from: ' + config.image_source)
+def capture_image(config, image_client):
+    """Take a picture with the camera config.image_source, returning the ImageResponse."""
     image_responses = image_client.get_image_from_sources([config.image_source])
 
     if len(image_responses) != 1:
         print('Got invalid number of images: ' + str(len(image_responses)))
         print(image_responses)
         assert False
+    return image_responses[0]
 
-    image = image_responses[0]
-    if image.shot.image.pixel_format == image_pb2.Image.PIXEL_FORMAT_DEPTH_U16:
-        dtype = np.uint16
-    else:
-        dtype = np.uint8
-    img = np.fromstring(image.shot.image.data, dtype=dtype)
-    if image.shot.image.format == image_pb2.Image.FORMAT_RAW:
-        img = img.reshape(image.shot.image.rows, image.shot.image.cols)
-    else:
-        img = cv2.imdecode(img, -1)
+
+def build_grasp_request(config, image, pix_x, pix_y, robot_state_client):
+    """Return the ManipulationApiRequest grasping the pixel (row pix_x, column pix_y) of image."""
+    pick_vec = geometry_pb2.Vec2(x=pix_y, y=pix_x)
+
+    # Build the proto
+    grasp = manipulation_api_pb2.PickObjectInImage(
+        pixel_xy=pick_vec, transforms_snapshot_for_camera=image.shot.transforms_snapshot,
+        frame_name_image_sensor=image.shot.frame_name_image_sensor,
+        camera_model=image.source.pinhole)
+
+    # Optionally add a grasp constraint.  This lets you tell the robot you only want top-down grasps or side-on grasps.
+    add_grasp_constraint(config, grasp, robot_state_client)
+
+    return manipulation_api_pb2.ManipulationApiRequest(pick_object_in_image=grasp)
+
+
+def build_depth_grasp_request(config, capture, robot_state_client, candidates=20):
+    """Return the ManipulationApiRequest picking the 3D point of the handle, None if not found.
+
+    The best candidates of the handle detector in capture.color (a ColorDepthCapture) are
+    back-projected with the aligned depth, and the first one in reach is grasped.
+    """
+    detections = _RED_DETECTOR.detect(capture.color, k=candidates)
+    targets = capture.locate([(row, col) for row, col, _ in detections])
+    target = first_valid(targets)
+    if target is None:
+        for candidate in targets[:3]:
+            print(candidate)
+        return None
+    print(target)
+    request = build_pick_object_request(target)
+    add_grasp_constraint(config, request.pick_object, robot_state_client)
+    return request
+
+
+def arm_object_grasp(config, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
+    """A simple example of using the Boston Dynamics API to command Spot's arm."""
+
+    # See hello_spot.py for an explanation of these lines.
+
+    # Take a picture with a camera
+    robot.logger.info('Getting an image from: ' + config.image_source)
+    image = capture_image(config, image_client)
+    img = decode_image(image)
 
     # Show the image to the user and wait for them to click on a pixel
     """
@@ -133,20 +175,8 @@ def arm_object_grasp(config, sdk, robot, lease_client, robot_state_client, image
     pix_x, pix_y, pix_red = best_red(img)
     print(pix_x, pix_y, pix_red)
 
-    #pick_vec = geometry_pb2.Vec2(x=g_image_click[0], y=g_image_click[1])
-    pick_vec = geometry_pb2.Vec2(x=pix_y, y=pix_x)
-
-    # Build the proto
-    grasp = manipulation_api_pb2.PickObjectInImage(
-        pixel_xy=pick_vec, transforms_snapshot_for_camera=image.shot.transforms_snapshot,
-        frame_name_image_sensor=image.shot.frame_name_image_sensor,
-        camera_model=image.source.pinhole)
-
-    # Optionally add a grasp constraint.  This lets you tell the robot you only want top-down grasps or side-on grasps.
-    add_grasp_constraint(config, grasp, robot_state_client)
-
     # Ask the robot to pick up the object
-    grasp_request = manipulation_api_pb2.ManipulationApiRequest(pick_object_in_image=grasp)
+    grasp_request = build_grasp_request(config, image, pix_x, pix_y, robot_state_client)
 
     # Send the request
     cmd_response = manipulation_api_client.manipulation_api_command(
@@ -167,10 +197,10 @@ def arm_object_grasp(config, sdk, robot, lease_client, robot_state_client, image
         if response.current_state == manipulation_api_pb2.MANIP_STATE_GRASP_SUCCEEDED or response.current_state == manipulation_api_pb2.MANIP_STATE_GRASP_FAILED:
             break
 
-        time.sleep(0.25)
+        traced_sleep(0.25, "wait for the grasp")
 
     robot.logger.info('Finished grasp.')
-    time.sleep(2.0)
+    traced_sleep(2.0, "settle after the grasp")
 
 
 
@@ -269,6 +299,19 @@ def add_grasp_constraint(config, grasp, robot_state_client):
         constraint.squeeze_grasp.SetInParent()
 
 
+def build_constrained_manipulation_command(config):
+    """Return the constrained manipulation RobotCommand of config.task_type, None if unknown."""
+    # The task types are defined in constrained_manipulation_helper.py. The input is a normalized
+    # task velocity in range [-1, 1], scaled as a function of the force (or torque) limit.
+    # For heavier tasks, consider specifying the force or torque limit as well.
+    if config.task_type not in TASK_REGISTRY:
+        print("Unspecified task type. Exit.")
+        return None
+    return TASK_REGISTRY.command(config.task_type, config.task_velocity,
+                                 force_limit=config.force_limit,
+                                 torque_limit=config.torque_limit)
+
+
 def run_constrained_manipulation(config, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
     """A simple example of using the Boston Dynamics API to run a
        constrained manipulation task."""
@@ -277,36 +320,8 @@ def run_constrained_manipulation(config, sdk, robot, lease_client, robot_state_c
         "Start doing constrained manipulation. Make sure Object of interest is grasped before starting."
     )
 
-    # Build constrained manipulation command
-    # You can build the task type of interest by using functions
-    # defined in constrained_manipulation_helper.py
-    # The input to this function is a normalized task velocity in range [-1, 1].
-    # The normalized task velocity is scaled as a function of the force limit
-    # (See the constrained_manipulation_helper.py for more details)
-    # For heavier tasks, consider specifying the force or torque limit as well.
-    if (config.task_type == 'crank'):
-        command = construct_crank_task(config.task_velocity, force_limit=config.force_limit)
-    elif (config.task_type == 'lever'):
-        command = construct_lever_task(config.task_velocity, force_limit=config.force_limit,
-                                       torque_limit=config.torque_limit)
-    elif (config.task_type == 'left_handed_ballvalve'):
-        command = construct_left_handed_ballvalve_task(config.task_velocity,
-                                                       force_limit=config.force_limit,
-                                                       torque_limit=config.torque_limit)
-    elif (config.task_type == 'right_handed_ballvalve'):
-        command = construct_right_handed_ballvalve_task(config.task_velocity,
-                                                        force_limit=config.force_limit,
-                                                        torque_limit=config.torque_limit)
-    elif (config.task_type == 'cabinet'):
-        command = construct_cabinet_task(config.task_velocity, force_limit=config.force_limit)
-    elif (config.task_type == 'wheel'):
-        command = construct_wheel_task(config.task_velocity, force_limit=config.force_limit)
-    elif (config.task_type == 'drawer'):
-        command = construct_drawer_task(config.task_velocity, force_limit=config.force_limit)
-    elif (config.task_type == 'knob'):
-        command = construct_knob_task(config.task_velocity, torque_limit=config.torque_limit)
-    else:
-        print("Unspecified task type. Exit.")
+    command = build_constrained_manipulation_command(config)
+    if command is None:
         return
 
 
@@ -329,11 +344,11 @@ def run_constrained_manipulation(config, sdk, robot, lease_client, robot_state_c
     command.full_body_command.constrained_manipulation_request.end_time.CopyFrom(
         robot.time_sync.robot_timestamp_from_local_secs(time.time() + 10))
     command_client.robot_command_async(command)
-    time.sleep(2.0)
+    traced_sleep(2.0, "constrained manipulation")
 
-def open_gripper(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
-     # Close the gripper
-    robot_state = robot_state_client.get_robot_state()
+def build_open_gripper_command(robot_state, seconds=2):
+    """Return the RobotCommand opening the gripper while holding the hand where it is in
+    robot_state, the arm trajectory taking seconds."""
     robot_hand_pose = robot_state.kinematic_state.transforms_snapshot.child_to_parent_edge_map["hand"].parent_tform_child
     print(robot_hand_pose)
     # Make the arm pose RobotCommand
@@ -353,14 +368,10 @@ def open_gripper(options, sdk, robot, lease_client, robot_state_client, image_cl
     flat_body_T_hand = geometry_pb2.SE3Pose(position=hand_ewrt_flat_body,
                                             rotation=flat_body_Q_hand)
 
-    robot_state = robot_state_client.get_robot_state()
     odom_T_flat_body = get_a_tform_b(robot_state.kinematic_state.transforms_snapshot,
                                      ODOM_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME)
 
-    odom_T_hand = odom_T_flat_body * math_helpers.SE3Pose.from_obj(flat_body_T_hand)
-
-    # duration in seconds
-    seconds = 2
+    odom_T_hand = odom_T_flat_body * math_helpers.SE3Pose.from_proto(flat_body_T_hand)
 
     arm_command = RobotCommandBuilder.arm_pose_command(
         odom_T_hand.x, odom_T_hand.y, odom_T_hand.z, odom_T_hand.rot.w, odom_T_hand.rot.x,
@@ -370,7 +381,13 @@ def open_gripper(options, sdk, robot, lease_client, robot_state_client, image_cl
     gripper_command = RobotCommandBuilder.claw_gripper_open_fraction_command(1.0)
 
     # Combine the arm and gripper commands into one RobotCommand
-    command = RobotCommandBuilder.build_synchro_command(gripper_command, arm_command)
+    return RobotCommandBuilder.build_synchro_command(gripper_command, arm_command)
+
+
+def open_gripper(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
+     # Close the gripper
+    robot_state = robot_state_client.get_robot_state()
+    command = build_open_gripper_command(robot_state)
 
     # Send the request
     cmd_id = command_client.robot_command(command)
@@ -378,7 +395,7 @@ def open_gripper(options, sdk, robot, lease_client, robot_state_client, image_cl
 
     # Wait until the arm arrives at the goal.
     #block_until_arm_arrives_with_prints(robot, command_client, cmd_id)
-    time.sleep(2)
+    traced_sleep(2, "wait for the gripper to open")
 
 
 def block_until_arm_arrives_with_prints(robot, command_client, cmd_id):
@@ -399,12 +416,11 @@ def block_until_arm_arrives_with_prints(robot, command_client, cmd_id):
         if feedback_resp.feedback.synchronized_feedback.arm_command_feedback.arm_cartesian_feedback.status == arm_command_pb2.ArmCartesianCommand.Feedback.STATUS_TRAJECTORY_COMPLETE:
             robot.logger.info('Move complete.')
             break
-        time.sleep(0.1)
+        traced_sleep(0.1, "wait for the arm")
 
 
-def relative_move(dx, dy, dyaw, frame_name, robot_command_client, robot_state_client, stairs=False):
-    transforms = robot_state_client.get_robot_state().kinematic_state.transforms_snapshot
-
+def build_relative_move_command(dx, dy, dyaw, frame_name, transforms, stairs=False):
+    """Return the RobotCommand moving the body by (dx, dy, dyaw) from where it is in transforms."""
     # Build the transform for where we want the robot to be relative to where the body currently is.
     body_tform_goal = math_helpers.SE2Pose(x=dx, y=dy, angle=dyaw)
     # We do not want to command this goal in body frame because the body will move, thus shifting
@@ -415,9 +431,14 @@ def relative_move(dx, dy, dyaw, frame_name, robot_command_client, robot_state_cl
 
     # Command the robot to go to the goal point in the specified frame. The command will stop at the
     # new position.
-    robot_cmd = RobotCommandBuilder.synchro_se2_trajectory_point_command(
+    return RobotCommandBuilder.synchro_se2_trajectory_point_command(
         goal_x=out_tform_goal.x, goal_y=out_tform_goal.y, goal_heading=out_tform_goal.angle,
         frame_name=frame_name, params=RobotCommandBuilder.mobility_params(stair_hint=stairs))
+
+
+def relative_move(dx, dy, dyaw, frame_name, robot_command_client, robot_state_client, stairs=False):
+    transforms = robot_state_client.get_robot_state().kinematic_state.transforms_snapshot
+    robot_cmd = build_relative_move_command(dx, dy, dyaw, frame_name, transforms, stairs)
     end_time = 10.0
     cmd_id = robot_command_client.robot_command(lease=None, command=robot_cmd,
                                                 end_time_secs=time.time() + end_time)
@@ -433,7 +454,7 @@ def relative_move(dx, dy, dyaw, frame_name, robot_command_client, robot_state_cl
                 traj_feedback.body_movement_status == traj_feedback.BODY_STATUS_SETTLED):
             print("Arrived at the goal.")
             return True
-        time.sleep(1)
+        traced_sleep(1, "wait for the relative move")
 
     return True
 
@@ -453,6 +474,17 @@ def main(argv):
 
     parser.add_argument('--torque-limit', help='Max force to be applied along task dimensions',
                         type=float, default=5.0)
+    parser.add_argument('--manipulation-seconds', type=float, default=2.0,
+                        help='Maximum time the drawer is pulled for')
+    parser.add_argument('--travel-target', type=float, default=None,
+                        help='Meters the drawer is pulled open, by default until it stops')
+    parser.add_argument('--sequential', action='store_true',
+                        help='Run the skill steps one after the other with fixed waits')
+    parser.add_argument('--depth-grasp', action='store_true',
+                        help='Locate the handle in 3D with the aligned hand depth image and grasp '
+                        'that point')
+    parser.add_argument('--trace', default=None,
+                        help='Write a Chrome trace of the RPCs and waits of the skill to this file')
 
     options = parser.parse_args(argv)
     options.task_velocity = -0.5
@@ -467,10 +499,13 @@ def main(argv):
     stairs = False
     dframe = ODOM_FRAME_NAME
 
+    tracer = RpcTracer().start() if options.trace else None
     try:
 
         sdk = bosdyn.client.create_standard_sdk('ArmObjectGraspClient')
         robot = sdk.create_robot(options.hostname)
+        if tracer is not None:
+            tracer.instrument_robot(robot)
 
         bosdyn.client.util.setup_logging(options.verbose)
         bosdyn.client.util.authenticate(robot)
@@ -481,7 +516,15 @@ def main(argv):
 
         manipulation_api_client = robot.ensure_client(ManipulationApiClient.default_service_name)
 
-        with bosdyn.client.lease.LeaseKeepAlive(lease_client, must_acquire=True, return_at_exit=True):
+        # Images stream while the robot powers on and stands, so the handle is found without
+        # waiting for an image request.
+        if options.sequential or options.depth_grasp:
+            image_stream = contextlib.nullcontext()
+        else:
+            image_stream = ImageStream(image_client, [options.image_source], max_in_flight=1,
+                                       period=IMAGE_STREAM_PERIOD)
+        with bosdyn.client.lease.LeaseKeepAlive(lease_client, must_acquire=True, return_at_exit=True), \
+                image_stream as image_stream:
 
             robot.time_sync.wait_for_sync()
 
@@ -521,7 +564,14 @@ def main(argv):
             print("Stow arm")
             stow_spot_arm(command_client, robot)
             """
-            open_drawer_skill(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client)
+            if options.sequential:
+                start = time.time()
+                open_drawer_skill_sequential(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client)
+                print("Skill took {:.2f}s".format(time.time() - start))
+            else:
+                report = open_drawer_skill(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client, image_stream)
+                if not report.complete:
+                    return False
 
 
         return True
@@ -529,8 +579,172 @@ def main(argv):
         logger = bosdyn.client.util.get_logger()
         logger.exception("Threw an exception")
         return False
+    finally:
+        if tracer is not None:
+            tracer.stop()
+            tracer.print_summary()
+            tracer.write_chrome_trace(options.trace)
+
+def open_drawer_stages(options, robot, robot_state_client, image_client, manipulation_api_client,
+                       command_client, image_stream=None):
+    """Return the stages of the open drawer skill, to run with a SkillExecutor.
+
+    Every stage waits for the robot feedback instead of sleeping. The handle is found in the
+    camera image before the grasp stage starts. The drawer is pulled by a
+    ConstrainedManipulationController, prepared during the grasp, until it reaches
+    options.travel_target or stops moving; the last robot state it received is the input of the
+    step back. With an image_stream (an ImageStream of options.image_source), the handle is found in
+    the first frame it received after the stages were built instead of a newly requested image.
+    With options.depth_grasp, the color and aligned depth images are captured together and the
+    robot is sent the 3D point of the handle instead of a pixel.
+    """
+    dx = -0.25
+    dy = 0
+    dyaw = 0
+    stairs = False
+    dframe = ODOM_FRAME_NAME
+    # The constrained manipulation runs at most this long, less if the drawer stops moving.
+    manipulation_seconds = getattr(options, 'manipulation_seconds', 2.0)
+    # Duration of the arm trajectory holding the hand in place while the gripper opens.
+    release_seconds = getattr(options, 'release_seconds', 0.5)
+    # Maximum age, in seconds, of a robot state reused from the previous stage.
+    max_state_age = 0.25
+    # Frames received before this were taken before the robot was ready, e.g. while standing up.
+    stages_start = time.time()
+
+    def find_handle(context):
+        if getattr(options, 'depth_grasp', False):
+            capture = capture_color_and_depth(image_client, color_source=options.image_source)
+            request = build_depth_grasp_request(options, capture, robot_state_client)
+            if request is None:
+                raise StageFailed("No handle candidate with a valid depth.")
+            return request
+        if image_stream is not None:
+            frame = image_stream.wait_for_frame(options.image_source,
+                                                received_after=stages_start, timeout=2.0)
+            if frame is None:
+                raise StageFailed("No image from {}.".format(options.image_source))
+            # No later stage looks at the images, stop requesting them.
+            image_stream.stop()
+            image, pixels = frame.response, frame.pixels
+        else:
+            image = capture_image(options, image_client)
+            pixels = decode_image(image)
+        pix_x, pix_y, pix_red = best_red(pixels)
+        print(pix_x, pix_y, pix_red)
+        return build_grasp_request(options, image, pix_x, pix_y, robot_state_client)
+
+    def grasp(context, grasp_request, deadline):
+        cmd_response = manipulation_api_client.manipulation_api_command(
+            manipulation_api_request=grasp_request)
+        feedback_request = manipulation_api_pb2.ManipulationApiFeedbackRequest(
+            manipulation_cmd_id=cmd_response.manipulation_cmd_id)
+
+        def grasp_finished():
+            state = manipulation_api_client.manipulation_api_feedback_command(
+                manipulation_api_feedback_request=feedback_request).current_state
+            if state in (manipulation_api_pb2.MANIP_STATE_GRASP_SUCCEEDED,
+                         manipulation_api_pb2.MANIP_STATE_GRASP_FAILED):
+                return state
+            return None
+
+        state = wait_until(grasp_finished, deadline, period=0.1, description="the grasp")
+        if state == manipulation_api_pb2.MANIP_STATE_GRASP_FAILED:
+            raise StageFailed("The grasp failed.")
+
+    def manipulation_controller(context):
+        if options.task_type not in TASK_REGISTRY:
+            raise StageFailed("Unknown task type {}.".format(options.task_type))
+        return ConstrainedManipulationController(
+            command_client, robot_state_client, robot.time_sync, task_type=options.task_type,
+            velocity=options.task_velocity, force_limit=options.force_limit,
+            torque_limit=options.torque_limit,
+            travel_target=getattr(options, 'travel_target', None),
+            max_seconds=manipulation_seconds)
+
+    def open_drawer(context, controller, deadline):
+        result = controller.run(deadline)
+        print(result)
+        # The last state received is the step back's input.
+        context['robot_state'] = (time.time(), result.robot_state)
+        context['manipulation_trace'] = result.trace
+        if result.reason == "grasp lost":
+            raise StageFailed("The grasp was lost while opening the drawer.")
+        if result.reason == "blocked":
+            raise StageFailed("The drawer did not move.")
+
+    def step_back(context, prefetched, deadline):
+        state_time, robot_state = context.get('robot_state', (0.0, None))
+        if robot_state is None or time.time() - state_time > max_state_age:
+            robot_state = robot_state_client.get_robot_state()
+        robot_cmd = build_relative_move_command(dx, dy, dyaw, dframe,
+                                                robot_state.kinematic_state.transforms_snapshot,
+                                                stairs)
+        cmd_id = command_client.robot_command(lease=None, command=robot_cmd,
+                                              end_time_secs=deadline)
+
+        def arrived():
+            feedback = command_client.robot_command_feedback(cmd_id)
+            mobility_feedback = feedback.feedback.synchronized_feedback.mobility_command_feedback
+            if mobility_feedback.status != RobotCommandFeedbackStatus.STATUS_PROCESSING:
+                raise StageFailed("Failed to reach the goal.")
+            traj_feedback = mobility_feedback.se2_trajectory_feedback
+            return (traj_feedback.status == traj_feedback.STATUS_AT_GOAL and
+                    traj_feedback.body_movement_status == traj_feedback.BODY_STATUS_SETTLED)
+
+        wait_until(arrived, deadline, description="the step back")
+
+    def release(context, prefetched, deadline):
+        command = build_open_gripper_command(robot_state_client.get_robot_state(), release_seconds)
+        cmd_id = command_client.robot_command(command)
+
+        def released():
+            feedback = command_client.robot_command_feedback(cmd_id).feedback.synchronized_feedback
+            gripper_status = feedback.gripper_command_feedback.claw_gripper_feedback.status
+            arm_status = feedback.arm_command_feedback.arm_cartesian_feedback.status
+            return (gripper_status == gripper_command_pb2.ClawGripperCommand.Feedback.STATUS_AT_GOAL
+                    and arm_status ==
+                    arm_command_pb2.ArmCartesianCommand.Feedback.STATUS_TRAJECTORY_COMPLETE)
+
+        wait_until(released, deadline, description="the gripper to open")
+
+    def stow(context, prefetched, deadline):
+        cmd_id = command_client.robot_command(RobotCommandBuilder.arm_stow_command())
+
+        def stowed():
+            feedback = command_client.robot_command_feedback(cmd_id).feedback.synchronized_feedback
+            return (feedback.arm_command_feedback.named_arm_position_feedback.status ==
+                    arm_command_pb2.NamedArmPositionsCommand.Feedback.STATUS_COMPLETE)
+
+        wait_until(stowed, deadline, description="the arm to stow")
+
+    return [
+        Stage("grasp handle", grasp, timeout=15.0, prefetch=find_handle),
+        Stage("open drawer", open_drawer, timeout=manipulation_seconds + 3.0,
+              prefetch=manipulation_controller),
+        Stage("step back", step_back, timeout=10.0),
+        Stage("open gripper", release, timeout=release_seconds + 3.0),
+        Stage("stow arm", stow, timeout=5.0),
+    ]
+
+
+def open_drawer_skill(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client, image_stream=None):
+    """Grasp the handle, open the drawer, step back, let go and stow the arm.
+
+    Returns the SkillReport with the time each stage took. The handle is found in the frames of
+    image_stream, an ImageStream of options.image_source, or in a newly requested image without
+    one.
+    """
+    executor = SkillExecutor(
+        open_drawer_stages(options, robot, robot_state_client, image_client,
+                           manipulation_api_client, command_client, image_stream))
+    report = executor.run()
+    print(report)
+    return report
+
 
-def open_drawer_skill(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
+def open_drawer_skill_sequential(options, sdk, robot, lease_client, robot_state_client, image_client, manipulation_api_client, command_client):
+    """The open drawer skill as a plain sequence with fixed waits, to compare against."""
     dx = -0.25
     dy = 0
     dyaw = 0
@@ -0,0 +1,264 @@
+"""Asyncio GraphNav session.
+
+GraphNavInterface only has blocking methods, meant for its interactive run() loop. The session
+offers the same operations as coroutines, built on the SDK's *_async RPCs, so one event loop can
+navigate, stream the robot state and capture images at the same time:
+
+    session = AsyncGraphNavSession.for_robot(robot)
+    await session.upload(get_map_loader(path), lease=lease.lease_proto)
+    await session.localize_fiducial()
+    await session.power_on()
+    navigation = asyncio.ensure_future(session.navigate_to(waypoint_id))
+    async for state in session.stream_robot_state(period=0.2):
+        ...
+        if navigation.done():
+            break
+
+The SDK futures complete on gRPC threads; wrap_future hands their results to the event loop.
+The snapshot uploads are streaming RPCs without an async variant, they run in the default
+executor through SnapshotUploader.
+"""
+
+import asyncio
+import math
+import time
+
+from bosdyn.api import power_pb2
+from bosdyn.api import robot_state_pb2
+from bosdyn.api.graph_nav import graph_nav_pb2
+from bosdyn.api.graph_nav import nav_pb2
+from bosdyn.client.exceptions import ResponseError
+from bosdyn.client.frame_helpers import get_odom_tform_body
+from bosdyn.client.graph_nav import GraphNavClient
+from bosdyn.client.power import PowerClient
+from bosdyn.client.robot_command import RobotCommandBuilder, RobotCommandClient
+from bosdyn.client.robot_state import RobotStateClient
+
+from utils.navigation_driver import GoalMetrics, NavigationDriver
+from utils.snapshot_uploader import SnapshotUploader, UploadReport
+
+
+def wrap_future(sdk_future, loop=None):
+    """Return an asyncio future that completes with the result of an SDK (or gRPC) future.
+
+    Cancelling the asyncio future cancels the RPC.
+    """
+    loop = loop if loop is not None else asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def transfer(done_future):
+        if future.cancelled():
+            return
+        try:
+            future.set_result(done_future.result())
+        except Exception as err:  # pylint: disable=broad-except
+            future.set_exception(err)
+
+    def on_done(done_future):
+        # Called on a gRPC thread.
+        loop.call_soon_threadsafe(transfer, done_future)
+
+    future.add_done_callback(lambda f: sdk_future.cancel() if f.cancelled() else None)
+    sdk_future.add_done_callback(on_done)
+    return future
+
+
+class AsyncNavigationDriver(NavigationDriver):
+    """NavigationDriver whose navigate_to, navigate_route and navigate_to_anchor are coroutines.
+
+    The command refresh and feedback schedule are the same; waiting happens in the event loop.
+    """
+
+    async def run(self, send_command, goal=None):
+        """Follow a navigation command until it finishes, returning the GoalMetrics."""
+        metrics = GoalMetrics(goal)
+        self.metrics.append(metrics)
+        try:
+            command_id = await wrap_future(send_command(None))
+        except ResponseError as e:
+            print("Error while navigating {}".format(e))
+            metrics.end_time = time.time()
+            return metrics
+        metrics.commands_sent += 1
+        metrics.first_command_latency = time.time() - metrics.start_time
+        next_refresh = metrics.start_time + self.command_period
+        previous = None
+
+        while True:
+            now = time.time()
+            # Refresh the command and poll the feedback at the same time.
+            command_future = None
+            if now >= next_refresh:
+                command_future = wrap_future(send_command(command_id))
+                next_refresh = now + self.command_period
+            feedback = await wrap_future(
+                self._graph_nav_client.navigation_feedback_async(command_id))
+            metrics.feedback_polls += 1
+            if command_future is not None:
+                try:
+                    await command_future
+                    metrics.commands_sent += 1
+                except ResponseError as e:
+                    print("Error while navigating {}".format(e))
+                    break
+            metrics.status = feedback.status
+            if self.is_finished(feedback.status):
+                break
+            wake_up = min(next_refresh, now + self._feedback_period(feedback, previous))
+            previous = (now, getattr(feedback, "remaining_route_length", 0.0))
+            await asyncio.sleep(max(0.0, wake_up - time.time()))
+        metrics.end_time = time.time()
+        return metrics
+
+
+class AsyncGraphNavSession(object):
+    """GraphNav operations of one robot as coroutines.
+
+    Creating a session does not block: no time sync and no lease acquisition. Navigation commands
+    use the lease of the clients' lease wallet, like GraphNavInterface.
+
+    params:
+    + graph_nav_client: GraphNavClient of the robot
+    + robot_state_client (optional): RobotStateClient, needed to localize and for power
+    + power_client (optional): PowerClient, needed to power on
+    + robot_command_client (optional): RobotCommandClient, needed to power off
+    + robot_serial (optional): serial number of the robot, the upload manifest key
+    + navigation_driver (optional): AsyncNavigationDriver following the navigation commands
+    """
+
+    def __init__(self, graph_nav_client, robot_state_client=None, power_client=None,
+                 robot_command_client=None, robot_serial=None, navigation_driver=None):
+        self.graph_nav_client = graph_nav_client
+        self.robot_state_client = robot_state_client
+        self.power_client = power_client
+        self.robot_command_client = robot_command_client
+        self.robot_serial = robot_serial
+        self.navigation_driver = (navigation_driver if navigation_driver is not None else
+                                  AsyncNavigationDriver(graph_nav_client))
+
+    @staticmethod
+    def for_robot(robot):
+        """Return the session of an authenticated bosdyn.client.Robot."""
+        return AsyncGraphNavSession(robot.ensure_client(GraphNavClient.default_service_name),
+                                    robot.ensure_client(RobotStateClient.default_service_name),
+                                    robot.ensure_client(PowerClient.default_service_name),
+                                    robot.ensure_client(RobotCommandClient.default_service_name),
+                                    robot.get_id().serial_number)
+
+    async def upload(self, map_loader, lease=None, generate_new_anchoring=None, max_in_flight=4):
+        """Upload the graph, then the snapshots the robot does not have yet; see SnapshotUploader.
+
+        Returns the UploadReport.
+        """
+        graph = map_loader.graph
+        if generate_new_anchoring is None:
+            generate_new_anchoring = not len(graph.anchoring.anchors)
+        start = time.time()
+        response = await wrap_future(
+            self.graph_nav_client.upload_graph_async(lease=lease, graph=graph,
+                                                     generate_new_anchoring=generate_new_anchoring))
+        report = UploadReport()
+        report.seconds = time.time() - start
+        report.already_on_robot = (
+            len(map_loader.waypoint_snapshots) + len(map_loader.edge_snapshots) -
+            len(response.unknown_waypoint_snapshot_ids) - len(response.unknown_edge_snapshot_ids))
+        uploader = SnapshotUploader(self.graph_nav_client, map_loader,
+                                    self.robot_serial or "unknown", max_in_flight=max_in_flight)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, uploader.upload_snapshots, response.unknown_waypoint_snapshot_ids,
+            response.unknown_edge_snapshot_ids, report)
+
+    async def get_localization_state(self, **kwargs):
+        return await wrap_future(self.graph_nav_client.get_localization_state_async(**kwargs))
+
+    async def get_robot_state(self):
+        return await wrap_future(self.robot_state_client.get_robot_state_async())
+
+    async def stream_robot_state(self, period=0.1):
+        """Yield the robot state every period seconds; the next request is sent while the caller
+        handles the current state."""
+        next_state = asyncio.ensure_future(self.get_robot_state())
+        try:
+            while True:
+                start = time.time()
+                state = await next_state
+                next_state = asyncio.ensure_future(self._robot_state_after(start + period))
+                yield state
+        finally:
+            next_state.cancel()
+
+    async def _robot_state_after(self, wake_up):
+        await asyncio.sleep(max(0.0, wake_up - time.time()))
+        return await self.get_robot_state()
+
+    async def _odom_tform_body(self):
+        robot_state = await self.get_robot_state()
+        return get_odom_tform_body(robot_state.kinematic_state.transforms_snapshot).to_proto()
+
+    async def localize_fiducial(self):
+        """Localize to the nearest fiducial in sight."""
+        # An empty initial guess asks GraphNav to localize based on the nearest fiducial.
+        return await wrap_future(
+            self.graph_nav_client.set_localization_async(
+                initial_guess_localization=nav_pb2.Localization(),
+                ko_tform_body=await self._odom_tform_body()))
+
+    async def localize_waypoint(self, waypoint_id, waypoint_tform_body=None):
+        """Localize to a waypoint; the robot is at waypoint_tform_body (geometry_pb2.SE3Pose) from
+        it, or at the waypoint itself by default."""
+        localization = nav_pb2.Localization()
+        localization.waypoint_id = waypoint_id
+        if waypoint_tform_body is not None:
+            localization.waypoint_tform_body.CopyFrom(waypoint_tform_body)
+        else:
+            localization.waypoint_tform_body.rotation.w = 1.0
+        return await wrap_future(
+            self.graph_nav_client.set_localization_async(
+                initial_guess_localization=localization,
+                # It's hard to get the pose perfect, search +/-20 deg and +/-20cm (0.2m).
+                max_distance=0.2, max_yaw=20.0 * math.pi / 180.0,
+                fiducial_init=graph_nav_pb2.SetLocalizationRequest.FIDUCIAL_INIT_NO_FIDUCIAL,
+                ko_tform_body=await self._odom_tform_body()))
+
+    async def navigate_to(self, waypoint_id, leases=None):
+        """Navigate to a waypoint id, returning the GoalMetrics."""
+        return await self.navigation_driver.navigate_to(waypoint_id, leases=leases)
+
+    async def navigate_route(self, route, leases=None):
+        """Navigate a route built with GraphNavClient.build_route, returning the GoalMetrics."""
+        return await self.navigation_driver.navigate_route(route, leases=leases)
+
+    async def navigate_to_anchor(self, seed_tform_goal, leases=None):
+        """Navigate to a geometry_pb2.SE3Pose in the seed frame, returning the GoalMetrics."""
+        return await self.navigation_driver.navigate_to_anchor(seed_tform_goal, leases=leases)
+
+    async def is_powered_on(self):
+        state = await self.get_robot_state()
+        return state.power_state.motor_power_state == robot_state_pb2.PowerState.STATE_ON
+
+    async def _wait_motor_power(self, motor_power_state, timeout, poll_period=0.25):
+        end_time = time.time() + timeout
+        while True:
+            state = await self.get_robot_state()
+            if state.power_state.motor_power_state == motor_power_state:
+                return True
+            if time.time() > end_time:
+                return False
+            await asyncio.sleep(poll_period)
+
+    async def power_on(self, timeout=20.0):
+        """Power the motors on, returning True once they are on."""
+        if await self.is_powered_on():
+            return True
+        request = power_pb2.PowerCommandRequest.REQUEST_ON_MOTORS
+        await wrap_future(self.power_client.power_command_async(request))
+        return await self._wait_motor_power(robot_state_pb2.PowerState.STATE_ON, timeout)
+
+    async def power_off(self, timeout=20.0):
+        """Sit the robot down and power the motors off, returning True once they are off."""
+        if not await self.is_powered_on():
+            return True
+        await wrap_future(
+            self.robot_command_client.robot_command_async(
+                RobotCommandBuilder.safe_power_off_command()))
+        return await self._wait_motor_power(robot_state_pb2.PowerState.STATE_OFF, timeout)
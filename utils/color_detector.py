@@ -0,0 +1,100 @@
+"""Vectorized search for the pixels closest to a target color.
+
+ColorTargetDetector computes the distance of every pixel to one or more target colors as a single
+NumPy operation and returns the best candidates with the same (x, y, dist) contract as
+open_drawer.best_red: x is the row index, y the column index and dist the color distance.
+
+Two metrics are supported:
+  - "bgr": euclidean distance in BGR space, the metric best_red always used.
+  - "hsv": distance in HSV space where the hue difference wraps around, which is less sensitive
+    to lighting changes. hsv_weights scales the (hue, saturation, value) differences.
+"""
+
+import cv2
+import numpy as np
+
+# Color of the drawer handle tape, in BGR order as decoded by cv2.
+RED_BGR = (35, 29, 206)
+
+
+class ColorTargetDetector(object):
+    """Finds the pixels of an image closest to a set of target colors.
+
+    params:
+    + target_colors (optional): list of BGR colors; a pixel's distance is to its closest target
+    + metric (optional): "bgr" or "hsv"
+    + downsample (optional): only look at every n-th row and column
+    + roi (optional): (row_min, col_min, row_max, col_max) region to search, max excluded
+    + hsv_weights (optional): weights of the (hue, saturation, value) differences for "hsv"
+    """
+
+    def __init__(self, target_colors=(RED_BGR,), metric="bgr", downsample=1, roi=None,
+                 hsv_weights=(1.0, 1.0, 1.0)):
+        if metric not in ("bgr", "hsv"):
+            raise ValueError("Unknown color metric {}".format(metric))
+        self.metric = metric
+        self.downsample = max(1, int(downsample))
+        self.roi = roi
+        self._hsv_weights = np.asarray(hsv_weights, dtype=np.float32)
+        targets = np.asarray(target_colors, dtype=np.uint8).reshape(-1, 3)
+        if metric == "hsv":
+            targets = cv2.cvtColor(targets.reshape(1, -1, 3), cv2.COLOR_BGR2HSV).reshape(-1, 3)
+        # Integer targets keep the BGR distances exact, so the results match best_red.
+        self._targets = targets.astype(np.int32)
+
+    def _region(self, image):
+        """Return the searched part of the image and the (row, col) offset of its origin."""
+        row_min, col_min = 0, 0
+        if self.roi is not None:
+            row_min, col_min, row_max, col_max = self.roi
+            image = image[row_min:row_max, col_min:col_max]
+        return image[::self.downsample, ::self.downsample], (row_min, col_min)
+
+    def squared_distances(self, image):
+        """Return the squared distance of every searched pixel to its closest target color."""
+        if image.ndim == 2:
+            # Single channel images are compared against every channel of the target, as
+            # best_red did by broadcasting.
+            image = image[:, :, np.newaxis]
+        if self.metric == "hsv":
+            image = cv2.cvtColor(np.ascontiguousarray(image[:, :, :3]), cv2.COLOR_BGR2HSV)
+        pixels = image.astype(np.int32)
+        best = None
+        for target in self._targets:
+            diff = pixels - target
+            if self.metric == "hsv":
+                # OpenCV hue is in [0, 180) and wraps around.
+                np.abs(diff, out=diff)
+                diff[:, :, 0] = np.minimum(diff[:, :, 0], 180 - diff[:, :, 0])
+                dist = np.einsum("ijk,ijk,k->ij", diff, diff, self._hsv_weights**2,
+                                 dtype=np.float64)
+            else:
+                dist = np.einsum("ijk,ijk->ij", diff, diff, dtype=np.int64)
+            best = dist if best is None else np.minimum(best, dist)
+        return best
+
+    def detect(self, image, k=1):
+        """Return up to k (x, y, dist) candidates, closest first, in full image coordinates."""
+        region, (row_offset, col_offset) = self._region(image)
+        if region.size == 0:
+            return []
+        squared = self.squared_distances(region)
+        flat = squared.ravel()
+        k = min(k, flat.size)
+        if k == 1:
+            # argmin returns the first minimum in row-major order, like the original loop.
+            indices = [int(np.argmin(flat))]
+        else:
+            indices = np.argpartition(flat, k - 1)[:k]
+            indices = indices[np.lexsort((indices, flat[indices]))]
+        cols = squared.shape[1]
+        return [(row_offset + (int(i) // cols) * self.downsample,
+                 col_offset + (int(i) % cols) * self.downsample, float(np.sqrt(flat[i])))
+                for i in indices]
+
+    def best(self, image):
+        """Return the (x, y, dist) of the closest pixel, or (None, None, None) if there is none."""
+        candidates = self.detect(image, k=1)
+        if not candidates:
+            return None, None, None
+        return candidates[0]
@@ -0,0 +1,257 @@
+"""Closed-loop constrained manipulation.
+
+run_constrained_manipulation sends one command with a 10 s end time and sleeps for 2 s, whether
+or not the drawer moved. ConstrainedManipulationController instead streams the manipulator state
+(hand pose and estimated force) and the command feedback, and keeps re-issuing a command of a
+short horizon, built from TASK_REGISTRY, until one of:
+
+  - target: the hand travelled travel_target meters from where it started,
+  - stuck: the robot reports ARM_IS_STUCK, e.g. the drawer is fully open,
+  - stalled: the hand moved less than stall_speed over the last stall_time seconds,
+  - blocked: it stalled before travelling min_travel meters, e.g. the drawer is locked,
+    (stalls are only detected for tasks that move the hand; a knob turns it in place and
+    hold_pose keeps it still, so they run until another reason),
+  - force: the estimated force at the hand exceeds max_force,
+  - grasp lost: the robot reports GRASP_IS_LOST,
+  - timeout: max_seconds passed.
+
+The hand is then stopped with a zero velocity command. Every state received is recorded in a
+ManipulationTrace:
+
+    controller = ConstrainedManipulationController(command_client, robot_state_client,
+                                                   robot.time_sync, task_type="drawer",
+                                                   velocity=-0.5, travel_target=0.3)
+    result = controller.run()
+    print(result)
+    result.trace.save("drawer_trace.npz")
+
+Because a command only lasts horizon seconds, the hand also stops on its own shortly after the
+client stops sending, e.g. if the connection drops.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+from bosdyn.api import basic_command_pb2
+from bosdyn.client.frame_helpers import HAND_FRAME_NAME, ODOM_FRAME_NAME, get_a_tform_b
+
+from utils.constrained_manipulation_helper import TASK_REGISTRY
+
+_Feedback = basic_command_pb2.ConstrainedManipulationCommand.Feedback
+_TaskType = basic_command_pb2.ConstrainedManipulationCommand.Request
+
+# Task types whose hand barely translates, so travel does not measure their progress.
+_IN_PLACE_TASK_TYPES = (_TaskType.TASK_TYPE_SE3_ROTATIONAL_TORQUE, _TaskType.TASK_TYPE_HOLD_POSE)
+
+
+class ManipulationTrace(object):
+    """Time series of one controller run, one row per robot state received."""
+
+    FIELDS = ("time", "travel", "speed", "force", "velocity")
+
+    def __init__(self):
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, seconds, travel, speed, force, velocity):
+        """Add a row: seconds since the start, meters travelled by the hand, its speed in meters
+        per second, the estimated force at the hand in newtons and the normalized velocity
+        commanded."""
+        self._rows.append((seconds, travel, speed, force, velocity))
+
+    def to_array(self):
+        """Return the trace as a (rows, len(FIELDS)) float32 array."""
+        return np.array(self._rows, dtype=np.float32).reshape(-1, len(self.FIELDS))
+
+    def column(self, field):
+        return self.to_array()[:, self.FIELDS.index(field)]
+
+    def save(self, path):
+        """Write the trace to a compressed .npz file, with the field names."""
+        np.savez_compressed(path, trace=self.to_array(), fields=np.array(self.FIELDS))
+
+    @staticmethod
+    def load(path):
+        trace = ManipulationTrace()
+        with np.load(path) as data:
+            trace._rows = [tuple(row) for row in data["trace"].tolist()]
+        return trace
+
+
+class ManipulationResult(object):
+    """Outcome of one ConstrainedManipulationController.run call."""
+
+    def __init__(self):
+        self.reason = None  # why the controller stopped, see the module docstring
+        self.travel = 0.0  # meters the hand travelled
+        self.seconds = 0.0
+        self.commands_sent = 0
+        self.robot_state = None  # last robot state received
+        self.trace = ManipulationTrace()
+
+    @property
+    def succeeded(self):
+        return self.reason in ("target", "stuck", "stalled")
+
+    def __str__(self):
+        return "Stopped on {} after {:.2f}s: {:.3f} m travelled, {} commands, {} states".format(
+            self.reason, self.seconds, self.travel, self.commands_sent, len(self.trace))
+
+
+def hand_position(robot_state, frame_name=ODOM_FRAME_NAME):
+    """Return the (x, y, z) of the hand in frame_name."""
+    pose = get_a_tform_b(robot_state.kinematic_state.transforms_snapshot, frame_name,
+                         HAND_FRAME_NAME)
+    return np.array([pose.x, pose.y, pose.z])
+
+
+def hand_force(robot_state):
+    """Return the norm of the estimated force at the hand, in newtons."""
+    force = robot_state.manipulator_state.estimated_end_effector_force_in_hand
+    return float(np.sqrt(force.x * force.x + force.y * force.y + force.z * force.z))
+
+
+class ConstrainedManipulationController(object):
+    """Runs a constrained manipulation task until its goal, a stall or a failure.
+
+    params:
+    + robot_command_client: RobotCommandClient
+    + robot_state_client: RobotStateClient
+    + time_sync: TimeSyncEndpoint (robot.time_sync) converting local times to robot timestamps
+    + task_type (optional): name of a TASK_REGISTRY task
+    + velocity (optional): normalized task velocity in range [-1.0, 1.0]
+    + force_limit (optional): max force along the task dimension
+    + torque_limit (optional): max torque about the task axis
+    + travel_target (optional): meters of hand travel after which the task is done, None to run
+                                until the arm is stuck or stalls
+    + horizon (optional): seconds each command lasts; it is re-issued every half horizon
+    + period (optional): seconds between two robot states
+    + stall_speed (optional): meters per second below which the hand is stalled
+    + stall_time (optional): seconds the hand must stay below stall_speed to be stalled; stalls
+                             are only detected once the hand has had that long to start, and
+                             never for knob (rotational) or hold_pose tasks
+    + min_travel (optional): meters the hand must travel for a stall to count as done rather than
+                             blocked
+    + max_force (optional): newtons of estimated hand force that stop the task, None for no limit
+    + max_seconds (optional): seconds after which the task stops
+    + registry (optional): TaskRegistry the commands are built from
+    """
+
+    def __init__(self, robot_command_client, robot_state_client, time_sync, task_type="drawer",
+                 velocity=-0.5, force_limit=40, torque_limit=5, travel_target=None, horizon=0.5,
+                 period=0.02, stall_speed=0.02, stall_time=0.3, min_travel=0.02, max_force=None,
+                 max_seconds=10.0, registry=TASK_REGISTRY):
+        self._command_client = robot_command_client
+        self._state_client = robot_state_client
+        self._time_sync = time_sync
+        self.task_type = task_type
+        self.velocity = velocity
+        self.force_limit = force_limit
+        self.torque_limit = torque_limit
+        self.travel_target = travel_target
+        self.horizon = horizon
+        self.period = period
+        self.stall_speed = stall_speed
+        self.stall_time = stall_time
+        self.min_travel = min_travel
+        self.max_force = max_force
+        self.max_seconds = max_seconds
+        self._registry = registry
+        self._detect_stalls = (registry.definition(task_type).task_type
+                               not in _IN_PLACE_TASK_TYPES)
+        # Built now, so the prototype is cached before run is called.
+        self._command = registry.command(task_type, 0.0, force_limit=force_limit,
+                                         torque_limit=torque_limit)
+
+    def _send(self, velocity, now, blocking=False):
+        self._registry.set_velocity(
+            self._command, self.task_type, velocity, force_limit=self.force_limit,
+            torque_limit=self.torque_limit,
+            end_time=self._time_sync.robot_timestamp_from_local_secs(now + self.horizon))
+        if blocking:
+            return self._command_client.robot_command(self._command)
+        return self._command_client.robot_command_async(self._command)
+
+    def _stop_reason(self, result, elapsed, status, force, window):
+        if status == _Feedback.STATUS_GRASP_IS_LOST:
+            return "grasp lost"
+        if status == _Feedback.STATUS_ARM_IS_STUCK:
+            return "stuck"
+        if self.travel_target is not None and result.travel >= self.travel_target:
+            return "target"
+        if self.max_force is not None and force > self.max_force:
+            return "force"
+        if self._detect_stalls and elapsed >= 2 * self.stall_time:
+            # window starts about stall_time seconds ago.
+            if abs(result.travel - window[0][1]) < self.stall_speed * self.stall_time:
+                return "stalled" if result.travel >= self.min_travel else "blocked"
+        return None
+
+    def run(self, deadline=None):
+        """Run the task, returning the ManipulationResult.
+
+        params:
+        + deadline (optional): time.time() by which the task stops, in addition to max_seconds
+        """
+        result = ManipulationResult()
+        start = time.time()
+        max_seconds = self.max_seconds if deadline is None else min(self.max_seconds,
+                                                                    deadline - start)
+        start_position = hand_position(self._state_client.get_robot_state())
+        command_id = self._send(self.velocity, time.time(), blocking=True)
+        result.commands_sent += 1
+        last_sent = time.time()
+        command_future = None
+        state_future = self._state_client.get_robot_state_async()
+        feedback_future = self._command_client.robot_command_feedback_async(command_id)
+        previous = None
+        window = collections.deque()  # (elapsed, travel) of the last stall_time seconds
+        try:
+            while True:
+                robot_state = state_future.result()
+                feedback = feedback_future.result()
+                now = time.time()
+                elapsed = now - start
+                if command_future is not None and command_future.done():
+                    command_id = command_future.result()
+                    command_future = None
+                # Request the next state and feedback while this one is handled.
+                wake_up = now + self.period
+                state_future = self._state_client.get_robot_state_async()
+                feedback_future = self._command_client.robot_command_feedback_async(command_id)
+
+                result.robot_state = robot_state
+                result.travel = float(np.linalg.norm(hand_position(robot_state) - start_position))
+                speed = 0.0
+                if previous is not None and now > previous[0]:
+                    speed = (result.travel - previous[1]) / (now - previous[0])
+                previous = (now, result.travel)
+                force = hand_force(robot_state)
+                result.trace.append(elapsed, result.travel, speed, force, self.velocity)
+                window.append((elapsed, result.travel))
+                while len(window) > 1 and window[1][0] <= elapsed - self.stall_time:
+                    window.popleft()
+                status = feedback.feedback.full_body_feedback.constrained_manipulation_feedback.status
+                result.reason = self._stop_reason(result, elapsed, status, force, window)
+                if result.reason is None and elapsed >= max_seconds:
+                    result.reason = "timeout"
+                if result.reason is not None:
+                    break
+                if now - last_sent >= self.horizon / 2 and command_future is None:
+                    command_future = self._send(self.velocity, now)
+                    result.commands_sent += 1
+                    last_sent = now
+                time.sleep(max(0.0, wake_up - time.time()))
+        finally:
+            # Hold the hand where it is; the command expires after one horizon.
+            self._send(0.0, time.time(), blocking=True)
+            result.commands_sent += 1
+            for future in (state_future, feedback_future, command_future):
+                if future is not None:
+                    future.cancel()
+        result.seconds = time.time() - start
+        return result
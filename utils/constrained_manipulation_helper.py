@@ -7,7 +7,9 @@
 """Test script to run constrained manipulation
 """
 
-from bosdyn.api import basic_command_pb2, geometry_pb2
+import threading
+
+from bosdyn.api import basic_command_pb2, geometry_pb2, robot_command_pb2
 from bosdyn.client.robot_command import RobotCommandBuilder
 
 
@@ -33,22 +35,8 @@ def construct_lever_task(velocity_normalized, force_limit=40, torque_limit=5):
     or use the ball valve task types, which assume a specific grasp and specify
     what the initial torque_direction is.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    torque_lim = torque_limit
-    force_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=1.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('lever', velocity_normalized, force_limit=force_limit,
+                                 torque_limit=torque_limit)
 
 
 def construct_right_handed_ballvalve_task(velocity_normalized, force_limit=40, torque_limit=5):
@@ -70,25 +58,8 @@ def construct_right_handed_ballvalve_task(velocity_normalized, force_limit=40, t
     If the grasp is such that the hand x axis is not parallel to the axis
     of rotation of the ball valve, then use the lever task.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    torque_lim = torque_limit
-    # Force/torque signs are opposite for right-handed ball valve
-    force_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=1.0)
-    # The torque vector is provided as additional information denoting the
-    # axis of rotation of the task.
-    torque_direction = geometry_pb2.Vec3(x=-1.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('right_handed_ballvalve', velocity_normalized,
+                                 force_limit=force_limit, torque_limit=torque_limit)
 
 
 def construct_left_handed_ballvalve_task(velocity_normalized, force_limit=40, torque_limit=5):
@@ -110,25 +81,8 @@ def construct_left_handed_ballvalve_task(velocity_normalized, force_limit=40, to
     If the grasp is such that the hand x axis is not parallel to the axis
     of rotation of the ball valve, then use the lever task.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    torque_lim = torque_limit
-    # Force/torque signs are the same for left-handed ball valve
-    force_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=1.0)
-    # The torque vector is provided as additional information denoting the
-    # axis of rotation of the task.
-    torque_direction = geometry_pb2.Vec3(x=1.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('left_handed_ballvalve', velocity_normalized,
+                                 force_limit=force_limit, torque_limit=torque_limit)
 
 
 def construct_crank_task(velocity_normalized, force_limit=40):
@@ -147,27 +101,7 @@ def construct_crank_task(velocity_normalized, force_limit=40):
     grasp is such that the initial motion needs to be something else,
     change the force direction.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    # Setting a placeholder value that doesn't matter, since we don't
-    # apply a pure torque in this task.
-    torque_lim = 5.0
-    # This assumes the grasp of crank is such that the crank will initially
-    # move along the hand y axis. Change if that is not the case.
-    force_direction = geometry_pb2.Vec3(x=0.0, y=1.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_R3_CIRCLE_EXTRADOF_FORCE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-
-    return command
+    return TASK_REGISTRY.command('crank', velocity_normalized, force_limit=force_limit)
 
 
 def construct_cabinet_task(velocity_normalized, force_limit=40):
@@ -186,24 +120,7 @@ def construct_cabinet_task(velocity_normalized, force_limit=40):
     grasp is such that the initial motion needs to be something else,
     change the force direction.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    # Setting a placeholder value that doesn't matter, since we don't
-    # apply a pure torque in this task.
-    torque_lim = 5.0
-    force_direction = geometry_pb2.Vec3(x=1.0, y=0.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_R3_CIRCLE_FORCE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('cabinet', velocity_normalized, force_limit=force_limit)
 
 
 def construct_drawer_task(velocity_normalized, force_limit=40):
@@ -222,24 +139,7 @@ def construct_drawer_task(velocity_normalized, force_limit=40):
     grasp is such that the initial motion needs to be something else,
     change the force direction.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    # Setting a placeholder value that doesn't matter, since we don't
-    # apply a pure torque in this task.
-    torque_lim = 5.0
-    force_direction = geometry_pb2.Vec3(x=1.0, y=0.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_R3_LINEAR_FORCE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('drawer', velocity_normalized, force_limit=force_limit)
 
 
 def construct_wheel_task(velocity_normalized, force_limit=40):
@@ -259,24 +159,7 @@ def construct_wheel_task(velocity_normalized, force_limit=40):
     This assumes initial motion will be along the y axis of the hand,
     which is often the case. Change force_direction if that is not true.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    velocity_limit = scale_velocity_lim_given_force_lim(force_limit)
-    tangential_velocity = velocity_normalized * velocity_limit
-    frame_name = "hand"
-    force_lim = force_limit
-    # Setting a placeholder value that doesn't matter, since we don't
-    # apply a pure torque in this task.
-    torque_lim = 5.0
-    force_direction = geometry_pb2.Vec3(x=0.0, y=1.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_R3_CIRCLE_FORCE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=tangential_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('wheel', velocity_normalized, force_limit=force_limit)
 
 
 def construct_knob_task(velocity_normalized, torque_limit=5):
@@ -295,24 +178,7 @@ def construct_knob_task(velocity_normalized, torque_limit=5):
     This assumes that the axis of rotation of the knob is roughly parallel
     to the x axis of the hand. Change torque_direction if that is not the case.
     """
-    velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
-    rot_velocity_limit = scale_rot_velocity_lim_given_torque_lim(torque_limit)
-    rotational_velocity = velocity_normalized * rot_velocity_limit
-    frame_name = "hand"
-    # Setting a placeholder value that doesn't matter, since we don't
-    # apply a pure force in this task.
-    force_lim = 40.0
-    torque_lim = torque_limit
-    force_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=1.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_SE3_ROTATIONAL_TORQUE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, rotational_speed=rotational_velocity,
-        frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('knob', velocity_normalized, torque_limit=torque_limit)
 
 
 def construct_hold_pose_task():
@@ -323,18 +189,7 @@ def construct_hold_pose_task():
     Output:
     + command: api command object
     """
-    frame_name = "hand"
-    force_lim = 80
-    torque_lim = 10
-    force_direction = geometry_pb2.Vec3(x=1.0, y=0.0, z=0.0)
-    torque_direction = geometry_pb2.Vec3(x=0.0, y=0.0, z=0.0)
-    init_wrench_dir = geometry_pb2.Wrench(force=force_direction, torque=torque_direction)
-    task_type = basic_command_pb2.ConstrainedManipulationCommand.Request.TASK_TYPE_HOLD_POSE
-
-    command = RobotCommandBuilder.constrained_manipulation_command(
-        task_type=task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
-        force_limit=force_lim, torque_limit=torque_lim, tangential_speed=0.0, frame_name=frame_name)
-    return command
+    return TASK_REGISTRY.command('hold_pose', 0.0)
 
 
 # This function is used to scale the velocity limit given
@@ -355,3 +210,175 @@ def scale_rot_velocity_lim_given_torque_lim(torque_limit):
     internal_vel_tracking_gain = 300.0 / 333.0
     vel_limit = torque_limit / internal_vel_tracking_gain
     return vel_limit
+
+
+_TaskType = basic_command_pb2.ConstrainedManipulationCommand.Request
+
+
+class TaskDefinition(object):
+    """Declarative description of a constrained manipulation task.
+
+    params:
+    + name: name of the task, e.g. the --task-type of open_drawer.py
+    + task_type: ConstrainedManipulationCommand.Request task type
+    + force_direction: (x, y, z) initial force direction in frame_name
+    + torque_direction (optional): (x, y, z) initial torque direction, the axis of rotation
+    + speed (optional): "tangential" for a velocity scaled by the force limit, "rotational" for
+                        one scaled by the torque limit, None for a task that does not move
+    + force_limit (optional): force limit always used, whatever the caller asks for; for tasks
+                              that apply no pure force
+    + torque_limit (optional): torque limit always used, whatever the caller asks for; for tasks
+                               that apply no pure torque
+    + frame_name (optional): frame of the directions
+    """
+
+    def __init__(self, name, task_type, force_direction, torque_direction=(0.0, 0.0, 0.0),
+                 speed="tangential", force_limit=None, torque_limit=None, frame_name="hand"):
+        self.name = name
+        self.task_type = task_type
+        self.force_direction = force_direction
+        self.torque_direction = torque_direction
+        self.speed = speed
+        self.force_limit = force_limit
+        self.torque_limit = torque_limit
+        self.frame_name = frame_name
+
+    def limits(self, force_limit, torque_limit):
+        """Return the (force_limit, torque_limit) the command is built with."""
+        return (self.force_limit if self.force_limit is not None else force_limit,
+                self.torque_limit if self.torque_limit is not None else torque_limit)
+
+    def speed_limit(self, force_limit, torque_limit):
+        """Return the speed of a normalized velocity of 1 under the given limits."""
+        if self.speed == "tangential":
+            return scale_velocity_lim_given_force_lim(force_limit)
+        if self.speed == "rotational":
+            return scale_rot_velocity_lim_given_torque_lim(torque_limit)
+        return 0.0
+
+    def build(self, force_limit, torque_limit):
+        """Return a new RobotCommand for the task at rest, under the given limits."""
+        init_wrench_dir = geometry_pb2.Wrench(
+            force=geometry_pb2.Vec3(x=self.force_direction[0], y=self.force_direction[1],
+                                    z=self.force_direction[2]),
+            torque=geometry_pb2.Vec3(x=self.torque_direction[0], y=self.torque_direction[1],
+                                     z=self.torque_direction[2]))
+        speed = dict(rotational_speed=0.0) if self.speed == "rotational" else dict(
+            tangential_speed=0.0)
+        return RobotCommandBuilder.constrained_manipulation_command(
+            task_type=self.task_type, init_wrench_direction_in_frame_name=init_wrench_dir,
+            force_limit=force_limit, torque_limit=torque_limit, frame_name=self.frame_name,
+            **speed)
+
+
+TASK_DEFINITIONS = [
+    # Initial motion of the lever along the hand z axis, plane normal unknown.
+    TaskDefinition('lever', _TaskType.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE, (0.0, 0.0, 1.0)),
+    # Force/torque signs are opposite for right-handed ball valve; the torque vector is the axis
+    # of rotation of the task.
+    TaskDefinition('right_handed_ballvalve', _TaskType.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE,
+                   (0.0, 0.0, 1.0), (-1.0, 0.0, 0.0)),
+    # Force/torque signs are the same for left-handed ball valve.
+    TaskDefinition('left_handed_ballvalve', _TaskType.TASK_TYPE_SE3_CIRCLE_FORCE_TORQUE,
+                   (0.0, 0.0, 1.0), (1.0, 0.0, 0.0)),
+    # The crank, cabinet, drawer and wheel apply no pure torque; their torque limit is a
+    # placeholder value that doesn't matter.
+    TaskDefinition('crank', _TaskType.TASK_TYPE_R3_CIRCLE_EXTRADOF_FORCE, (0.0, 1.0, 0.0),
+                   torque_limit=5.0),
+    TaskDefinition('cabinet', _TaskType.TASK_TYPE_R3_CIRCLE_FORCE, (1.0, 0.0, 0.0),
+                   torque_limit=5.0),
+    TaskDefinition('drawer', _TaskType.TASK_TYPE_R3_LINEAR_FORCE, (1.0, 0.0, 0.0),
+                   torque_limit=5.0),
+    TaskDefinition('wheel', _TaskType.TASK_TYPE_R3_CIRCLE_FORCE, (0.0, 1.0, 0.0),
+                   torque_limit=5.0),
+    # The knob applies no pure force, its force limit is a placeholder.
+    TaskDefinition('knob', _TaskType.TASK_TYPE_SE3_ROTATIONAL_TORQUE, (0.0, 0.0, 0.0),
+                   (1.0, 0.0, 0.0), speed="rotational", force_limit=40.0),
+    TaskDefinition('hold_pose', _TaskType.TASK_TYPE_HOLD_POSE, (1.0, 0.0, 0.0), speed=None,
+                   force_limit=80, torque_limit=10),
+]
+
+
+class TaskRegistry(object):
+    """Constrained manipulation tasks by name, with a prototype command cached per limits.
+
+    The first command of a (task, force_limit, torque_limit) builds the prototype RobotCommand;
+    the following ones copy it and only set the speed and end time. A closed loop re-issuing the
+    same task can also keep one command and update it in place with set_velocity.
+
+    params:
+    + definitions (optional): list of TaskDefinition
+    """
+
+    def __init__(self, definitions=()):
+        self._definitions = dict()
+        self._prototypes = dict()  # maps (name, force_limit, torque_limit) to (command, speed)
+        self._lock = threading.Lock()
+        for definition in definitions:
+            self.register(definition)
+
+    def register(self, definition):
+        """Add or replace a TaskDefinition."""
+        with self._lock:
+            self._definitions[definition.name] = definition
+            for key in [key for key in self._prototypes if key[0] == definition.name]:
+                del self._prototypes[key]
+
+    def __contains__(self, name):
+        return name in self._definitions
+
+    @property
+    def names(self):
+        return list(self._definitions)
+
+    def definition(self, name):
+        return self._definitions[name]
+
+    def _prototype(self, name, force_limit, torque_limit):
+        definition = self._definitions[name]
+        force_limit, torque_limit = definition.limits(force_limit, torque_limit)
+        key = (name, force_limit, torque_limit)
+        with self._lock:
+            prototype = self._prototypes.get(key)
+            if prototype is None:
+                prototype = self._prototypes[key] = (
+                    definition.build(force_limit, torque_limit),
+                    definition.speed_limit(force_limit, torque_limit))
+            return prototype
+
+    def command(self, name, velocity_normalized, force_limit=40, torque_limit=5, end_time=None):
+        """Return a new RobotCommand of a task.
+
+        params:
+        + name: name of a registered task
+        + velocity_normalized: normalized task velocity in range [-1.0, 1.0]
+        + force_limit (optional): max force along the task dimension, unless the task fixes it
+        + torque_limit (optional): max torque about the task axis, unless the task fixes it
+        + end_time (optional): robot clock Timestamp at which the command ends
+        """
+        prototype, speed_limit = self._prototype(name, force_limit, torque_limit)
+        command = robot_command_pb2.RobotCommand()
+        command.CopyFrom(prototype)
+        self._patch(command, self._definitions[name], speed_limit, velocity_normalized, end_time)
+        return command
+
+    def set_velocity(self, command, name, velocity_normalized, force_limit=40, torque_limit=5,
+                     end_time=None):
+        """Update, in place, the speed and end time of a command returned by command()."""
+        speed_limit = self._prototype(name, force_limit, torque_limit)[1]
+        self._patch(command, self._definitions[name], speed_limit, velocity_normalized, end_time)
+        return command
+
+    @staticmethod
+    def _patch(command, definition, speed_limit, velocity_normalized, end_time):
+        request = command.full_body_command.constrained_manipulation_request
+        velocity_normalized = max(min(velocity_normalized, 1.0), -1.0)
+        if definition.speed == "rotational":
+            request.rotational_speed = velocity_normalized * speed_limit
+        elif definition.speed == "tangential":
+            request.tangential_speed = velocity_normalized * speed_limit
+        if end_time is not None:
+            request.end_time.CopyFrom(end_time)
+
+
+TASK_REGISTRY = TaskRegistry(TASK_DEFINITIONS)
@@ -0,0 +1,357 @@
+"""2D seed frame costmap of a GraphNav map, built from the waypoint snapshot point clouds.
+
+Every anchored waypoint's cloud is split into floor points, which mark cells as observed free,
+and points between min_obstacle_height and max_obstacle_height above the floor, which mark cells
+as occupied. The floor height is estimated per waypoint from the cloud around it. Occupied cells
+are inflated by the robot radius:
+  - LETHAL: within robot_radius of an obstacle, the robot body would collide.
+  - 1 to 253: within inflation_radius of an obstacle, decreasing with the distance.
+  - FREE: observed, away from obstacles.
+  - UNKNOWN: never observed.
+
+The costmap is stored in the map cache directory next to the map as .npy files that are
+memory-mapped when loaded. The cells each waypoint contributed are stored too, so when snapshot
+files change only those snapshots are processed again:
+
+    costmap = Costmap.for_map("maps/cit121/downloaded_graph")
+    costmap.is_free(x, y)
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+from utils.map_cache import MapCache
+from utils.map_loader import WAYPOINT_SNAPSHOT_DIR, get_map_loader
+from utils.point_cloud import load_waypoint_clouds
+
+COSTMAP_VERSION = 1
+FREE = 0
+LETHAL = 254
+UNKNOWN = 255
+
+_META_FILE_NAME = "costmap.json"
+_COSTS_FILE_NAME = "costmap_costs.npy"
+_OCCUPIED_FILE_NAME = "costmap_occupied.npy"
+_OBSERVED_FILE_NAME = "costmap_observed.npy"
+_CELLS_FILE_NAME = "costmap_cells.npz"
+
+
+class CostmapParams(object):
+    """Parameters of a costmap; a costmap is rebuilt when they change.
+
+    params:
+    + resolution (optional): side of a cell, in meters
+    + robot_radius (optional): cells closer than this to an obstacle are LETHAL
+    + inflation_radius (optional): cells closer than this to an obstacle have a cost
+    + min_obstacle_height (optional): points lower than this above the floor are floor
+    + max_obstacle_height (optional): points higher than this above the floor are ignored
+    + max_range (optional): points farther than this from their waypoint are ignored, the floor
+                            height estimate does not hold far from the waypoint
+    + margin (optional): meters of unknown cells kept around the observed area
+    """
+
+    def __init__(self, resolution=0.1, robot_radius=0.35, inflation_radius=1.0,
+                 min_obstacle_height=0.2, max_obstacle_height=1.0, max_range=4.0, margin=1.0):
+        self.resolution = resolution
+        self.robot_radius = robot_radius
+        self.inflation_radius = inflation_radius
+        self.min_obstacle_height = min_obstacle_height
+        self.max_obstacle_height = max_obstacle_height
+        self.max_range = max_range
+        self.margin = margin
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def floor_height(heights, bin_size=0.05):
+    """Estimate the floor height of a cloud as its most common height among the lowest half."""
+    low = heights[heights <= np.median(heights)]
+    edges = np.arange(low.min(), low.max() + 2 * bin_size, bin_size)
+    counts, edges = np.histogram(low, bins=edges)
+    return float(edges[np.argmax(counts)] + bin_size / 2)
+
+
+class Costmap(object):
+    """Seed frame costmap: costs[row, col] is the cost of the cell whose lower left corner is
+    origin + (col, row) * resolution."""
+
+    def __init__(self, costs, occupied, observed, origin, params, waypoint_cells=None,
+                 snapshot_hashes=None):
+        self.costs = costs  # (rows, cols) uint8
+        self.occupied = occupied  # (rows, cols) uint16, number of waypoints seeing an obstacle
+        self.observed = observed  # (rows, cols) uint16, number of waypoints seeing the cell
+        self.origin = tuple(float(value) for value in origin)
+        self.params = params
+        # Maps waypoint id to the (occupied, observed) flat cell indices it contributed.
+        self.waypoint_cells = waypoint_cells if waypoint_cells is not None else dict()
+        # Maps waypoint id to the sha1 of its snapshot file.
+        self.snapshot_hashes = snapshot_hashes if snapshot_hashes is not None else dict()
+
+    @property
+    def resolution(self):
+        return self.params.resolution
+
+    @property
+    def shape(self):
+        return self.costs.shape
+
+    def world_to_cell(self, x, y):
+        """Return the (row, col) of the cell containing (x, y), or None outside the costmap."""
+        col = int(np.floor((x - self.origin[0]) / self.resolution))
+        row = int(np.floor((y - self.origin[1]) / self.resolution))
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row, col
+        return None
+
+    def cell_to_world(self, row, col):
+        """Return the (x, y) of the center of a cell."""
+        return (self.origin[0] + (col + 0.5) * self.resolution,
+                self.origin[1] + (row + 0.5) * self.resolution)
+
+    def cost_at(self, x, y):
+        """Return the cost of the cell containing (x, y), UNKNOWN outside the costmap."""
+        cell = self.world_to_cell(x, y)
+        return int(self.costs[cell]) if cell is not None else UNKNOWN
+
+    def is_free(self, x, y, allow_unknown=False):
+        """Return True if the robot can stand at (x, y) without colliding with the map."""
+        cost = self.cost_at(x, y)
+        return cost < LETHAL or (allow_unknown and cost == UNKNOWN)
+
+    def _add_cells(self, occupied_cells, observed_cells, sign):
+        """Add (sign 1) or remove (sign -1) the cells one waypoint contributed."""
+        for grid, cells in ((self.occupied, occupied_cells), (self.observed, observed_cells)):
+            # Cell indices are unique per waypoint, so the fancy indexed update is exact.
+            flat = grid.reshape(-1)
+            if sign > 0:
+                flat[cells] += np.uint16(1)
+            else:
+                flat[cells] -= np.uint16(1)
+
+    def _waypoint_cells(self, points, seed_tform_waypoint):
+        """Return the (occupied, observed) flat indices of the cells a waypoint cloud touches,
+        or None if some fall outside the costmap."""
+        params = self.params
+        x, y = seed_tform_waypoint.position.x, seed_tform_waypoint.position.y
+        distance = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        points = points[distance <= params.max_range]
+        distance = distance[distance <= params.max_range]
+        heights = points[:, 2] - floor_height(points[:, 2]) if len(points) else points[:, 2]
+        keep = heights <= params.max_obstacle_height
+        # The robot stood at the waypoint, so its footprint is free even though the sensors do
+        # not see it, and points inside it are the robot itself.
+        footprint = np.mgrid[-params.robot_radius:params.robot_radius + 1e-9:params.resolution,
+                             -params.robot_radius:params.robot_radius + 1e-9:params.resolution]
+        footprint = footprint.reshape(2, -1).T
+        footprint = footprint[np.hypot(footprint[:, 0], footprint[:, 1]) <= params.robot_radius]
+        xy = np.concatenate([points[keep, :2], footprint + (x, y)])
+        cols = np.floor((xy[:, 0] - self.origin[0]) / self.resolution).astype(np.int64)
+        rows = np.floor((xy[:, 1] - self.origin[1]) / self.resolution).astype(np.int64)
+        if rows.min() < 0 or cols.min() < 0 or rows.max() >= self.shape[0] or \
+                cols.max() >= self.shape[1]:
+            return None
+        cells = rows * self.shape[1] + cols
+        obstacle = np.zeros(len(cells), dtype=bool)
+        obstacle[:keep.sum()] = ((heights[keep] >= params.min_obstacle_height) &
+                                 (distance[keep] > params.robot_radius))
+        return np.unique(cells[obstacle]), np.unique(cells)
+
+    def update_costs(self):
+        """Recompute the costs from the occupied and observed counts."""
+        params = self.params
+        occupied = self.occupied > 0
+        # Distance, in meters, from every cell to the nearest occupied cell.
+        distance = cv2.distanceTransform(np.where(occupied, 0, 255).astype(np.uint8), cv2.DIST_L2,
+                                         cv2.DIST_MASK_PRECISE) * params.resolution
+        costs = np.full(self.shape, FREE, dtype=np.uint8)
+        inflated = distance < params.inflation_radius
+        if params.inflation_radius > params.robot_radius:
+            decay = ((params.inflation_radius - distance[inflated]) /
+                     (params.inflation_radius - params.robot_radius))
+            costs[inflated] = np.clip(np.rint(253 * decay), 1, 253).astype(np.uint8)
+        costs[(self.observed == 0) & ~occupied] = UNKNOWN
+        costs[distance <= params.robot_radius] = LETHAL
+        self.costs[...] = costs
+
+    @staticmethod
+    def build(clouds, seed_tform_waypoints, params=None, snapshot_hashes=None):
+        """Build a costmap from seed frame clouds.
+
+        params:
+        + clouds: maps waypoint id to its (N, 3) seed frame cloud
+        + seed_tform_waypoints: maps waypoint id to its anchor's geometry_pb2.SE3Pose
+        + params (optional): CostmapParams
+        + snapshot_hashes (optional): maps waypoint id to the hash of its snapshot
+        """
+        params = params if params is not None else CostmapParams()
+        clouds = {waypoint_id: points for waypoint_id, points in clouds.items() if len(points)}
+        if clouds:
+            # Every waypoint covers at most max_range around it.
+            xy = np.array([(seed_tform_waypoints[waypoint_id].position.x,
+                            seed_tform_waypoints[waypoint_id].position.y)
+                           for waypoint_id in clouds])
+            low = xy.min(axis=0) - params.max_range - params.margin
+            high = xy.max(axis=0) + params.max_range + params.margin
+        else:
+            low, high = np.zeros(2), np.zeros(2)
+        cols, rows = np.maximum(1, np.ceil((high - low) / params.resolution).astype(int))
+        costmap = Costmap(np.empty((rows, cols), dtype=np.uint8),
+                          np.zeros((rows, cols), dtype=np.uint16),
+                          np.zeros((rows, cols), dtype=np.uint16), low, params,
+                          snapshot_hashes=dict(snapshot_hashes or {}))
+        for waypoint_id, points in clouds.items():
+            cells = costmap._waypoint_cells(points, seed_tform_waypoints[waypoint_id])
+            costmap.waypoint_cells[waypoint_id] = cells
+            costmap._add_cells(cells[0], cells[1], 1)
+        costmap.update_costs()
+        return costmap
+
+    def update_waypoints(self, clouds, seed_tform_waypoints, snapshot_hashes=None,
+                         removed=()):
+        """Replace the contribution of some waypoints, recomputing the costs.
+
+        Returns False, without changing the costmap, if a cloud falls outside of it; it must then
+        be built again.
+        """
+        new_cells = dict()
+        for waypoint_id, points in clouds.items():
+            cells = self._waypoint_cells(points, seed_tform_waypoints[waypoint_id])
+            if cells is None:
+                return False
+            new_cells[waypoint_id] = cells
+        for waypoint_id in list(removed) + list(new_cells):
+            old = self.waypoint_cells.pop(waypoint_id, None)
+            if old is not None:
+                self._add_cells(old[0], old[1], -1)
+            self.snapshot_hashes.pop(waypoint_id, None)
+        for waypoint_id, cells in new_cells.items():
+            self.waypoint_cells[waypoint_id] = cells
+            self._add_cells(cells[0], cells[1], 1)
+        self.snapshot_hashes.update(snapshot_hashes or {})
+        self.update_costs()
+        return True
+
+    def save(self, directory, files=None):
+        """Write the costmap into directory; files is the map file manifest it was built from."""
+        os.makedirs(directory, exist_ok=True)
+        for file_name, array in ((_COSTS_FILE_NAME, self.costs),
+                                 (_OCCUPIED_FILE_NAME, self.occupied),
+                                 (_OBSERVED_FILE_NAME, self.observed)):
+            full_name = os.path.join(directory, file_name)
+            # Write to a temporary file first so an interrupted run never leaves a truncated file.
+            np.save(full_name + ".tmp.npy", np.asarray(array))
+            os.replace(full_name + ".tmp.npy", full_name)
+        waypoint_ids = list(self.waypoint_cells)
+        cells = {"waypoint_ids": np.array(waypoint_ids, dtype=str)}
+        for i, waypoint_id in enumerate(waypoint_ids):
+            cells["occupied_{}".format(i)], cells["observed_{}".format(i)] = \
+                self.waypoint_cells[waypoint_id]
+        full_name = os.path.join(directory, _CELLS_FILE_NAME)
+        np.savez(full_name + ".tmp.npz", **cells)
+        os.replace(full_name + ".tmp.npz", full_name)
+        meta = {
+            "version": COSTMAP_VERSION,
+            "origin": list(self.origin),
+            "params": self.params.to_dict(),
+            "snapshot_hashes": self.snapshot_hashes,
+            "files": files or {},
+        }
+        # The metadata is written last; it is what marks the costmap files as valid.
+        full_name = os.path.join(directory, _META_FILE_NAME)
+        with open(full_name + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(full_name + ".tmp", full_name)
+
+    def _save_to_cache(self, directory, files):
+        """Save into the map cache directory; returns False, keeping the costmap in memory only,
+        if the directory is not writable."""
+        try:
+            self.save(directory, files)
+        except OSError as err:
+            print("Could not write the costmap in {}: {}".format(directory, err))
+            return False
+        return True
+
+    @staticmethod
+    def load(directory):
+        """Return the costmap saved in directory, memory-mapped, and its file manifest.
+
+        Returns (None, None) if there is no valid costmap.
+        """
+        try:
+            with open(os.path.join(directory, _META_FILE_NAME), "r") as f:
+                meta = json.load(f)
+            if meta.get("version") != COSTMAP_VERSION:
+                return None, None
+            # Memory-map the grids copy-on-write: an incremental update only changes the copy in
+            # memory, the files only change through save(), which writes the metadata last.
+            costs, occupied, observed = [
+                np.load(os.path.join(directory, file_name), mmap_mode="c")
+                for file_name in (_COSTS_FILE_NAME, _OCCUPIED_FILE_NAME, _OBSERVED_FILE_NAME)
+            ]
+            with np.load(os.path.join(directory, _CELLS_FILE_NAME)) as cells:
+                waypoint_cells = {
+                    str(waypoint_id): (cells["occupied_{}".format(i)],
+                                       cells["observed_{}".format(i)])
+                    for i, waypoint_id in enumerate(cells["waypoint_ids"])
+                }
+        except (OSError, ValueError, KeyError):
+            return None, None
+        costmap = Costmap(costs, occupied, observed, meta["origin"],
+                          CostmapParams(**meta["params"]), waypoint_cells,
+                          meta["snapshot_hashes"])
+        return costmap, meta["files"]
+
+    @staticmethod
+    def for_map(path, params=None, max_workers=None):
+        """Return the costmap of the map at path, from the map cache directory when it is valid.
+
+        Only the waypoints whose snapshot file changed are processed again.
+        """
+        params = params if params is not None else CostmapParams()
+        map_loader = get_map_loader(path)
+        map_cache = MapCache(path)
+        costmap, previous_files = Costmap.load(map_cache.cache_dir)
+        files = map_cache.file_hashes(previous_files)
+        seed_tform_waypoints = {
+            waypoint_id: anchor.seed_tform_waypoint
+            for waypoint_id, anchor in map_loader.anchors.items()
+        }
+        snapshot_hashes = {
+            waypoint.id: files[os.path.join(WAYPOINT_SNAPSHOT_DIR, waypoint.snapshot_id)][2]
+            for waypoint in map_loader.graph.waypoints
+            if waypoint.id in seed_tform_waypoints and os.path.join(
+                WAYPOINT_SNAPSHOT_DIR, waypoint.snapshot_id) in files
+        }
+
+        if costmap is not None and costmap.params.to_dict() == params.to_dict():
+            changed = [
+                waypoint_id for waypoint_id, snapshot_hash in snapshot_hashes.items()
+                if costmap.snapshot_hashes.get(waypoint_id) != snapshot_hash
+            ]
+            removed = [
+                waypoint_id for waypoint_id in costmap.snapshot_hashes
+                if waypoint_id not in snapshot_hashes
+            ]
+            if not changed and not removed:
+                return costmap
+            clouds = load_waypoint_clouds(path, params.resolution / 2, max_workers, map_loader,
+                                          waypoint_ids=changed)
+            if costmap.update_waypoints(clouds, seed_tform_waypoints,
+                                        {waypoint_id: snapshot_hashes[waypoint_id]
+                                         for waypoint_id in changed}, removed):
+                print("Updated the costmap for {} changed waypoints".format(
+                    len(changed) + len(removed)))
+                costmap._save_to_cache(map_cache.cache_dir, files)
+                return costmap
+
+        print("Building the costmap in {}".format(map_cache.cache_dir))
+        clouds = load_waypoint_clouds(path, params.resolution / 2, max_workers, map_loader)
+        costmap = Costmap.build(clouds, seed_tform_waypoints, params, snapshot_hashes)
+        if not costmap._save_to_cache(map_cache.cache_dir, files):
+            return costmap
+        return Costmap.load(map_cache.cache_dir)[0]
@@ -0,0 +1,365 @@
+"""Local stand-in for the GraphNav gRPC service, for exercising the helpers without a robot.
+
+FakeGraphNavServer runs a real gRPC server on localhost, so the SDK's GraphNavClient talks to it
+exactly as it would to Spot:
+
+    with FakeGraphNavServer() as server:
+        graph_nav_client = server.create_client()
+        graph_nav_client.upload_graph(graph=graph)
+
+The servicer keeps the uploaded graph and snapshots in memory, counts calls per RPC and can be
+told to add latency or to fail snapshot uploads, e.g. to exercise resuming an upload.
+Navigation commands are simulated: every new command reaches navigation_status after
+navigation_duration seconds, which lets the feedback latency of a client be measured, or follows
+a navigation_script of statuses. Localizing puts the robot at the initial guess waypoint, or at
+localization_waypoint_id when localizing to a fiducial.
+
+FakeServicerBase, shared with the other fake services of utils/fake_robot.py, adds latency to
+every call, per RPC latencies and injected failures:
+
+    servicer = FakeGraphNavServicer(latency=0.01, latencies={"NavigateTo": 0.2})
+    servicer.inject_failure("SetLocalization", count=2)  # the next 2 calls fail with UNAVAILABLE
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+import grpc
+
+from bosdyn.api import header_pb2, robot_state_pb2
+from bosdyn.api.graph_nav import graph_nav_pb2, graph_nav_service_pb2_grpc, map_pb2
+from bosdyn.client.frame_helpers import BODY_FRAME_NAME, ODOM_FRAME_NAME, VISION_FRAME_NAME
+from bosdyn.client.graph_nav import GraphNavClient
+from bosdyn.util import RobotTimeConverter
+
+
+def _set_ok_header(response):
+    response.header.error.code = header_pb2.CommonError.CODE_OK
+    return response
+
+
+def _join_chunks(request_iterator):
+    return b"".join(request.chunk.data for request in request_iterator)
+
+
+def static_kinematic_state():
+    """Return the KinematicState of a robot standing still at the origin of odom and vision."""
+    kinematic_state = robot_state_pb2.KinematicState()
+    snapshot = kinematic_state.transforms_snapshot
+    snapshot.child_to_parent_edge_map[BODY_FRAME_NAME].parent_frame_name = ""
+    for frame_name in (ODOM_FRAME_NAME, VISION_FRAME_NAME):
+        edge = snapshot.child_to_parent_edge_map[frame_name]
+        edge.parent_frame_name = BODY_FRAME_NAME
+        edge.parent_tform_child.rotation.w = 1.0
+    return kinematic_state
+
+
+class FakeServicerBase(object):
+    """Latency, failure injection and call counting shared by the fake services.
+
+    params:
+    + latency (optional): seconds added to every RPC
+    + latencies (optional): dict of RPC name to seconds added to that RPC instead of latency
+    + failures (optional): dict of RPC name to the number of its next calls that fail with
+                           UNAVAILABLE
+    """
+
+    def __init__(self, latency=0.0, latencies=None, failures=None):
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.call_counts = collections.Counter()
+        self._failures = dict()  # maps RPC name to [calls left to fail, status code]
+        self._lock = threading.Lock()
+        for name, count in (failures or {}).items():
+            self.inject_failure(name, count)
+
+    def inject_failure(self, name, count=1, code=grpc.StatusCode.UNAVAILABLE):
+        """Make the next count calls of the RPC name fail with the gRPC status code."""
+        with self._lock:
+            self._failures[name] = [count, code]
+
+    def _start_call(self, name, context=None):
+        """Count the call, sleep its latency and abort it if a failure is injected."""
+        with self._lock:
+            self.call_counts[name] += 1
+            failure = self._failures.get(name)
+            fail = failure is not None and failure[0] > 0
+            if fail:
+                failure[0] -= 1
+        latency = self.latencies.get(name, self.latency)
+        if latency:
+            time.sleep(latency)
+        if fail and context is not None:
+            context.abort(failure[1], "Injected {} failure.".format(name))
+
+
+class FakeGraphNavServicer(FakeServicerBase, graph_nav_service_pb2_grpc.GraphNavServiceServicer):
+    """In-memory GraphNav service.
+
+    params:
+    + latency: seconds added to every RPC
+    + fail_snapshot_uploads_after (optional): number of snapshot uploads that succeed before every
+                            following snapshot upload fails with UNAVAILABLE
+    + navigation_duration (optional): seconds a navigation command takes to finish
+    + navigation_status (optional): NavigationFeedbackResponse status a finished command reports
+    + route_length (optional): meters of route the simulated robot travels per command
+    + navigation_script (optional): list of (seconds, status) a navigation command goes through,
+                            each status reported from its seconds after the command started;
+                            replaces navigation_duration and navigation_status
+    + localization_waypoint_id (optional): waypoint the robot localizes to from a fiducial, the
+                            first waypoint of the graph by default
+    + kinematic_state (optional): function returning the robot_state_pb2.KinematicState reported
+                            with the localization, a robot still at the origin by default
+    + latencies, failures (optional): see FakeServicerBase
+    """
+
+    def __init__(self, latency=0.0, fail_snapshot_uploads_after=None, navigation_duration=2.0,
+                 navigation_status=graph_nav_pb2.NavigationFeedbackResponse.STATUS_REACHED_GOAL,
+                 route_length=5.0, navigation_script=None, localization_waypoint_id=None,
+                 kinematic_state=None, latencies=None, failures=None):
+        super(FakeGraphNavServicer, self).__init__(latency, latencies, failures)
+        self.fail_snapshot_uploads_after = fail_snapshot_uploads_after
+        if navigation_script is not None:
+            navigation_duration = navigation_script[-1][0]
+            navigation_status = navigation_script[-1][1]
+        self.navigation_duration = navigation_duration
+        self.navigation_status = navigation_status
+        self.navigation_script = navigation_script
+        self.route_length = route_length
+        self.localization_waypoint_id = localization_waypoint_id
+        self.kinematic_state = kinematic_state if kinematic_state is not None else (
+            static_kinematic_state)
+        # Maps command id to the time it finishes, i.e. when its status becomes terminal.
+        self.navigation_end_times = dict()
+        self.localization = None  # nav_pb2.Localization once the robot localized
+        self.graph = map_pb2.Graph()
+        self.waypoint_snapshots = dict()  # maps id to waypoint snapshot
+        self.edge_snapshots = dict()  # maps id to edge snapshot
+        self.max_concurrent_uploads = 0
+        self._concurrent_uploads = 0
+        self._snapshot_uploads = 0
+
+    def _unknown_snapshot_ids(self):
+        unknown_waypoint_snapshot_ids = [
+            waypoint.snapshot_id for waypoint in self.graph.waypoints
+            if waypoint.snapshot_id and waypoint.snapshot_id not in self.waypoint_snapshots
+        ]
+        unknown_edge_snapshot_ids = [
+            edge.snapshot_id for edge in self.graph.edges
+            if edge.snapshot_id and edge.snapshot_id not in self.edge_snapshots
+        ]
+        return unknown_waypoint_snapshot_ids, unknown_edge_snapshot_ids
+
+    def _upload_graph(self, request):
+        with self._lock:
+            if request.replace_graph:
+                self.graph = map_pb2.Graph()
+            # Like the robot, add the new waypoints and edges to the graph, replacing known ones.
+            graph = map_pb2.Graph()
+            waypoints = {waypoint.id: waypoint for waypoint in self.graph.waypoints}
+            waypoints.update((waypoint.id, waypoint) for waypoint in request.graph.waypoints)
+            graph.waypoints.extend(waypoints.values())
+            edges = {
+                (edge.id.from_waypoint, edge.id.to_waypoint): edge for edge in self.graph.edges
+            }
+            edges.update(((edge.id.from_waypoint, edge.id.to_waypoint), edge)
+                         for edge in request.graph.edges)
+            graph.edges.extend(edges.values())
+            graph.anchoring.CopyFrom(request.graph.anchoring if request.graph.HasField("anchoring")
+                                     else self.graph.anchoring)
+            self.graph = graph
+            unknown_waypoint_snapshot_ids, unknown_edge_snapshot_ids = self._unknown_snapshot_ids()
+        return _set_ok_header(
+            graph_nav_pb2.UploadGraphResponse(
+                status=graph_nav_pb2.UploadGraphResponse.STATUS_OK,
+                unknown_waypoint_snapshot_ids=unknown_waypoint_snapshot_ids,
+                unknown_edge_snapshot_ids=unknown_edge_snapshot_ids))
+
+    def UploadGraph(self, request, context):
+        self._start_call("UploadGraph", context)
+        return self._upload_graph(request)
+
+    def UploadGraphStreaming(self, request_iterator, context):
+        self._start_call("UploadGraph", context)
+        request = graph_nav_pb2.UploadGraphRequest()
+        request.ParseFromString(_join_chunks(request_iterator))
+        return self._upload_graph(request)
+
+    def _upload_snapshot(self, name, request_iterator, context, message_type, snapshots):
+        with self._lock:
+            self._concurrent_uploads += 1
+            self.max_concurrent_uploads = max(self.max_concurrent_uploads,
+                                              self._concurrent_uploads)
+        try:
+            self._start_call(name, context)
+            data = _join_chunks(request_iterator)
+            with self._lock:
+                if (self.fail_snapshot_uploads_after is not None and
+                        self._snapshot_uploads >= self.fail_snapshot_uploads_after):
+                    context.abort(grpc.StatusCode.UNAVAILABLE, "Injected snapshot upload failure.")
+                self._snapshot_uploads += 1
+            snapshot = message_type()
+            snapshot.ParseFromString(data)
+            with self._lock:
+                snapshots[snapshot.id] = snapshot
+        finally:
+            with self._lock:
+                self._concurrent_uploads -= 1
+
+    def UploadWaypointSnapshot(self, request_iterator, context):
+        self._upload_snapshot("UploadWaypointSnapshot", request_iterator, context,
+                              map_pb2.WaypointSnapshot, self.waypoint_snapshots)
+        return _set_ok_header(
+            graph_nav_pb2.UploadWaypointSnapshotResponse(
+                status=graph_nav_pb2.UploadWaypointSnapshotResponse.STATUS_OK))
+
+    def UploadEdgeSnapshot(self, request_iterator, context):
+        self._upload_snapshot("UploadEdgeSnapshot", request_iterator, context,
+                              map_pb2.EdgeSnapshot, self.edge_snapshots)
+        return _set_ok_header(graph_nav_pb2.UploadEdgeSnapshotResponse())
+
+    def GetLocalizationState(self, request, context):
+        self._start_call("GetLocalizationState", context)
+        response = graph_nav_pb2.GetLocalizationStateResponse()
+        with self._lock:
+            if self.localization is not None:
+                response.localization.CopyFrom(self.localization)
+        response.robot_kinematics.CopyFrom(self.kinematic_state())
+        return _set_ok_header(response)
+
+    def SetLocalization(self, request, context):
+        self._start_call("SetLocalization", context)
+        response = graph_nav_pb2.SetLocalizationResponse()
+        with self._lock:
+            waypoint_id = request.initial_guess.waypoint_id
+            if not waypoint_id:
+                # Localizing to a fiducial.
+                waypoint_id = self.localization_waypoint_id or (
+                    self.graph.waypoints[0].id if self.graph.waypoints else "")
+            if not any(waypoint.id == waypoint_id for waypoint in self.graph.waypoints):
+                response.status = response.STATUS_UNKNOWN_WAYPOINT if waypoint_id else (
+                    response.STATUS_NO_MATCHING_FIDUCIAL)
+                return _set_ok_header(response)
+            self.localization = response.localization
+            self.localization.waypoint_id = waypoint_id
+            if request.initial_guess.HasField("waypoint_tform_body"):
+                self.localization.waypoint_tform_body.CopyFrom(
+                    request.initial_guess.waypoint_tform_body)
+            else:
+                self.localization.waypoint_tform_body.rotation.w = 1.0
+            self.localization.timestamp.GetCurrentTime()
+        response.status = response.STATUS_OK
+        return _set_ok_header(response)
+
+    def DownloadGraph(self, request, context):
+        self._start_call("DownloadGraph", context)
+        response = graph_nav_pb2.DownloadGraphResponse()
+        with self._lock:
+            response.graph.CopyFrom(self.graph)
+        return _set_ok_header(response)
+
+    def _navigate(self, name, request, response, context):
+        self._start_call(name, context)
+        with self._lock:
+            command_id = request.command_id
+            if command_id not in self.navigation_end_times:
+                # A new command; continuing an existing one keeps its end time.
+                command_id = len(self.navigation_end_times) + 1
+                self.navigation_end_times[command_id] = time.time() + self.navigation_duration
+        response.status = response.STATUS_OK
+        response.command_id = command_id
+        return _set_ok_header(response)
+
+    def NavigateTo(self, request, context):
+        return self._navigate("NavigateTo", request, graph_nav_pb2.NavigateToResponse(), context)
+
+    def NavigateRoute(self, request, context):
+        return self._navigate("NavigateRoute", request, graph_nav_pb2.NavigateRouteResponse(),
+                              context)
+
+    def NavigateToAnchor(self, request, context):
+        return self._navigate("NavigateToAnchor", request,
+                              graph_nav_pb2.NavigateToAnchorResponse(), context)
+
+    def NavigationFeedback(self, request, context):
+        self._start_call("NavigationFeedback", context)
+        response = graph_nav_pb2.NavigationFeedbackResponse(command_id=request.command_id)
+        with self._lock:
+            end_time = self.navigation_end_times.get(request.command_id)
+        if end_time is None:
+            response.status = response.STATUS_UNKNOWN
+        elif time.time() >= end_time:
+            response.status = self.navigation_status
+        elif self.navigation_script is not None:
+            elapsed = time.time() - (end_time - self.navigation_duration)
+            response.status = response.STATUS_FOLLOWING_ROUTE
+            for seconds, status in self.navigation_script:
+                if elapsed >= seconds:
+                    response.status = status
+            response.remaining_route_length = (self.route_length * (end_time - time.time()) /
+                                               self.navigation_duration)
+        else:
+            response.status = response.STATUS_FOLLOWING_ROUTE
+            if self.navigation_duration > 0:
+                response.remaining_route_length = (self.route_length * (end_time - time.time()) /
+                                                   self.navigation_duration)
+        return _set_ok_header(response)
+
+    def ClearGraph(self, request, context):
+        self._start_call("ClearGraph", context)
+        with self._lock:
+            self.graph = map_pb2.Graph()
+            self.waypoint_snapshots.clear()
+            self.edge_snapshots.clear()
+        return _set_ok_header(
+            graph_nav_pb2.ClearGraphResponse(status=graph_nav_pb2.ClearGraphResponse.STATUS_OK))
+
+
+class FakeTimeSyncEndpoint(object):
+    """Time sync endpoint for a robot whose clock matches the local clock."""
+
+    clock_identifier = "fake-robot-clock"
+
+    def get_robot_time_converter(self):
+        return RobotTimeConverter(0)
+
+    def robot_timestamp_from_local_secs(self, local_time_secs):
+        return self.get_robot_time_converter().robot_timestamp_from_local_secs(local_time_secs)
+
+
+class FakeGraphNavServer(object):
+    """gRPC server on a free localhost port serving a FakeGraphNavServicer."""
+
+    def __init__(self, servicer=None, max_workers=16):
+        self.servicer = servicer if servicer is not None else FakeGraphNavServicer()
+        self._server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=max_workers))
+        graph_nav_service_pb2_grpc.add_GraphNavServiceServicer_to_server(
+            self.servicer, self._server)
+        self.port = self._server.add_insecure_port("localhost:0")
+
+    @property
+    def address(self):
+        return "localhost:{}".format(self.port)
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self):
+        self._server.stop(grace=None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def create_client(self):
+        """Return a GraphNavClient connected to this server."""
+        graph_nav_client = GraphNavClient()
+        graph_nav_client.channel = grpc.insecure_channel(self.address)
+        # Navigation commands need a time sync endpoint to set their end time.
+        graph_nav_client._timesync_endpoint = FakeTimeSyncEndpoint()
+        return graph_nav_client
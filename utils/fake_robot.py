@@ -0,0 +1,630 @@
+"""Fake Spot on a localhost gRPC server, for running the utilities and skills without a robot.
+
+FakeRobotServer serves, on one free localhost port, the services the utilities of this repo use:
+GraphNav (FakeGraphNavServicer), RobotState, RobotCommand, Lease, Power, Image and
+ManipulationApi. They share a SimulatedRobot: motor power, the body standing at the origin of odom
+and vision, an arm holding a SimulatedDrawer handle, and a hand camera that sees a red handle.
+Commands finish after configurable durations, and every RPC can be given a latency or made to
+fail (see FakeServicerBase).
+
+FakeRobot stands in for bosdyn.client.robot.Robot: ensure_client returns the real SDK clients,
+connected to the server, so GraphNavInterface, open_drawer_skill, ... run unchanged:
+
+    with FakeRobotServer(latency=0.005) as server:
+        robot = FakeRobot(server.address)
+        graph_nav_interface = GraphNavInterface(robot, map_path)
+        graph_nav_interface._upload_graph_and_snapshots()
+        print(server.call_counts)
+        robot.shutdown()
+
+The simulation is kinematic only: the body does not move on mobility commands, they just report
+reaching their goal after move_seconds; constrained manipulation moves the drawer.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+
+import cv2
+import grpc
+import numpy as np
+
+from bosdyn.api import (arm_command_pb2, basic_command_pb2, gripper_command_pb2, image_pb2,
+                        lease_pb2, manipulation_api_pb2, power_pb2, robot_command_pb2,
+                        robot_id_pb2, robot_state_pb2)
+from bosdyn.api import (image_service_pb2_grpc, lease_service_pb2_grpc,
+                        manipulation_api_service_pb2_grpc, power_service_pb2_grpc,
+                        robot_command_service_pb2_grpc, robot_state_service_pb2_grpc)
+from bosdyn.api.graph_nav import graph_nav_service_pb2_grpc
+from bosdyn.client.frame_helpers import (BODY_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME,
+                                         ODOM_FRAME_NAME, VISION_FRAME_NAME)
+from bosdyn.client.graph_nav import GraphNavClient
+from bosdyn.client.image import ImageClient
+from bosdyn.client.lease import LeaseClient, LeaseWallet
+from bosdyn.client.manipulation_api_client import ManipulationApiClient
+from bosdyn.client.math_helpers import Quat, SE3Pose
+from bosdyn.client.power import PowerClient
+from bosdyn.client.power import (is_powered_on, power_off_motors, power_on_motors,
+                                  safe_power_off_motors)
+from bosdyn.client.processors import AddRequestHeader
+from bosdyn.client.robot import UnregisteredServiceNameError
+from bosdyn.client.robot_command import RobotCommandClient
+from bosdyn.client.robot_state import RobotStateClient, has_arm
+
+from utils.color_detector import RED_BGR
+from utils.fake_graph_nav import (FakeGraphNavServicer, FakeServicerBase, FakeTimeSyncEndpoint,
+                                  _set_ok_header)
+from utils.grasp_targeting import COLOR_SOURCE, DEPTH_SOURCE
+from utils.simulated_manipulation import SimulatedDrawer
+
+_CommandStatus = basic_command_pb2.RobotCommandFeedbackStatus
+_CAMERA_FRAME_NAME = "hand_color_image_sensor"
+# Camera x right, y down and z forward, expressed in the body frame: looking along body x.
+_BODY_TFORM_CAMERA = SE3Pose(0.8, 0.0, 0.5,
+                             Quat.from_matrix(np.array([[0, 0, 1], [-1, 0, 0], [0, -1, 0]])))
+
+
+def _identity_edge(snapshot, frame_name, parent_frame_name):
+    edge = snapshot.child_to_parent_edge_map[frame_name]
+    edge.parent_frame_name = parent_frame_name
+    edge.parent_tform_child.rotation.w = 1.0
+
+
+class SimulatedRobot(object):
+    """State shared by the fake services of one robot.
+
+    params:
+    + drawer (optional): SimulatedDrawer whose handle the hand holds, a free drawer by default
+    + powered_on (optional): whether the motors start powered on
+    + power_on_seconds (optional): seconds the motors take to power on
+    + stand_seconds (optional): seconds a stand command takes
+    + move_seconds (optional): seconds an se2 trajectory command takes to reach its goal
+    + arm_seconds (optional): seconds an arm or gripper command takes, unless its trajectory says
+    + grasp_seconds (optional): seconds a ManipulationApi grasp takes
+    + grasp_succeeds (optional): whether grasps succeed
+    + image_size (optional): (rows, cols) of the hand camera images
+    + handle_pixel (optional): (row, col) of the center of the red handle in the color image
+    + handle_depth (optional): meters from the camera to the handle
+    + wall_depth (optional): meters from the camera to everything else
+    """
+
+    def __init__(self, drawer=None, powered_on=False, power_on_seconds=0.5, stand_seconds=0.3,
+                 move_seconds=1.0, arm_seconds=0.5, grasp_seconds=1.0, grasp_succeeds=True,
+                 image_size=(480, 640), handle_pixel=(240, 320), handle_depth=0.6,
+                 wall_depth=0.65):
+        self.drawer = drawer if drawer is not None else SimulatedDrawer()
+        self.power_on_seconds = power_on_seconds
+        self.stand_seconds = stand_seconds
+        self.move_seconds = move_seconds
+        self.arm_seconds = arm_seconds
+        self.grasp_seconds = grasp_seconds
+        self.grasp_succeeds = grasp_succeeds
+        # Time the motors are (or will be) on, None while they are off.
+        self.motors_on_time = 0.0 if powered_on else None
+        self._commands = dict()  # maps command id to (start time, RobotCommand)
+        self._drawer_commands = self.drawer.command_client()
+        self._drawer_state = self.drawer.state_client()
+        self._lock = threading.Lock()
+        self._render_images(image_size, handle_pixel, handle_depth, wall_depth)
+
+    def _render_images(self, image_size, handle_pixel, handle_depth, wall_depth):
+        rows, cols = image_size
+        color = np.full((rows, cols, 3), 128, dtype=np.uint8)
+        depth = np.full((rows, cols), int(wall_depth * 1000), dtype=np.uint16)
+        row, col = handle_pixel
+        color[row - 10:row + 10, col - 40:col + 40] = RED_BGR
+        depth[row - 10:row + 10, col - 40:col + 40] = int(handle_depth * 1000)
+        _, jpeg = cv2.imencode(".jpg", color)
+        self.color_jpeg = jpeg.tobytes()
+        self.depth_raw = depth.tobytes()
+        self.image_size = image_size
+
+    def motor_power_state(self, now):
+        if self.motors_on_time is None:
+            return robot_state_pb2.PowerState.STATE_OFF
+        if now < self.motors_on_time:
+            return robot_state_pb2.PowerState.STATE_POWERING_ON
+        return robot_state_pb2.PowerState.STATE_ON
+
+    def power_on(self, now):
+        with self._lock:
+            if self.motors_on_time is None:
+                self.motors_on_time = now + self.power_on_seconds
+            return self.motors_on_time
+
+    def power_off(self):
+        with self._lock:
+            self.motors_on_time = None
+
+    def robot_state(self):
+        """Return the RobotState: the drawer's kinematics and manipulator state, and the power."""
+        state = self._drawer_state.get_robot_state()
+        snapshot = state.kinematic_state.transforms_snapshot
+        _identity_edge(snapshot, VISION_FRAME_NAME, ODOM_FRAME_NAME)
+        _identity_edge(snapshot, GRAV_ALIGNED_BODY_FRAME_NAME, BODY_FRAME_NAME)
+        state.power_state.motor_power_state = self.motor_power_state(time.time())
+        return state
+
+    def kinematic_state(self):
+        return self.robot_state().kinematic_state
+
+    def robot_command(self, command):
+        """Start a RobotCommand, returning its id."""
+        # Every command goes to the drawer: anything but a constrained manipulation releases it.
+        command_id = self._drawer_commands.robot_command(command)
+        full_body = command.full_body_command
+        if full_body.HasField("safe_power_off_request"):
+            self.power_off()
+        with self._lock:
+            self._commands[command_id] = (time.time(), command)
+        return command_id
+
+    def _duration(self, arm_command):
+        if arm_command.HasField("arm_cartesian_command"):
+            points = arm_command.arm_cartesian_command.pose_trajectory_in_task.points
+            if points:
+                duration = points[-1].time_since_reference
+                return duration.seconds + duration.nanos * 1e-9
+        return self.arm_seconds
+
+    def robot_command_feedback(self, command_id):
+        """Return the RobotCommandFeedbackResponse of a command started by robot_command."""
+        with self._lock:
+            start, command = self._commands.get(command_id, (None, None))
+        response = robot_command_pb2.RobotCommandFeedbackResponse()
+        if command is None:
+            return response
+        elapsed = time.time() - start
+        feedback = response.feedback
+        if command.HasField("full_body_command"):
+            full_body = command.full_body_command
+            if full_body.HasField("constrained_manipulation_request"):
+                response.CopyFrom(self._drawer_commands.robot_command_feedback(command_id))
+                response.feedback.full_body_feedback.status = _CommandStatus.STATUS_PROCESSING
+            elif full_body.HasField("safe_power_off_request"):
+                feedback.full_body_feedback.status = _CommandStatus.STATUS_PROCESSING
+                feedback.full_body_feedback.safe_power_off_feedback.status = (
+                    basic_command_pb2.SafePowerOffCommand.Feedback.STATUS_POWERED_OFF)
+            else:
+                feedback.full_body_feedback.status = _CommandStatus.STATUS_PROCESSING
+        if command.HasField("synchronized_command"):
+            self._synchronized_feedback(command.synchronized_command, elapsed,
+                                        feedback.synchronized_feedback)
+        return response
+
+    def _synchronized_feedback(self, command, elapsed, feedback):
+        if command.HasField("mobility_command"):
+            mobility = feedback.mobility_command_feedback
+            mobility.status = _CommandStatus.STATUS_PROCESSING
+            if command.mobility_command.HasField("stand_request"):
+                mobility.stand_feedback.status = (
+                    basic_command_pb2.StandCommand.Feedback.STATUS_IS_STANDING
+                    if elapsed >= self.stand_seconds else
+                    basic_command_pb2.StandCommand.Feedback.STATUS_IN_PROGRESS)
+            elif command.mobility_command.HasField("se2_trajectory_request"):
+                trajectory = mobility.se2_trajectory_feedback
+                arrived = elapsed >= self.move_seconds
+                trajectory.status = (trajectory.STATUS_AT_GOAL
+                                     if arrived else trajectory.STATUS_GOING_TO_GOAL)
+                trajectory.body_movement_status = (trajectory.BODY_STATUS_SETTLED
+                                                   if arrived else trajectory.BODY_STATUS_MOVING)
+        if command.HasField("arm_command"):
+            arm = feedback.arm_command_feedback
+            arm.status = _CommandStatus.STATUS_PROCESSING
+            arrived = elapsed >= self._duration(command.arm_command)
+            if command.arm_command.HasField("arm_cartesian_command"):
+                arm.arm_cartesian_feedback.status = (
+                    arm_command_pb2.ArmCartesianCommand.Feedback.STATUS_TRAJECTORY_COMPLETE
+                    if arrived else
+                    arm_command_pb2.ArmCartesianCommand.Feedback.STATUS_IN_PROGRESS)
+            elif command.arm_command.HasField("named_arm_position_command"):
+                arm.named_arm_position_feedback.status = (
+                    arm_command_pb2.NamedArmPositionsCommand.Feedback.STATUS_COMPLETE
+                    if arrived else
+                    arm_command_pb2.NamedArmPositionsCommand.Feedback.STATUS_IN_PROGRESS)
+        if command.HasField("gripper_command"):
+            gripper = feedback.gripper_command_feedback
+            gripper.status = _CommandStatus.STATUS_PROCESSING
+            gripper.claw_gripper_feedback.status = (
+                gripper_command_pb2.ClawGripperCommand.Feedback.STATUS_AT_GOAL
+                if elapsed >= self.arm_seconds else
+                gripper_command_pb2.ClawGripperCommand.Feedback.STATUS_IN_PROGRESS)
+
+    def image_sources(self):
+        """Return the image_pb2.ImageSource of the hand color camera and of its aligned depth."""
+        rows, cols = self.image_size
+        sources = []
+        for name, image_type in ((COLOR_SOURCE, image_pb2.ImageSource.IMAGE_TYPE_VISUAL),
+                                 (DEPTH_SOURCE, image_pb2.ImageSource.IMAGE_TYPE_DEPTH)):
+            source = image_pb2.ImageSource(name=name, rows=rows, cols=cols,
+                                           image_type=image_type)
+            if image_type == image_pb2.ImageSource.IMAGE_TYPE_DEPTH:
+                source.depth_scale = 1000.0
+            intrinsics = source.pinhole.intrinsics
+            intrinsics.focal_length.x = intrinsics.focal_length.y = 550.0
+            intrinsics.principal_point.x = cols / 2.0
+            intrinsics.principal_point.y = rows / 2.0
+            sources.append(source)
+        return sources
+
+    def image_response(self, source):
+        """Return the image_pb2.ImageResponse of a source of image_sources."""
+        rows, cols = self.image_size
+        response = image_pb2.ImageResponse(source=source,
+                                           status=image_pb2.ImageResponse.STATUS_OK)
+        shot = response.shot
+        shot.acquisition_time.GetCurrentTime()
+        shot.frame_name_image_sensor = _CAMERA_FRAME_NAME
+        snapshot = shot.transforms_snapshot
+        snapshot.child_to_parent_edge_map[BODY_FRAME_NAME].parent_frame_name = ""
+        _identity_edge(snapshot, ODOM_FRAME_NAME, BODY_FRAME_NAME)
+        _identity_edge(snapshot, VISION_FRAME_NAME, BODY_FRAME_NAME)
+        camera = snapshot.child_to_parent_edge_map[_CAMERA_FRAME_NAME]
+        camera.parent_frame_name = BODY_FRAME_NAME
+        camera.parent_tform_child.CopyFrom(_BODY_TFORM_CAMERA.to_proto())
+        image = shot.image
+        image.rows, image.cols = rows, cols
+        if source.name == DEPTH_SOURCE:
+            image.format = image_pb2.Image.FORMAT_RAW
+            image.pixel_format = image_pb2.Image.PIXEL_FORMAT_DEPTH_U16
+            image.data = self.depth_raw
+        else:
+            image.format = image_pb2.Image.FORMAT_JPEG
+            image.pixel_format = image_pb2.Image.PIXEL_FORMAT_RGB_U8
+            image.data = self.color_jpeg
+        return response
+
+    def grasp_state(self, elapsed):
+        if elapsed < self.grasp_seconds:
+            return manipulation_api_pb2.MANIP_STATE_MOVING_TO_GRASP
+        if self.grasp_succeeds:
+            return manipulation_api_pb2.MANIP_STATE_GRASP_SUCCEEDED
+        return manipulation_api_pb2.MANIP_STATE_GRASP_FAILED
+
+
+class FakeRobotStateServicer(FakeServicerBase, robot_state_service_pb2_grpc.RobotStateServiceServicer):
+    """RobotState service of a SimulatedRobot."""
+
+    def __init__(self, robot, **kwargs):
+        super(FakeRobotStateServicer, self).__init__(**kwargs)
+        self.robot = robot
+
+    def GetRobotState(self, request, context):
+        self._start_call("GetRobotState", context)
+        response = robot_state_pb2.RobotStateResponse()
+        response.robot_state.CopyFrom(self.robot.robot_state())
+        return _set_ok_header(response)
+
+
+class FakeRobotCommandServicer(FakeServicerBase,
+                               robot_command_service_pb2_grpc.RobotCommandServiceServicer):
+    """RobotCommand service of a SimulatedRobot."""
+
+    def __init__(self, robot, **kwargs):
+        super(FakeRobotCommandServicer, self).__init__(**kwargs)
+        self.robot = robot
+
+    def RobotCommand(self, request, context):
+        self._start_call("RobotCommand", context)
+        response = robot_command_pb2.RobotCommandResponse(
+            status=robot_command_pb2.RobotCommandResponse.STATUS_OK)
+        response.robot_command_id = self.robot.robot_command(request.command)
+        return _set_ok_header(response)
+
+    def RobotCommandFeedback(self, request, context):
+        self._start_call("RobotCommandFeedback", context)
+        return _set_ok_header(self.robot.robot_command_feedback(request.robot_command_id))
+
+
+class FakeLeaseServicer(FakeServicerBase, lease_service_pb2_grpc.LeaseServiceServicer):
+    """Lease service granting every request a lease of its resource."""
+
+    def __init__(self, **kwargs):
+        super(FakeLeaseServicer, self).__init__(**kwargs)
+        self.leases = dict()  # maps resource to its current lease_pb2.Lease
+        self._epochs = itertools.count(1)
+
+    def _grant(self, request, response, context):
+        with self._lock:
+            lease = lease_pb2.Lease(resource=request.resource,
+                                    epoch="fake-epoch-{}".format(next(self._epochs)), sequence=[1])
+            lease.client_names.append(request.header.client_name)
+            self.leases[request.resource] = lease
+        response.status = response.STATUS_OK
+        response.lease.CopyFrom(lease)
+        response.lease_owner.client_name = request.header.client_name
+        return _set_ok_header(response)
+
+    def AcquireLease(self, request, context):
+        self._start_call("AcquireLease", context)
+        return self._grant(request, lease_pb2.AcquireLeaseResponse(), context)
+
+    def TakeLease(self, request, context):
+        self._start_call("TakeLease", context)
+        return self._grant(request, lease_pb2.TakeLeaseResponse(), context)
+
+    def ReturnLease(self, request, context):
+        self._start_call("ReturnLease", context)
+        with self._lock:
+            self.leases.pop(request.lease.resource, None)
+        return _set_ok_header(
+            lease_pb2.ReturnLeaseResponse(status=lease_pb2.ReturnLeaseResponse.STATUS_OK))
+
+    def RetainLease(self, request, context):
+        self._start_call("RetainLease", context)
+        return _set_ok_header(lease_pb2.RetainLeaseResponse())
+
+    def ListLeases(self, request, context):
+        self._start_call("ListLeases", context)
+        response = lease_pb2.ListLeasesResponse()
+        with self._lock:
+            for resource, lease in self.leases.items():
+                response.resources.add(resource=resource, lease=lease)
+        return _set_ok_header(response)
+
+
+class FakePowerServicer(FakeServicerBase, power_service_pb2_grpc.PowerServiceServicer):
+    """Power service of a SimulatedRobot: the motors power on after power_on_seconds."""
+
+    def __init__(self, robot, **kwargs):
+        super(FakePowerServicer, self).__init__(**kwargs)
+        self.robot = robot
+        self._command_ids = itertools.count(1)
+        self._commands = dict()  # maps power command id to the time it succeeds
+
+    def PowerCommand(self, request, context):
+        self._start_call("PowerCommand", context)
+        response = power_pb2.PowerCommandResponse(power_command_id=next(self._command_ids))
+        if request.request == power_pb2.PowerCommandRequest.REQUEST_ON_MOTORS:
+            done_time = self.robot.power_on(time.time())
+        elif request.request == power_pb2.PowerCommandRequest.REQUEST_OFF_MOTORS:
+            self.robot.power_off()
+            done_time = 0.0
+        else:
+            response.status = power_pb2.STATUS_INTERNAL_ERROR
+            return _set_ok_header(response)
+        with self._lock:
+            self._commands[response.power_command_id] = done_time
+        response.status = (power_pb2.STATUS_SUCCESS
+                           if time.time() >= done_time else power_pb2.STATUS_IN_PROGRESS)
+        return _set_ok_header(response)
+
+    def PowerCommandFeedback(self, request, context):
+        self._start_call("PowerCommandFeedback", context)
+        response = power_pb2.PowerCommandFeedbackResponse()
+        with self._lock:
+            done_time = self._commands.get(request.power_command_id)
+        if done_time is None:
+            response.status = power_pb2.STATUS_INTERNAL_ERROR
+        elif time.time() >= done_time:
+            response.status = power_pb2.STATUS_SUCCESS
+        else:
+            response.status = power_pb2.STATUS_IN_PROGRESS
+        return _set_ok_header(response)
+
+
+class FakeImageServicer(FakeServicerBase, image_service_pb2_grpc.ImageServiceServicer):
+    """Image service of a SimulatedRobot's hand camera."""
+
+    def __init__(self, robot, **kwargs):
+        super(FakeImageServicer, self).__init__(**kwargs)
+        self.robot = robot
+        self.sources = {source.name: source for source in robot.image_sources()}
+
+    def ListImageSources(self, request, context):
+        self._start_call("ListImageSources", context)
+        response = image_pb2.ListImageSourcesResponse()
+        response.image_sources.extend(self.sources.values())
+        return _set_ok_header(response)
+
+    def GetImage(self, request, context):
+        self._start_call("GetImage", context)
+        response = image_pb2.GetImageResponse()
+        for image_request in request.image_requests:
+            source = self.sources.get(image_request.image_source_name)
+            if source is None:
+                response.image_responses.add(
+                    status=image_pb2.ImageResponse.STATUS_UNKNOWN_CAMERA).source.name = (
+                        image_request.image_source_name)
+            else:
+                response.image_responses.append(self.robot.image_response(source))
+        return _set_ok_header(response)
+
+
+class FakeManipulationApiServicer(FakeServicerBase,
+                                  manipulation_api_service_pb2_grpc.ManipulationApiServiceServicer):
+    """ManipulationApi service of a SimulatedRobot: grasps finish after grasp_seconds."""
+
+    def __init__(self, robot, **kwargs):
+        super(FakeManipulationApiServicer, self).__init__(**kwargs)
+        self.robot = robot
+        self._command_ids = itertools.count(1)
+        self._start_times = dict()  # maps manipulation command id to its start time
+
+    def ManipulationApi(self, request, context):
+        self._start_call("ManipulationApi", context)
+        response = manipulation_api_pb2.ManipulationApiResponse(
+            manipulation_cmd_id=next(self._command_ids))
+        with self._lock:
+            self._start_times[response.manipulation_cmd_id] = time.time()
+        return _set_ok_header(response)
+
+    def ManipulationApiFeedback(self, request, context):
+        self._start_call("ManipulationApiFeedback", context)
+        response = manipulation_api_pb2.ManipulationApiFeedbackResponse(
+            manipulation_cmd_id=request.manipulation_cmd_id)
+        with self._lock:
+            start = self._start_times.get(request.manipulation_cmd_id)
+        if start is None:
+            response.current_state = manipulation_api_pb2.MANIP_STATE_UNKNOWN
+        else:
+            response.current_state = self.robot.grasp_state(time.time() - start)
+        return _set_ok_header(response)
+
+
+class FakeRobotServer(object):
+    """gRPC server on a free localhost port serving every fake service of one SimulatedRobot.
+
+    params:
+    + robot (optional): SimulatedRobot, a default one if None
+    + graph_nav_servicer (optional): FakeGraphNavServicer, one reporting the robot's kinematics if
+                                     None
+    + latency, latencies, failures (optional): passed to every servicer, see FakeServicerBase;
+                                               RPC names are unique across the services
+    + max_workers (optional): threads of the server
+    """
+
+    def __init__(self, robot=None, graph_nav_servicer=None, latency=0.0, latencies=None,
+                 failures=None, max_workers=32):
+        self.robot = robot if robot is not None else SimulatedRobot()
+        kwargs = dict(latency=latency, latencies=latencies)
+        failures = dict(failures or {})
+        if graph_nav_servicer is None:
+            graph_nav_servicer = FakeGraphNavServicer(kinematic_state=self.robot.kinematic_state,
+                                                      **kwargs)
+        self.servicers = [
+            graph_nav_servicer,
+            FakeRobotStateServicer(self.robot, **kwargs),
+            FakeRobotCommandServicer(self.robot, **kwargs),
+            FakeLeaseServicer(**kwargs),
+            FakePowerServicer(self.robot, **kwargs),
+            FakeImageServicer(self.robot, **kwargs),
+            FakeManipulationApiServicer(self.robot, **kwargs),
+        ]
+        self._server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=max_workers))
+        for servicer, add_to_server in zip(self.servicers, (
+                graph_nav_service_pb2_grpc.add_GraphNavServiceServicer_to_server,
+                robot_state_service_pb2_grpc.add_RobotStateServiceServicer_to_server,
+                robot_command_service_pb2_grpc.add_RobotCommandServiceServicer_to_server,
+                lease_service_pb2_grpc.add_LeaseServiceServicer_to_server,
+                power_service_pb2_grpc.add_PowerServiceServicer_to_server,
+                image_service_pb2_grpc.add_ImageServiceServicer_to_server,
+                manipulation_api_service_pb2_grpc.add_ManipulationApiServiceServicer_to_server)):
+            add_to_server(servicer, self._server)
+        for name, count in failures.items():
+            self.inject_failure(name, count)
+        self.port = self._server.add_insecure_port("localhost:0")
+
+    @property
+    def graph_nav_servicer(self):
+        return self.servicers[0]
+
+    @property
+    def address(self):
+        return "localhost:{}".format(self.port)
+
+    @property
+    def call_counts(self):
+        """Counter of the calls of every RPC, across the services."""
+        counts = collections.Counter()
+        for servicer in self.servicers:
+            counts.update(servicer.call_counts)
+        return counts
+
+    def inject_failure(self, name, count=1, code=grpc.StatusCode.UNAVAILABLE):
+        """Make the next count calls of the RPC name fail with the gRPC status code."""
+        for servicer in self.servicers:
+            if callable(getattr(type(servicer), name, None)):
+                servicer.inject_failure(name, count, code)
+                return
+        raise ValueError("No fake service has an RPC named {}".format(name))
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self):
+        self._server.stop(grace=None)
+        self.robot.drawer.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class FakeTimeSync(FakeTimeSyncEndpoint):
+    """robot.time_sync of a FakeRobot: always in sync, with the local clock."""
+
+    @property
+    def endpoint(self):
+        return self
+
+    def wait_for_sync(self, timeout_sec=3.0):
+        return True
+
+    def has_established_time_sync(self, timesync_endpoint=None):
+        return True
+
+
+_CLIENT_TYPES = {
+    client_type.default_service_name: client_type
+    for client_type in (GraphNavClient, RobotStateClient, RobotCommandClient, LeaseClient,
+                        PowerClient, ImageClient, ManipulationApiClient)
+}
+
+
+class FakeRobot(object):
+    """The parts of bosdyn.client.robot.Robot the utilities use, connected to a FakeRobotServer.
+
+    params:
+    + address: address of the FakeRobotServer
+    + client_name (optional): name put in the request headers and leases
+    + serial_number (optional): serial number reported by get_id
+    """
+
+    def __init__(self, address, client_name="FakeRobotClient", serial_number="fake-spot"):
+        self.address = address
+        self.client_name = client_name
+        self.serial_number = serial_number
+        self.logger = logging.getLogger("FakeRobot")
+        self.lease_wallet = LeaseWallet()
+        self.lease_wallet.set_client_name(client_name)
+        self.request_processors = [AddRequestHeader(lambda: self.client_name)]
+        self.response_processors = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+        self.time_sync = FakeTimeSync()
+        self.service_clients_by_name = dict()
+        self._channel = grpc.insecure_channel(address)
+
+    def ensure_client(self, service_name, channel=None, options=[], service_endpoint=None):
+        if service_name in self.service_clients_by_name:
+            return self.service_clients_by_name[service_name]
+        if service_name not in _CLIENT_TYPES:
+            raise UnregisteredServiceNameError(service_name)
+        client = _CLIENT_TYPES[service_name]()
+        client.channel = channel if channel is not None else self._channel
+        client.update_from(self)
+        self.service_clients_by_name[service_name] = client
+        return client
+
+    def get_id(self):
+        return robot_id_pb2.RobotId(serial_number=self.serial_number, nickname="fake")
+
+    def has_arm(self, timeout=None):
+        return has_arm(self.ensure_client(RobotStateClient.default_service_name), timeout=timeout)
+
+    def is_powered_on(self, timeout=None):
+        return is_powered_on(self.ensure_client(RobotStateClient.default_service_name),
+                             timeout=timeout)
+
+    def power_on(self, timeout_sec=20, update_frequency=1.0, timeout=None):
+        power_on_motors(self.ensure_client(PowerClient.default_service_name), timeout_sec,
+                        update_frequency, timeout=timeout)
+
+    def power_off(self, cut_immediately=False, timeout_sec=20, update_frequency=1.0, timeout=None):
+        if cut_immediately:
+            power_off_motors(self.ensure_client(PowerClient.default_service_name), timeout_sec,
+                             update_frequency, timeout=timeout)
+            return
+        safe_power_off_motors(self.ensure_client(RobotCommandClient.default_service_name),
+                              self.ensure_client(RobotStateClient.default_service_name),
+                              timeout_sec, update_frequency, timeout=timeout)
+
+    def shutdown(self):
+        self._channel.close()
+        self.executor.shutdown(wait=False)
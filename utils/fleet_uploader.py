@@ -0,0 +1,245 @@
+"""Upload one map to a fleet of robots at the same time.
+
+The map is parsed once, before any upload starts, and every robot's upload sends the same parsed
+snapshot objects, which are only read. Each robot gets its own SnapshotUploader, so it is only
+sent the snapshots it is missing, over its own window of in-flight RPCs with per-snapshot
+retries. A robot whose upload still fails, or whose connection drops, is retried as a whole a few
+times; every retry resumes with the snapshots that robot is still missing. All the robots share
+one UploadManifest, keyed by serial number.
+
+Unlike GraphNavInterface, nothing here waits for time sync or for the navigation stack: uploading
+a map only needs the GraphNav client and, on a real robot, the body lease.
+
+    python -m utils.fleet_uploader --path maps/cit121/downloaded_graph 192.168.80.3 192.168.80.4
+"""
+
+import argparse
+import concurrent.futures
+import sys
+import threading
+import time
+
+from bosdyn.client.exceptions import Error as SdkError
+from bosdyn.client.graph_nav import GraphNavClient
+from bosdyn.client.lease import LeaseClient, LeaseKeepAlive
+import bosdyn.client.util
+
+from utils.map_loader import get_map_loader
+from utils.snapshot_uploader import SnapshotUploader, UploadManifest
+
+
+class FleetRobot(object):
+    """A robot of the fleet.
+
+    params:
+    + serial: serial number of the robot, the manifest key
+    + graph_nav_client: GraphNavClient of the robot
+    + lease_client (optional): LeaseClient of the robot; the body lease is acquired for the upload,
+                               kept alive while it runs and returned after
+    """
+
+    def __init__(self, serial, graph_nav_client, lease_client=None):
+        self.serial = serial
+        self.graph_nav_client = graph_nav_client
+        self.lease_client = lease_client
+
+
+class RobotUploadResult(object):
+    """Outcome of the upload to one robot, over all its attempts."""
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.reports = []  # one UploadReport per attempt that reached the robot
+        self.error = None  # exception of the last attempt, None if it completed
+        self.attempts = 0
+        self.seconds = 0.0
+
+    @property
+    def complete(self):
+        return self.error is None and bool(self.reports) and self.reports[-1].complete
+
+    @property
+    def uploaded(self):
+        return sum(len(report.uploaded) for report in self.reports)
+
+    def __str__(self):
+        status = "ok" if self.complete else "FAILED ({})".format(
+            self.error if self.error is not None else "{} snapshots failed".format(
+                len(self.reports[-1].failed)))
+        return "{:<20}{:>10}{:>10}{:>10.2f}  {}".format(self.serial, self.uploaded, self.attempts,
+                                                        self.seconds, status)
+
+
+class FleetReport(object):
+    """Outcome of one FleetUploader.upload call."""
+
+    def __init__(self):
+        self.results = dict()  # maps serial to RobotUploadResult
+        self.seconds = 0.0
+
+    @property
+    def complete(self):
+        return all(result.complete for result in self.results.values())
+
+    @property
+    def failed(self):
+        return [serial for serial, result in self.results.items() if not result.complete]
+
+    def __str__(self):
+        lines = ["{:<20}{:>10}{:>10}{:>10}  {}".format("robot", "uploaded", "attempts", "time (s)",
+                                                       "status")]
+        lines.extend(str(result) for result in self.results.values())
+        lines.append("{} of {} robots up to date in {:.2f}s".format(
+            len(self.results) - len(self.failed), len(self.results), self.seconds))
+        return "\n".join(lines)
+
+
+class FleetUploader(object):
+    """Uploads a map to several robots concurrently.
+
+    params:
+    + map_loader: MapLoader of the map to upload
+    + manifest (optional): UploadManifest shared by the robots, by default the one stored next to
+                           the map
+    + max_robots (optional): maximum number of robots uploading at the same time, all by default
+    + max_in_flight (optional): maximum number of snapshot uploads in flight per robot
+    + max_retries (optional): number of times a failed snapshot upload is retried
+    + snapshot_retry_delay (optional): seconds to wait before the first retry of a snapshot
+    + max_attempts (optional): number of times the whole upload to one robot is attempted
+    + retry_delay (optional): seconds to wait before attempting a robot again, doubled every time
+    + progress (optional): called as progress(serial, done, total) as each robot accepts
+                           snapshots, by default prints every tenth of a robot's upload
+    """
+
+    def __init__(self, map_loader, manifest=None, max_robots=None, max_in_flight=4,
+                 max_retries=3, snapshot_retry_delay=0.5, max_attempts=3, retry_delay=1.0,
+                 progress=None):
+        self._map_loader = map_loader
+        self._manifest = manifest if manifest is not None else UploadManifest.for_map(
+            map_loader.path)
+        self._max_robots = max_robots
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+        self._snapshot_retry_delay = snapshot_retry_delay
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._progress = progress if progress is not None else _print_progress
+
+    def _robot_progress(self, serial):
+        def progress(kind, snapshot_id, done, total):
+            self._progress(serial, done, total)
+
+        return progress
+
+    def _upload_attempt(self, robot, result, generate_new_anchoring):
+        uploader = SnapshotUploader(robot.graph_nav_client, self._map_loader, robot.serial,
+                                    manifest=self._manifest, max_in_flight=self._max_in_flight,
+                                    max_retries=self._max_retries,
+                                    retry_delay=self._snapshot_retry_delay,
+                                    progress=self._robot_progress(robot.serial))
+        if robot.lease_client is None:
+            report = uploader.upload(generate_new_anchoring=generate_new_anchoring)
+        else:
+            # Acquired here rather than up front, so a robot whose lease is taken only fails its
+            # own attempt.
+            with LeaseKeepAlive(robot.lease_client, must_acquire=True, return_at_exit=True):
+                lease = robot.lease_client.lease_wallet.get_lease()
+                report = uploader.upload(lease=lease.lease_proto,
+                                         generate_new_anchoring=generate_new_anchoring)
+        result.reports.append(report)
+        return report.complete
+
+    def _upload_robot(self, robot, generate_new_anchoring):
+        result = RobotUploadResult(robot.serial)
+        start = time.time()
+        delay = self._retry_delay
+        for attempt in range(self._max_attempts):
+            result.attempts += 1
+            try:
+                result.error = None
+                if self._upload_attempt(robot, result, generate_new_anchoring):
+                    break
+            except SdkError as err:
+                result.error = err
+                print("{}: upload attempt {} failed: {}".format(robot.serial, attempt + 1, err))
+            if attempt + 1 < self._max_attempts:
+                time.sleep(delay)
+                delay *= 2
+        result.seconds = time.time() - start
+        return result
+
+    def upload(self, robots, generate_new_anchoring=None):
+        """Upload the map to every robot, returning a FleetReport.
+
+        params:
+        + robots: list of FleetRobot
+        + generate_new_anchoring (optional): passed to upload_graph, by default only for maps
+                                             without anchoring
+        """
+        report = FleetReport()
+        start = time.time()
+        # Parse the map once; the robots then share the parsed snapshots.
+        self._map_loader.load_all()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_robots or max(1, len(robots))) as executor:
+            futures = [
+                executor.submit(self._upload_robot, robot, generate_new_anchoring)
+                for robot in robots
+            ]
+            for robot, future in zip(robots, futures):
+                report.results[robot.serial] = future.result()
+        self._manifest.save()
+        report.seconds = time.time() - start
+        return report
+
+
+_print_lock = threading.Lock()
+_printed_steps = dict()
+
+
+def _print_progress(serial, done, total):
+    # Print when a robot crosses each tenth of its upload, not for every snapshot.
+    step = 10 * done // total if total else 10
+    with _print_lock:
+        if _printed_steps.get(serial) == step and done != total:
+            return
+        _printed_steps[serial] = step
+    print("{}: {}/{} snapshots".format(serial, done, total))
+
+
+def connect_robot(sdk, hostname, take_lease=True):
+    """Return the FleetRobot for the robot at hostname; it is authenticated, but not time synced."""
+    robot = sdk.create_robot(hostname)
+    bosdyn.client.util.authenticate(robot)
+    lease_client = robot.ensure_client(LeaseClient.default_service_name) if take_lease else None
+    return FleetRobot(robot.get_id().serial_number,
+                      robot.ensure_client(GraphNavClient.default_service_name), lease_client)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', type=str, required=True,
+                        help='Map to upload, a directory or a map container.')
+    parser.add_argument('--max-robots', type=int, default=None,
+                        help='Maximum number of robots uploading at the same time.')
+    parser.add_argument('--max-in-flight', type=int, default=4,
+                        help='Maximum number of snapshot uploads in flight per robot.')
+    parser.add_argument('--no-lease', action='store_true',
+                        help='Upload without acquiring the body lease.')
+    parser.add_argument('hostnames', nargs='+', help='Hostnames or addresses of the robots.')
+    options = parser.parse_args(argv)
+
+    sdk = bosdyn.client.create_standard_sdk('FleetUploader')
+    # Authentication may prompt for credentials, so connect to the robots one at a time.
+    robots = [connect_robot(sdk, hostname, not options.no_lease) for hostname in options.hostnames]
+    uploader = FleetUploader(get_map_loader(options.path), max_robots=options.max_robots,
+                             max_in_flight=options.max_in_flight)
+    report = uploader.upload(robots)
+    print(report)
+    return report.complete
+
+
+if __name__ == '__main__':
+    if not main(sys.argv[1:]):
+        sys.exit(1)
@@ -2,26 +2,43 @@ from bosdyn.api import geometry_pb2
 from bosdyn.api import power_pb2
 from bosdyn.api import robot_state_pb2
 from bosdyn.api.graph_nav import graph_nav_pb2
-from bosdyn.api.graph_nav import map_pb2
 from bosdyn.api.graph_nav import nav_pb2
 import bosdyn.client.channel
 from bosdyn.client.power import safe_power_off, PowerClient, power_on
-from bosdyn.client.exceptions import ResponseError
 from bosdyn.client.graph_nav import GraphNavClient
 from bosdyn.client.frame_helpers import get_odom_tform_body
-from bosdyn.client.lease import LeaseClient, LeaseKeepAlive, LeaseWallet, ResourceAlreadyClaimedError
+from bosdyn.client.lease import LeaseClient, LeaseWallet, ResourceAlreadyClaimedError
 from bosdyn.client.math_helpers import Quat, SE3Pose
 from bosdyn.client.robot_command import RobotCommandClient, RobotCommandBuilder
 from bosdyn.client.robot_state import RobotStateClient
 import bosdyn.client.util
+import contextlib
 import google.protobuf.timestamp_pb2
+import math
 import time
 
 import graph_nav_util
+from utils.costmap import LETHAL, Costmap
+from utils.lease_manager import LeaseManager
+from utils.map_loader import get_map_loader
+from utils.mission_queue import ANCHOR, ROUTE, WAYPOINT, MissionQueue
+from utils.navigation_driver import NavigationDriver
+from utils.route_planner import RoutePlanner
+from utils.rpc_tracing import traced, traced_sleep
+from utils.snapshot_uploader import SnapshotUploader
+from utils.spatial_index import AnchoringIndex
 
 import os
 
 
+def _parse_floats(values):
+    """Return the values as floats, or None if one of them is not a number."""
+    try:
+        return [float(value) for value in values]
+    except ValueError:
+        return None
+
+
 class GraphNavInterfaceSimple(object):
     """GraphNav service command line interface."""
 
@@ -39,7 +56,8 @@ class GraphNavInterfaceSimple(object):
         except ResourceAlreadyClaimedError as err:
             print("The robot's lease is currently in use. Check for a tablet connection or try again in a few seconds.")
             os._exit(1)
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
+        # One keep-alive, and one GraphNav sublease shared by consecutive navigation commands.
+        self._lease_manager = LeaseManager(self._lease_client)
 
         # Create robot state and command clients.
         self._robot_command_client = self._robot.ensure_client(
@@ -48,6 +66,8 @@ class GraphNavInterfaceSimple(object):
 
         # Create the client for the Graph Nav main service.
         self._graph_nav_client = self._robot.ensure_client(GraphNavClient.default_service_name)
+        # Follows navigation commands until they finish, keeping per-goal latency metrics.
+        self._navigation_driver = NavigationDriver(self._graph_nav_client)
 
         # Create a power client for the robot.
         self._power_client = self._robot.ensure_client(PowerClient.default_service_name)
@@ -60,6 +80,17 @@ class GraphNavInterfaceSimple(object):
         # Number of attempts to wait before trying to re-power on.
         self._max_attempts_to_wait = 50
 
+        # Number of navigation_batch blocks running; the robot is powered off when the last ends.
+        self._navigation_batches = 0
+
+        # Maximum distance, in meters, between a seed frame goal and the nearest anchored waypoint.
+        self._max_anchor_goal_distance = 3.0
+
+        # Costmap of the map at upload_path, built the first time a seed frame goal is checked, and
+        # the graph it was looked up for; None if that graph is not the map at upload_path.
+        self._costmap = None
+        self._costmap_graph = None
+
         # Store the most recent knowledge of the state of the robot based on rpc calls.
         self._current_graph = None
         self._current_edges = dict()  #maps to_waypoint to list(from_waypoint)
@@ -111,8 +142,17 @@ class GraphNavInterfaceSimple(object):
             # If no waypoint id is given as input, then return without initializing.
             print("No waypoint specified to initialize to.")
             return
-        destination_waypoint = graph_nav_util.find_unique_waypoint_id(
-            args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
+        coordinates = _parse_floats(args[0])
+        if coordinates is not None and len(coordinates) in [2, 3]:
+            # The arguments are the [x, y] or [x, y, yaw] of the robot in seed frame, so localize
+            # to the nearest anchored waypoint.
+            destination_waypoint, waypoint_tform_body = self._nearest_anchored_waypoint(
+                *coordinates)
+        else:
+            destination_waypoint = graph_nav_util.find_unique_waypoint_id(
+                args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
+            # The robot is at the waypoint.
+            waypoint_tform_body = SE3Pose(0.0, 0.0, 0.0, Quat())
         if not destination_waypoint:
             # Failed to find the unique waypoint id.
             return
@@ -120,10 +160,10 @@ class GraphNavInterfaceSimple(object):
         robot_state = self._robot_state_client.get_robot_state()
         current_odom_tform_body = get_odom_tform_body(
             robot_state.kinematic_state.transforms_snapshot).to_proto()
-        # Create an initial localization to the specified waypoint as the identity.
+        # Create an initial localization to the specified waypoint.
         localization = nav_pb2.Localization()
         localization.waypoint_id = destination_waypoint
-        localization.waypoint_tform_body.rotation.w = 1.0
+        localization.waypoint_tform_body.CopyFrom(waypoint_tform_body.to_proto())
         self._graph_nav_client.set_localization(
             initial_guess_localization=localization,
             # It's hard to get the pose perfect, search +/-20 deg and +/-20cm (0.2m).
@@ -132,6 +172,55 @@ class GraphNavInterfaceSimple(object):
             fiducial_init=graph_nav_pb2.SetLocalizationRequest.FIDUCIAL_INIT_NO_FIDUCIAL,
             ko_tform_body=current_odom_tform_body)
 
+    def _nearest_anchored_waypoint(self, x, y, yaw=0.0):
+        """Return the anchored waypoint nearest to a seed frame position, and the pose of that
+        position relative to the waypoint."""
+        if self._current_graph is None or not len(self._current_graph.anchoring.anchors):
+            print("Please upload or list an anchored map before localizing to a seed frame position.")
+            return None, None
+        anchoring_index = AnchoringIndex.for_graph(self._current_graph)
+        waypoint_id, distance = anchoring_index.waypoints.nearest(x, y)[0]
+        print("Nearest anchored waypoint is {} ({:.2f}m away).".format(waypoint_id, distance))
+        seed_tform_waypoint = SE3Pose.from_proto(anchoring_index.seed_tform_waypoints[waypoint_id])
+        seed_tform_body = SE3Pose(x, y, seed_tform_waypoint.z, Quat.from_yaw(yaw))
+        return waypoint_id, seed_tform_waypoint.inverse() * seed_tform_body
+
+    def _is_anchor_goal_valid(self, seed_T_goal):
+        """Check that a seed frame goal is close to the anchored waypoints of the current graph."""
+        if self._current_graph is None or not len(self._current_graph.anchoring.anchors):
+            # There is nothing to check the goal against, leave it to the robot.
+            return True
+        nearest = AnchoringIndex.for_graph(self._current_graph).waypoints.nearest(
+            seed_T_goal.x, seed_T_goal.y)
+        waypoint_id, distance = nearest[0]
+        if distance > self._max_anchor_goal_distance:
+            print("The goal is {:.2f}m away from the nearest anchored waypoint {}, which is more "
+                  "than {:.2f}m.".format(distance, waypoint_id, self._max_anchor_goal_distance))
+            return False
+        # Cells the map never observed are left to the robot's own obstacle avoidance.
+        costmap = self._current_costmap()
+        if costmap is not None and costmap.cost_at(seed_T_goal.x, seed_T_goal.y) == LETHAL:
+            print("The goal collides with an obstacle of the map.")
+            return False
+        return True
+
+    def _current_costmap(self):
+        """Return the costmap of the current graph, None if it is not the map at upload_path.
+
+        A graph downloaded from the robot is only checked against the local map if it is the same
+        graph.
+        """
+        if self._costmap_graph is not self._current_graph:
+            self._costmap_graph = self._current_graph
+            self._costmap = None
+            try:
+                map_graph = get_map_loader(self._upload_filepath).graph
+            except OSError:
+                return None
+            if map_graph is self._current_graph or map_graph == self._current_graph:
+                self._costmap = Costmap.for_map(self._upload_filepath)
+        return self._costmap
+
     def _list_graph_waypoint_and_edge_ids(self, *args):
         """List the waypoint ids and edge ids of the graph currently on the robot."""
 
@@ -151,44 +240,26 @@ class GraphNavInterfaceSimple(object):
     def _upload_graph_and_snapshots(self, *args):
         """Upload the graph and snapshots to the robot."""
         print("Loading the graph from disk into local storage...")
-        with open(self._upload_filepath + "/graph", "rb") as graph_file:
-            # Load the graph from disk.
-            data = graph_file.read()
-            self._current_graph = map_pb2.Graph()
-            self._current_graph.ParseFromString(data)
-            print("Loaded graph has {} waypoints and {} edges".format(
-                len(self._current_graph.waypoints), len(self._current_graph.edges)))
-        for waypoint in self._current_graph.waypoints:
-            # Load the waypoint snapshots from disk.
-            with open(self._upload_filepath + "/waypoint_snapshots/{}".format(waypoint.snapshot_id),
-                      "rb") as snapshot_file:
-                waypoint_snapshot = map_pb2.WaypointSnapshot()
-                waypoint_snapshot.ParseFromString(snapshot_file.read())
-                self._current_waypoint_snapshots[waypoint_snapshot.id] = waypoint_snapshot
-        for edge in self._current_graph.edges:
-            if len(edge.snapshot_id) == 0:
-                continue
-            # Load the edge snapshots from disk.
-            with open(self._upload_filepath + "/edge_snapshots/{}".format(edge.snapshot_id),
-                      "rb") as snapshot_file:
-                edge_snapshot = map_pb2.EdgeSnapshot()
-                edge_snapshot.ParseFromString(snapshot_file.read())
-                self._current_edge_snapshots[edge_snapshot.id] = edge_snapshot
-        # Upload the graph to the robot.
+        # The graph is parsed right away, the snapshots are only read from disk when needed.
+        map_loader = get_map_loader(self._upload_filepath)
+        self._current_graph = map_loader.graph
+        self._current_waypoint_snapshots = map_loader.waypoint_snapshots
+        self._current_edge_snapshots = map_loader.edge_snapshots
+        print("Loaded graph has {} waypoints and {} edges".format(
+            len(self._current_graph.waypoints), len(self._current_graph.edges)))
+        # Upload the graph to the robot, then only the snapshots it does not have yet, several at
+        # a time. Running the upload again after a failure resumes where it stopped.
         print("Uploading the graph and snapshots to the robot...")
-        true_if_empty = not len(self._current_graph.anchoring.anchors)
-        response = self._graph_nav_client.upload_graph(lease=self._lease.lease_proto,
-                                                       graph=self._current_graph,
-                                                       generate_new_anchoring=true_if_empty)
-        # Upload the snapshots to the robot.
-        for snapshot_id in response.unknown_waypoint_snapshot_ids:
-            waypoint_snapshot = self._current_waypoint_snapshots[snapshot_id]
-            self._graph_nav_client.upload_waypoint_snapshot(waypoint_snapshot)
-            print("Uploaded {}".format(waypoint_snapshot.id))
-        for snapshot_id in response.unknown_edge_snapshot_ids:
-            edge_snapshot = self._current_edge_snapshots[snapshot_id]
-            self._graph_nav_client.upload_edge_snapshot(edge_snapshot)
-            print("Uploaded {}".format(edge_snapshot.id))
+        uploader = SnapshotUploader(self._graph_nav_client, map_loader,
+                                    self._robot.get_id().serial_number)
+        self._lease = self._lease_manager.lease()
+        report = uploader.upload(lease=self._lease.lease_proto)
+        print(report)
+        if not report.complete:
+            for _, snapshot_id, error in report.failed:
+                print("Failed to upload {}: {}".format(snapshot_id, error))
+            print("Upload incomplete, run the upload again to resume it.")
+            return
 
         # The upload is complete! Check that the robot is localized to the graph,
         # and if it is not, prompt the user to localize the robot before attempting
@@ -231,35 +302,22 @@ class GraphNavInterfaceSimple(object):
             seed_T_goal.rot = Quat(w=float(args[0][3]), x=float(args[0][4]), y=float(args[0][5]),
                                    z=float(args[0][6]))
 
-        self._lease = self._lease_wallet.get_lease()
+        # Check the goal before powering on the robot.
+        if not self._is_anchor_goal_valid(seed_T_goal):
+            return
+
         if not self.toggle_power(should_power_on=True):
             print("Failed to power on the robot, and cannot complete navigate to request.")
             return
 
-        # Stop the lease keepalive and create a new sublease for graph nav.
-        self._lease = self._lease_wallet.advance()
-        sublease = self._lease.create_sublease()
-        self._lease_keepalive.shutdown()
-        nav_to_cmd_id = None
-        # Navigate to the destination.
-        is_finished = False
-        while not is_finished:
-            # Issue the navigation command about twice a second such that it is easy to terminate the
-            # navigation command (with estop or killing the program).
-            try:
-                nav_to_cmd_id = self._graph_nav_client.navigate_to_anchor(
-                    seed_T_goal.to_proto(), 1.0, leases=[sublease.lease_proto],
-                    command_id=nav_to_cmd_id)
-            except ResponseError as e:
-                print("Error while navigating {}".format(e))
-                break
-            time.sleep(.5)  # Sleep for half a second to allow for command execution.
-            # Poll the robot for feedback to determine if the navigation command is complete. Then sit
-            # the robot down once it is finished.
-            is_finished = self._check_success(nav_to_cmd_id)
-
-        self._lease = self._lease_wallet.advance()
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
+        # Reuse the sublease of the previous navigation command if no other command has
+        # needed the lease since.
+        sublease = self._lease_manager.sublease()
+        # Navigate to the destination. The short command is refreshed such that it is easy to
+        # terminate the navigation command (with estop or killing the program), while the feedback
+        # is polled so we return as soon as the goal is reached.
+        print(self._navigation_driver.navigate_to_anchor(seed_T_goal.to_proto(),
+                                                         leases=[sublease.lease_proto]))
 
     def _navigate_to(self, *args):
         """Navigate to a specific waypoint."""
@@ -269,7 +327,6 @@ class GraphNavInterfaceSimple(object):
             print("No waypoint provided as a destination for navigate to.")
             return
 
-        self._lease = self._lease_wallet.get_lease()
         destination_waypoint = graph_nav_util.find_unique_waypoint_id(
             args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
         if not destination_waypoint:
@@ -279,35 +336,16 @@ class GraphNavInterfaceSimple(object):
             print("Failed to power on the robot, and cannot complete navigate to request.")
             return
 
-        # Stop the lease keep-alive and create a new sublease for graph nav.
-        self._lease = self._lease_wallet.advance()
-        sublease = self._lease.create_sublease()
-        self._lease_keepalive.shutdown()
-        nav_to_cmd_id = None
-        # Navigate to the destination waypoint.
-        is_finished = False
-        while not is_finished:
-            # Issue the navigation command about twice a second such that it is easy to terminate the
-            # navigation command (with estop or killing the program).
-            try:
-                nav_to_cmd_id = self._graph_nav_client.navigate_to(destination_waypoint, 1.0,
-                                                                   leases=[sublease.lease_proto],
-                                                                   command_id=nav_to_cmd_id)
-            except ResponseError as e:
-                print("Error while navigating {}".format(e))
-                break
-            time.sleep(.5)  # Sleep for half a second to allow for command execution.
-            # Poll the robot for feedback to determine if the navigation command is complete. Then sit
-            # the robot down once it is finished.
-            is_finished = self._check_success(nav_to_cmd_id)
+        # Reuse the sublease of the previous navigation command if no other command has
+        # needed the lease since.
+        sublease = self._lease_manager.sublease()
+        # Navigate to the destination waypoint. The short command is refreshed such that it is easy
+        # to terminate the navigation command (with estop or killing the program), while the
+        # feedback is polled so we return as soon as the goal is reached.
+        print(self._navigation_driver.navigate_to(destination_waypoint,
+                                                  leases=[sublease.lease_proto]))
 
-        self._lease = self._lease_wallet.advance()
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
-
-        # Update the lease and power off the robot if appropriate.
-        if self._powered_on and not self._started_powered_on:
-            # Sit the robot down + power off after the navigation command is complete.
-            self.toggle_power(should_power_on=False)
+        self._power_off_after_navigation()
 
     def _navigate_route(self, *args):
         """Navigate through a specific route of waypoints."""
@@ -323,65 +361,93 @@ class GraphNavInterfaceSimple(object):
                 # Failed to find the unique waypoint id.
                 return
 
+        if len(waypoint_ids) == 1:
+            # Only a goal was given, so plan the route from the waypoint the robot is at.
+            localization_id = self._graph_nav_client.get_localization_state().localization.waypoint_id
+            if not localization_id:
+                print("The robot is not localized, and cannot plan a route to a single waypoint.")
+                return
+            waypoint_ids.insert(0, localization_id)
+
+        route_waypoint_ids = waypoint_ids[:1]
         edge_ids_list = []
         all_edges_found = True
-        # Attempt to find edges in the current graph that match the ordered waypoint pairs.
+        # Attempt to find edges in the current graph that match the ordered waypoint pairs, and
+        # plan the shortest route between the pairs that are not adjacent.
         # These are necessary to create a valid route.
+        planner = RoutePlanner.for_graph(self._current_graph)
         for i in range(len(waypoint_ids) - 1):
             start_wp = waypoint_ids[i]
             end_wp = waypoint_ids[i + 1]
-            edge_id = self._match_edge(self._current_edges, start_wp, end_wp)
+            edge_id = self._match_edge(start_wp, end_wp)
             if edge_id is not None:
+                route_waypoint_ids.append(end_wp)
                 edge_ids_list.append(edge_id)
+                continue
+            leg_waypoint_ids, leg_edge_ids = planner.plan(start_wp, end_wp)
+            if leg_waypoint_ids is not None:
+                route_waypoint_ids.extend(leg_waypoint_ids[1:])
+                edge_ids_list.extend(leg_edge_ids)
             else:
                 all_edges_found = False
-                print("Failed to find an edge between waypoints: ", start_wp, " and ", end_wp)
+                print("Failed to find a route between waypoints: ", start_wp, " and ", end_wp)
                 print(
-                    "List the graph's waypoints and edges to ensure pairs of waypoints has an edge."
+                    "List the graph's waypoints and edges to ensure the waypoints are connected."
                 )
                 break
+        waypoint_ids = route_waypoint_ids
 
-        self._lease = self._lease_wallet.get_lease()
         if all_edges_found:
             if not self.toggle_power(should_power_on=True):
                 print("Failed to power on the robot, and cannot complete navigate route request.")
                 return
 
-            # Stop the lease keep-alive and create a new sublease for graph nav.
-            self._lease = self._lease_wallet.advance()
-            sublease = self._lease.create_sublease()
-            self._lease_keepalive.shutdown()
+            # Reuse the sublease of the previous navigation command if no other command has
+            # needed the lease since.
+            sublease = self._lease_manager.sublease()
 
             # Navigate a specific route.
             route = self._graph_nav_client.build_route(waypoint_ids, edge_ids_list)
-            is_finished = False
-            while not is_finished:
-                # Issue the route command about twice a second such that it is easy to terminate the
-                # navigation command (with estop or killing the program).
-                nav_route_command_id = self._graph_nav_client.navigate_route(
-                    route, cmd_duration=1.0, leases=[sublease.lease_proto])
-                time.sleep(.5)  # Sleep for half a second to allow for command execution.
-                # Poll the robot for feedback to determine if the route is complete. Then sit
-                # the robot down once it is finished.
-                is_finished = self._check_success(nav_route_command_id)
-
-            self._lease = self._lease_wallet.advance()
-            self._lease_keepalive = LeaseKeepAlive(self._lease_client)
-
-            # Update the lease and power off the robot if appropriate.
-            if self._powered_on and not self._started_powered_on:
-                # Sit the robot down + power off after the navigation command is complete.
-                self.toggle_power(should_power_on=False)
+            # The short route command is refreshed such that it is easy to terminate the navigation
+            # command (with estop or killing the program), while the feedback is polled so we
+            # return as soon as the route is complete.
+            print(self._navigation_driver.navigate_route(route, leases=[sublease.lease_proto]))
+
+            self._power_off_after_navigation()
 
     def _clear_graph(self, *args):
         """Clear the state of the map on the robot, removing all waypoints and edges."""
+        self._lease = self._lease_manager.lease()
         return self._graph_nav_client.clear_graph(lease=self._lease.lease_proto)
 
+    @contextlib.contextmanager
+    def navigation_batch(self):
+        """Run the navigation commands of the block with one sublease, without powering off.
+
+        A robot that was powered off at start is powered off once the block ends instead of after
+        every command, so the sublease is not revoked between commands.
+        """
+        self._navigation_batches += 1
+        try:
+            yield
+        finally:
+            self._navigation_batches -= 1
+            self._power_off_after_navigation()
+
+    def _power_off_after_navigation(self):
+        """Sit the robot down and power off if it was off at start, unless a batch is running."""
+        if self._navigation_batches:
+            return
+        if self._powered_on and not self._started_powered_on:
+            self.toggle_power(should_power_on=False)
+
     def toggle_power(self, should_power_on):
         """Power the robot on/off dependent on the current power state."""
         is_powered_on = self.check_is_powered_on()
         if not is_powered_on and should_power_on:
             # Power on the robot up before navigating when it is in a powered-off state.
+            # Power commands are sent with the lease, not with GraphNav's sublease.
+            self._lease = self._lease_manager.lease()
             power_on(self._power_client)
             motors_on = False
             while not motors_on:
@@ -392,10 +458,11 @@ class GraphNavInterfaceSimple(object):
                     motors_on = True
                 else:
                     # Motors are not yet fully powered on.
-                    time.sleep(.25)
+                    traced_sleep(.25, "wait for motor power")
         elif is_powered_on and not should_power_on:
             # Safe power off (robot will sit then power down) when it is in a
             # powered-on state.
+            self._lease = self._lease_manager.lease()
             safe_power_off(self._robot_command_client, self._robot_state_client)
         else:
             # Return the current power state without change.
@@ -416,44 +483,25 @@ class GraphNavInterfaceSimple(object):
             # No command, so we have no status to check.
             return False
         status = self._graph_nav_client.navigation_feedback(command_id)
-        if status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_REACHED_GOAL:
-            # Successfully completed the navigation commands!
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_LOST:
-            print("Robot got lost when navigating the route, the robot will now sit down.")
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_STUCK:
-            print("Robot got stuck when navigating the route, the robot will now sit down.")
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_ROBOT_IMPAIRED:
-            print("Robot is impaired.")
-            return True
-        else:
-            # Navigation command is not complete yet.
-            return False
+        return NavigationDriver.is_finished(status.status)
 
-    def _match_edge(self, current_edges, waypoint1, waypoint2):
+    def _match_edge(self, waypoint1, waypoint2):
         """Find an edge in the graph that is between two waypoint ids."""
-        # Return the correct edge id as soon as it's found.
-        for edge_to_id in current_edges:
-            for edge_from_id in current_edges[edge_to_id]:
-                if (waypoint1 == edge_to_id) and (waypoint2 == edge_from_id):
-                    # This edge matches the pair of waypoints! Add it the edge list and continue.
-                    return map_pb2.Edge.Id(from_waypoint=waypoint2, to_waypoint=waypoint1)
-                elif (waypoint2 == edge_to_id) and (waypoint1 == edge_from_id):
-                    # This edge matches the pair of waypoints! Add it the edge list and continue.
-                    return map_pb2.Edge.Id(from_waypoint=waypoint1, to_waypoint=waypoint2)
-        return None
+        if self._current_graph is None:
+            return None
+        return graph_nav_util.GraphIndex.for_graph(self._current_graph).match_edge(
+            waypoint1, waypoint2)
 
     def return_lease(self):
         """Shutdown lease keep-alive and return lease."""
-        self._lease_keepalive.shutdown()
-        self._lease_client.return_lease(self._lease)
+        self._lease_manager.return_lease()
+        print(self._lease_manager.metrics)
 
     def _on_quit(self):
         """Cleanup on quit from the command line interface."""
         # Sit the robot down + power off after the navigation command is complete.
         if self._powered_on and not self._started_powered_on:
+            self._lease = self._lease_manager.lease()
             self._robot_command_client.robot_command(RobotCommandBuilder.safe_power_off_command(),
                                                      end_time_secs=time.time())
         self.return_lease()
@@ -467,10 +515,14 @@ class GraphNavInterfaceSimple(object):
             (2) Initialize localization to the nearest fiducial (must be in sight of a fiducial).
             (3) Initialize localization to a specific waypoint (must be exactly at the waypoint)."""
                   """
+                Given a seed frame [x, y] or [x, y, yaw] instead, localize to the nearest anchored
+                waypoint.
             (4) List the waypoint ids and edge ids of the map on the robot.
             (5) Upload the graph and its snapshots.
             (6) Navigate to. The destination waypoint id is the second argument.
             (7) Navigate route. The (in-order) waypoint ids of the route are the arguments.
+                Waypoints that are not adjacent are joined by the shortest route; with a single
+                waypoint, the route starts from the waypoint the robot is localized to.
             (8) Navigate to in seed frame. The following options are accepted for arguments: [x, y],
                 [x, y, yaw], [x, y, z, yaw], [x, y, z, qw, qx, qy, qz]. (Don't type the braces).
                 When a value for z is not specified, we use the current z height.
@@ -516,7 +568,8 @@ class GraphNavInterface(object):
         except ResourceAlreadyClaimedError as err:
             print("The robot's lease is currently in use. Check for a tablet connection or try again in a few seconds.")
             os._exit(1)
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
+        # One keep-alive, and one GraphNav sublease shared by consecutive navigation commands.
+        self._lease_manager = LeaseManager(self._lease_client)
 
         # Create robot state and command clients.
         self._robot_command_client = self._robot.ensure_client(
@@ -525,6 +578,8 @@ class GraphNavInterface(object):
 
         # Create the client for the Graph Nav main service.
         self._graph_nav_client = self._robot.ensure_client(GraphNavClient.default_service_name)
+        # Follows navigation commands until they finish, keeping per-goal latency metrics.
+        self._navigation_driver = NavigationDriver(self._graph_nav_client)
 
         # Create a power client for the robot.
         self._power_client = self._robot.ensure_client(PowerClient.default_service_name)
@@ -537,6 +592,17 @@ class GraphNavInterface(object):
         # Number of attempts to wait before trying to re-power on.
         self._max_attempts_to_wait = 50
 
+        # Number of navigation_batch blocks running; the robot is powered off when the last ends.
+        self._navigation_batches = 0
+
+        # Maximum distance, in meters, between a seed frame goal and the nearest anchored waypoint.
+        self._max_anchor_goal_distance = 3.0
+
+        # Costmap of the map at upload_path, built the first time a seed frame goal is checked, and
+        # the graph it was looked up for; None if that graph is not the map at upload_path.
+        self._costmap = None
+        self._costmap_graph = None
+
         # Store the most recent knowledge of the state of the robot based on rpc calls.
         self._current_graph = None
         self._current_edges = dict()  #maps to_waypoint to list(from_waypoint)
@@ -559,7 +625,8 @@ class GraphNavInterface(object):
             '6': self._navigate_to,
             '7': self._navigate_route,
             '8': self._navigate_to_anchor,
-            '9': self._clear_graph
+            '9': self._clear_graph,
+            '10': self._run_mission
         }
 
     def _get_localization_state(self, *args):
@@ -569,6 +636,7 @@ class GraphNavInterface(object):
         odom_tform_body = get_odom_tform_body(state.robot_kinematics.transforms_snapshot)
         print('Got robot state in kinematic odometry frame: \n%s' % str(odom_tform_body))
 
+    @traced("set_localization_fiducial")
     def _set_initial_localization_fiducial(self, *args):
         """Trigger localization when near a fiducial."""
         robot_state = self._robot_state_client.get_robot_state()
@@ -581,6 +649,7 @@ class GraphNavInterface(object):
                                                 ko_tform_body=current_odom_tform_body)
 
 
+    @traced("set_localization_waypoint")
     def _set_initial_localization_waypoint(self, *args):
         """Trigger localization to a waypoint."""
         # Take the first argument as the localization waypoint.
@@ -588,8 +657,17 @@ class GraphNavInterface(object):
             # If no waypoint id is given as input, then return without initializing.
             print("No waypoint specified to initialize to.")
             return
-        destination_waypoint = graph_nav_util.find_unique_waypoint_id(
-            args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
+        coordinates = _parse_floats(args[0])
+        if coordinates is not None and len(coordinates) in [2, 3]:
+            # The arguments are the [x, y] or [x, y, yaw] of the robot in seed frame, so localize
+            # to the nearest anchored waypoint.
+            destination_waypoint, waypoint_tform_body = self._nearest_anchored_waypoint(
+                *coordinates)
+        else:
+            destination_waypoint = graph_nav_util.find_unique_waypoint_id(
+                args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
+            # The robot is at the waypoint.
+            waypoint_tform_body = SE3Pose(0.0, 0.0, 0.0, Quat())
         if not destination_waypoint:
             # Failed to find the unique waypoint id.
             return
@@ -597,10 +675,10 @@ class GraphNavInterface(object):
         robot_state = self._robot_state_client.get_robot_state()
         current_odom_tform_body = get_odom_tform_body(
             robot_state.kinematic_state.transforms_snapshot).to_proto()
-        # Create an initial localization to the specified waypoint as the identity.
+        # Create an initial localization to the specified waypoint.
         localization = nav_pb2.Localization()
         localization.waypoint_id = destination_waypoint
-        localization.waypoint_tform_body.rotation.w = 1.0
+        localization.waypoint_tform_body.CopyFrom(waypoint_tform_body.to_proto())
         self._graph_nav_client.set_localization(
             initial_guess_localization=localization,
             # It's hard to get the pose perfect, search +/-20 deg and +/-20cm (0.2m).
@@ -609,6 +687,55 @@ class GraphNavInterface(object):
             fiducial_init=graph_nav_pb2.SetLocalizationRequest.FIDUCIAL_INIT_NO_FIDUCIAL,
             ko_tform_body=current_odom_tform_body)
 
+    def _nearest_anchored_waypoint(self, x, y, yaw=0.0):
+        """Return the anchored waypoint nearest to a seed frame position, and the pose of that
+        position relative to the waypoint."""
+        if self._current_graph is None or not len(self._current_graph.anchoring.anchors):
+            print("Please upload or list an anchored map before localizing to a seed frame position.")
+            return None, None
+        anchoring_index = AnchoringIndex.for_graph(self._current_graph)
+        waypoint_id, distance = anchoring_index.waypoints.nearest(x, y)[0]
+        print("Nearest anchored waypoint is {} ({:.2f}m away).".format(waypoint_id, distance))
+        seed_tform_waypoint = SE3Pose.from_proto(anchoring_index.seed_tform_waypoints[waypoint_id])
+        seed_tform_body = SE3Pose(x, y, seed_tform_waypoint.z, Quat.from_yaw(yaw))
+        return waypoint_id, seed_tform_waypoint.inverse() * seed_tform_body
+
+    def _is_anchor_goal_valid(self, seed_T_goal):
+        """Check that a seed frame goal is close to the anchored waypoints of the current graph."""
+        if self._current_graph is None or not len(self._current_graph.anchoring.anchors):
+            # There is nothing to check the goal against, leave it to the robot.
+            return True
+        nearest = AnchoringIndex.for_graph(self._current_graph).waypoints.nearest(
+            seed_T_goal.x, seed_T_goal.y)
+        waypoint_id, distance = nearest[0]
+        if distance > self._max_anchor_goal_distance:
+            print("The goal is {:.2f}m away from the nearest anchored waypoint {}, which is more "
+                  "than {:.2f}m.".format(distance, waypoint_id, self._max_anchor_goal_distance))
+            return False
+        # Cells the map never observed are left to the robot's own obstacle avoidance.
+        costmap = self._current_costmap()
+        if costmap is not None and costmap.cost_at(seed_T_goal.x, seed_T_goal.y) == LETHAL:
+            print("The goal collides with an obstacle of the map.")
+            return False
+        return True
+
+    def _current_costmap(self):
+        """Return the costmap of the current graph, None if it is not the map at upload_path.
+
+        A graph downloaded from the robot is only checked against the local map if it is the same
+        graph.
+        """
+        if self._costmap_graph is not self._current_graph:
+            self._costmap_graph = self._current_graph
+            self._costmap = None
+            try:
+                map_graph = get_map_loader(self._upload_filepath).graph
+            except OSError:
+                return None
+            if map_graph is self._current_graph or map_graph == self._current_graph:
+                self._costmap = Costmap.for_map(self._upload_filepath)
+        return self._costmap
+
     def _list_graph_waypoint_and_edge_ids(self, *args):
         """List the waypoint ids and edge ids of the graph currently on the robot."""
 
@@ -625,47 +752,30 @@ class GraphNavInterface(object):
         self._current_annotation_name_to_wp_id, self._current_edges = graph_nav_util.update_waypoints_and_edges(
             graph, localization_id)
 
+    @traced("upload_graph_and_snapshots")
     def _upload_graph_and_snapshots(self, *args):
         """Upload the graph and snapshots to the robot."""
         print("Loading the graph from disk into local storage...")
-        with open(self._upload_filepath + "/graph", "rb") as graph_file:
-            # Load the graph from disk.
-            data = graph_file.read()
-            self._current_graph = map_pb2.Graph()
-            self._current_graph.ParseFromString(data)
-            print("Loaded graph has {} waypoints and {} edges".format(
-                len(self._current_graph.waypoints), len(self._current_graph.edges)))
-        for waypoint in self._current_graph.waypoints:
-            # Load the waypoint snapshots from disk.
-            with open(self._upload_filepath + "/waypoint_snapshots/{}".format(waypoint.snapshot_id),
-                      "rb") as snapshot_file:
-                waypoint_snapshot = map_pb2.WaypointSnapshot()
-                waypoint_snapshot.ParseFromString(snapshot_file.read())
-                self._current_waypoint_snapshots[waypoint_snapshot.id] = waypoint_snapshot
-        for edge in self._current_graph.edges:
-            if len(edge.snapshot_id) == 0:
-                continue
-            # Load the edge snapshots from disk.
-            with open(self._upload_filepath + "/edge_snapshots/{}".format(edge.snapshot_id),
-                      "rb") as snapshot_file:
-                edge_snapshot = map_pb2.EdgeSnapshot()
-                edge_snapshot.ParseFromString(snapshot_file.read())
-                self._current_edge_snapshots[edge_snapshot.id] = edge_snapshot
-        # Upload the graph to the robot.
+        # The graph is parsed right away, the snapshots are only read from disk when needed.
+        map_loader = get_map_loader(self._upload_filepath)
+        self._current_graph = map_loader.graph
+        self._current_waypoint_snapshots = map_loader.waypoint_snapshots
+        self._current_edge_snapshots = map_loader.edge_snapshots
+        print("Loaded graph has {} waypoints and {} edges".format(
+            len(self._current_graph.waypoints), len(self._current_graph.edges)))
+        # Upload the graph to the robot, then only the snapshots it does not have yet, several at
+        # a time. Running the upload again after a failure resumes where it stopped.
         print("Uploading the graph and snapshots to the robot...")
-        true_if_empty = not len(self._current_graph.anchoring.anchors)
-        response = self._graph_nav_client.upload_graph(lease=self._lease.lease_proto,
-                                                       graph=self._current_graph,
-                                                       generate_new_anchoring=true_if_empty)
-        # Upload the snapshots to the robot.
-        for snapshot_id in response.unknown_waypoint_snapshot_ids:
-            waypoint_snapshot = self._current_waypoint_snapshots[snapshot_id]
-            self._graph_nav_client.upload_waypoint_snapshot(waypoint_snapshot)
-            print("Uploaded {}".format(waypoint_snapshot.id))
-        for snapshot_id in response.unknown_edge_snapshot_ids:
-            edge_snapshot = self._current_edge_snapshots[snapshot_id]
-            self._graph_nav_client.upload_edge_snapshot(edge_snapshot)
-            print("Uploaded {}".format(edge_snapshot.id))
+        uploader = SnapshotUploader(self._graph_nav_client, map_loader,
+                                    self._robot.get_id().serial_number)
+        self._lease = self._lease_manager.lease()
+        report = uploader.upload(lease=self._lease.lease_proto)
+        print(report)
+        if not report.complete:
+            for _, snapshot_id, error in report.failed:
+                print("Failed to upload {}: {}".format(snapshot_id, error))
+            print("Upload incomplete, run the upload again to resume it.")
+            return
 
         # The upload is complete! Check that the robot is localized to the graph,
         # and if it is not, prompt the user to localize the robot before attempting
@@ -677,6 +787,7 @@ class GraphNavInterface(object):
             print("Upload complete! The robot is currently not localized to the map; please localize", \
                    "the robot using commands (2) or (3) before attempting a navigation command.")
 
+    @traced("navigate_to_anchor")
     def _navigate_to_anchor(self, *args):
         """Navigate to a pose in seed frame, using anchors."""
         # The following options are accepted for arguments: [x, y], [x, y, yaw], [x, y, z, yaw],
@@ -685,64 +796,69 @@ class GraphNavInterface(object):
         # When only yaw is specified, the quaternion is constructed from the yaw.
         # When yaw is not specified, an identity quaternion is used.
 
-        if len(args) < 1 or len(args[0]) not in [2, 3, 4, 7]:
+        if len(args) < 1:
             print("Invalid arguments supplied.")
             return
+        # Check the goal before powering on the robot.
+        seed_T_goal = self._anchor_goal(args[0])
+        if seed_T_goal is None:
+            return
 
-        seed_T_goal = SE3Pose(float(args[0][0]), float(args[0][1]), 0.0, Quat())
-
-        if len(args[0]) in [4, 7]:
-            seed_T_goal.z = float(args[0][2])
-        else:
-            localization_state = self._graph_nav_client.get_localization_state()
-            if not localization_state.localization.waypoint_id:
-                print("Robot not localized")
-                return
-            seed_T_goal.z = localization_state.localization.seed_tform_body.position.z
-
-        if len(args[0]) == 3:
-            seed_T_goal.rot = Quat.from_yaw(float(args[0][2]))
-        elif len(args[0]) == 4:
-            seed_T_goal.rot = Quat.from_yaw(float(args[0][3]))
-        elif len(args[0]) == 7:
-            seed_T_goal.rot = Quat(w=float(args[0][3]), x=float(args[0][4]), y=float(args[0][5]),
-                                   z=float(args[0][6]))
-
-        self._lease = self._lease_wallet.get_lease()
         if not self.toggle_power(should_power_on=True):
             print("Failed to power on the robot, and cannot complete navigate to request.")
             return
 
-        # Stop the lease keepalive and create a new sublease for graph nav.
-        self._lease = self._lease_wallet.advance()
-        sublease = self._lease.create_sublease()
-        self._lease_keepalive.shutdown()
-        nav_to_cmd_id = None
-        # Navigate to the destination.
-        is_finished = False
-        while not is_finished:
-            # Issue the navigation command about twice a second such that it is easy to terminate the
-            # navigation command (with estop or killing the program).
-            try:
-                nav_to_cmd_id = self._graph_nav_client.navigate_to_anchor(
-                    seed_T_goal.to_proto(), 1.0, leases=[sublease.lease_proto],
-                    command_id=nav_to_cmd_id)
-            except ResponseError as e:
-                print("Error while navigating {}".format(e))
-                break
-            time.sleep(.5)  # Sleep for half a second to allow for command execution.
-            # Poll the robot for feedback to determine if the navigation command is complete. Then sit
-            # the robot down once it is finished.
-            is_finished = self._check_success(nav_to_cmd_id)
+        # Reuse the sublease of the previous navigation command if no other command has
+        # needed the lease since.
+        sublease = self._lease_manager.sublease()
+        # Navigate to the destination. The short command is refreshed such that it is easy to
+        # terminate the navigation command (with estop or killing the program), while the feedback
+        # is polled so we return as soon as the goal is reached.
+        print(self._navigation_driver.navigate_to_anchor(seed_T_goal.to_proto(),
+                                                         leases=[sublease.lease_proto]))
 
-        self._lease = self._lease_wallet.advance()
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
+        self._power_off_after_navigation()
 
-        # Update the lease and power off the robot if appropriate.
-        if self._powered_on and not self._started_powered_on:
-            # Sit the robot down + power off after the navigation command is complete.
-            self.toggle_power(should_power_on=False)
+    def _anchor_goal(self, values, current_z=True):
+        """Return the seed frame SE3Pose of a navigate to anchor goal, None if it is invalid.
 
+        Without a z value the goal takes the current z height of the robot, unless current_z is
+        False: z is then left at 0 for the caller to set from _current_z() before driving.
+        """
+        if len(values) not in [2, 3, 4, 7]:
+            print("Invalid arguments supplied.")
+            return None
+
+        seed_T_goal = SE3Pose(float(values[0]), float(values[1]), 0.0, Quat())
+
+        if len(values) in [4, 7]:
+            seed_T_goal.z = float(values[2])
+        elif current_z:
+            seed_T_goal.z = self._current_z()
+            if seed_T_goal.z is None:
+                return None
+
+        if len(values) == 3:
+            seed_T_goal.rot = Quat.from_yaw(float(values[2]))
+        elif len(values) == 4:
+            seed_T_goal.rot = Quat.from_yaw(float(values[3]))
+        elif len(values) == 7:
+            seed_T_goal.rot = Quat(w=float(values[3]), x=float(values[4]), y=float(values[5]),
+                                   z=float(values[6]))
+
+        if not self._is_anchor_goal_valid(seed_T_goal):
+            return None
+        return seed_T_goal
+
+    def _current_z(self):
+        """Return the z height of the robot in seed frame, None if it is not localized."""
+        localization_state = self._graph_nav_client.get_localization_state()
+        if not localization_state.localization.waypoint_id:
+            print("Robot not localized")
+            return None
+        return localization_state.localization.seed_tform_body.position.z
+
+    @traced("navigate_to")
     def _navigate_to(self, *args):
         """Navigate to a specific waypoint."""
         # Take the first argument as the destination waypoint.
@@ -751,7 +867,6 @@ class GraphNavInterface(object):
             print("No waypoint provided as a destination for navigate to.")
             return
 
-        self._lease = self._lease_wallet.get_lease()
         destination_waypoint = graph_nav_util.find_unique_waypoint_id(
             args[0][0], self._current_graph, self._current_annotation_name_to_wp_id)
         if not destination_waypoint:
@@ -761,109 +876,147 @@ class GraphNavInterface(object):
             print("Failed to power on the robot, and cannot complete navigate to request.")
             return
 
-        # Stop the lease keep-alive and create a new sublease for graph nav.
-        self._lease = self._lease_wallet.advance()
-        sublease = self._lease.create_sublease()
-        self._lease_keepalive.shutdown()
-        nav_to_cmd_id = None
-        # Navigate to the destination waypoint.
-        is_finished = False
-        while not is_finished:
-            # Issue the navigation command about twice a second such that it is easy to terminate the
-            # navigation command (with estop or killing the program).
-            try:
-                nav_to_cmd_id = self._graph_nav_client.navigate_to(destination_waypoint, 1.0,
-                                                                   leases=[sublease.lease_proto],
-                                                                   command_id=nav_to_cmd_id)
-            except ResponseError as e:
-                print("Error while navigating {}".format(e))
-                break
-            time.sleep(.5)  # Sleep for half a second to allow for command execution.
-            # Poll the robot for feedback to determine if the navigation command is complete. Then sit
-            # the robot down once it is finished.
-            is_finished = self._check_success(nav_to_cmd_id)
+        # Reuse the sublease of the previous navigation command if no other command has
+        # needed the lease since.
+        sublease = self._lease_manager.sublease()
+        # Navigate to the destination waypoint. The short command is refreshed such that it is easy
+        # to terminate the navigation command (with estop or killing the program), while the
+        # feedback is polled so we return as soon as the goal is reached.
+        print(self._navigation_driver.navigate_to(destination_waypoint,
+                                                  leases=[sublease.lease_proto]))
 
-        self._lease = self._lease_wallet.advance()
-        self._lease_keepalive = LeaseKeepAlive(self._lease_client)
-
-        # Update the lease and power off the robot if appropriate.
-        if self._powered_on and not self._started_powered_on:
-            # Sit the robot down + power off after the navigation command is complete.
-            self.toggle_power(should_power_on=False)
+        self._power_off_after_navigation()
 
+    @traced("navigate_route")
     def _navigate_route(self, *args):
         """Navigate through a specific route of waypoints."""
         if len(args) < 1 or len(args[0]) < 1:
             # If no waypoint ids are given as input, then return without requesting navigation.
             print("No waypoints provided for navigate route.")
             return
-        waypoint_ids = args[0]
+        route = self._route_goal(args[0])
+
+        if route is not None:
+            if not self.toggle_power(should_power_on=True):
+                print("Failed to power on the robot, and cannot complete navigate route request.")
+                return
+
+            # Reuse the sublease of the previous navigation command if no other command has
+            # needed the lease since.
+            sublease = self._lease_manager.sublease()
+
+            # Navigate a specific route. The short route command is refreshed such that it is easy
+            # to terminate the navigation command (with estop or killing the program), while the
+            # feedback is polled so we return as soon as the route is complete.
+            print(self._navigation_driver.navigate_route(route, leases=[sublease.lease_proto]))
+
+            self._power_off_after_navigation()
+
+    def _route_goal(self, waypoint_names, start_waypoint=None):
+        """Return the route through waypoints given by id or short code, None if there is none.
+
+        With a single waypoint, the route starts from start_waypoint, by default the waypoint the
+        robot is localized to.
+        """
+        waypoint_ids = list(waypoint_names)
         for i in range(len(waypoint_ids)):
             waypoint_ids[i] = graph_nav_util.find_unique_waypoint_id(
                 waypoint_ids[i], self._current_graph, self._current_annotation_name_to_wp_id)
             if not waypoint_ids[i]:
                 # Failed to find the unique waypoint id.
-                return
-
+                return None
+
+        if len(waypoint_ids) == 1:
+            # Only a goal was given, so plan the route from the waypoint the robot is at.
+            localization_id = start_waypoint or self._graph_nav_client.get_localization_state(
+            ).localization.waypoint_id
+            if not localization_id:
+                print("The robot is not localized, and cannot plan a route to a single waypoint.")
+                return None
+            waypoint_ids.insert(0, localization_id)
+
+        route_waypoint_ids = waypoint_ids[:1]
         edge_ids_list = []
-        all_edges_found = True
-        # Attempt to find edges in the current graph that match the ordered waypoint pairs.
+        # Attempt to find edges in the current graph that match the ordered waypoint pairs, and
+        # plan the shortest route between the pairs that are not adjacent.
         # These are necessary to create a valid route.
+        planner = RoutePlanner.for_graph(self._current_graph)
         for i in range(len(waypoint_ids) - 1):
             start_wp = waypoint_ids[i]
             end_wp = waypoint_ids[i + 1]
-            edge_id = self._match_edge(self._current_edges, start_wp, end_wp)
+            edge_id = self._match_edge(start_wp, end_wp)
             if edge_id is not None:
+                route_waypoint_ids.append(end_wp)
                 edge_ids_list.append(edge_id)
+                continue
+            leg_waypoint_ids, leg_edge_ids = planner.plan(start_wp, end_wp)
+            if leg_waypoint_ids is not None:
+                route_waypoint_ids.extend(leg_waypoint_ids[1:])
+                edge_ids_list.extend(leg_edge_ids)
             else:
-                all_edges_found = False
-                print("Failed to find an edge between waypoints: ", start_wp, " and ", end_wp)
+                print("Failed to find a route between waypoints: ", start_wp, " and ", end_wp)
                 print(
-                    "List the graph's waypoints and edges to ensure pairs of waypoints has an edge."
+                    "List the graph's waypoints and edges to ensure the waypoints are connected."
                 )
-                break
-
-        self._lease = self._lease_wallet.get_lease()
-        if all_edges_found:
-            if not self.toggle_power(should_power_on=True):
-                print("Failed to power on the robot, and cannot complete navigate route request.")
+                return None
+        return self._graph_nav_client.build_route(route_waypoint_ids, edge_ids_list)
+
+    def _run_mission(self, *args):
+        """Navigate to several goals back to back, without powering off between them."""
+        # Goals are separated by ';', e.g. waypoint ab ; route cd ef ; anchor 1.0 2.0 0.5
+        mission = MissionQueue(self)
+        for goal in " ".join(args[0] if args else []).split(";"):
+            words = goal.split()
+            if not words:
+                continue
+            if words[0] == WAYPOINT and len(words) == 2:
+                mission.add_waypoint(words[1])
+            elif words[0] == ROUTE and len(words) > 1:
+                mission.add_route(words[1:])
+            elif words[0] == ANCHOR and len(words) > 1:
+                mission.add_anchor(words[1:])
+            else:
+                print("Invalid goal: {}".format(goal.strip()))
                 return
-
-            # Stop the lease keep-alive and create a new sublease for graph nav.
-            self._lease = self._lease_wallet.advance()
-            sublease = self._lease.create_sublease()
-            self._lease_keepalive.shutdown()
-
-            # Navigate a specific route.
-            route = self._graph_nav_client.build_route(waypoint_ids, edge_ids_list)
-            is_finished = False
-            while not is_finished:
-                # Issue the route command about twice a second such that it is easy to terminate the
-                # navigation command (with estop or killing the program).
-                nav_route_command_id = self._graph_nav_client.navigate_route(
-                    route, cmd_duration=1.0, leases=[sublease.lease_proto])
-                time.sleep(.5)  # Sleep for half a second to allow for command execution.
-                # Poll the robot for feedback to determine if the route is complete. Then sit
-                # the robot down once it is finished.
-                is_finished = self._check_success(nav_route_command_id)
-
-            self._lease = self._lease_wallet.advance()
-            self._lease_keepalive = LeaseKeepAlive(self._lease_client)
-
-            # Update the lease and power off the robot if appropriate.
-            if self._powered_on and not self._started_powered_on:
-                # Sit the robot down + power off after the navigation command is complete.
-                self.toggle_power(should_power_on=False)
+        if not mission.goals:
+            print("No goals provided for the mission.")
+            return
+        print(mission.run())
 
     def _clear_graph(self, *args):
         """Clear the state of the map on the robot, removing all waypoints and edges."""
+        self._lease = self._lease_manager.lease()
         return self._graph_nav_client.clear_graph(lease=self._lease.lease_proto)
 
+    @contextlib.contextmanager
+    def navigation_batch(self):
+        """Run the navigation commands of the block with one sublease, without powering off.
+
+        A robot that was powered off at start is powered off once the block ends instead of after
+        every command, so the sublease is not revoked between commands.
+        """
+        self._navigation_batches += 1
+        try:
+            yield
+        finally:
+            self._navigation_batches -= 1
+            self._power_off_after_navigation()
+
+    def _power_off_after_navigation(self):
+        """Sit the robot down and power off if it was off at start, unless a batch is running."""
+        if self._navigation_batches:
+            return
+        if self._powered_on and not self._started_powered_on:
+            self.toggle_power(should_power_on=False)
+
+    @traced("toggle_power")
     def toggle_power(self, should_power_on):
         """Power the robot on/off dependent on the current power state."""
         is_powered_on = self.check_is_powered_on()
         if not is_powered_on and should_power_on:
             # Power on the robot up before navigating when it is in a powered-off state.
+            # Power commands are sent with the lease, not with GraphNav's sublease.
+            self._lease = self._lease_manager.lease()
             power_on(self._power_client)
             motors_on = False
             while not motors_on:
@@ -874,10 +1027,11 @@ class GraphNavInterface(object):
                     motors_on = True
                 else:
                     # Motors are not yet fully powered on.
-                    time.sleep(.25)
+                    traced_sleep(.25, "wait for motor power")
         elif is_powered_on and not should_power_on:
             # Safe power off (robot will sit then power down) when it is in a
             # powered-on state.
+            self._lease = self._lease_manager.lease()
             safe_power_off(self._robot_command_client, self._robot_state_client)
         else:
             # Return the current power state without change.
@@ -898,44 +1052,25 @@ class GraphNavInterface(object):
             # No command, so we have no status to check.
             return False
         status = self._graph_nav_client.navigation_feedback(command_id)
-        if status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_REACHED_GOAL:
-            # Successfully completed the navigation commands!
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_LOST:
-            print("Robot got lost when navigating the route, the robot will now sit down.")
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_STUCK:
-            print("Robot got stuck when navigating the route, the robot will now sit down.")
-            return True
-        elif status.status == graph_nav_pb2.NavigationFeedbackResponse.STATUS_ROBOT_IMPAIRED:
-            print("Robot is impaired.")
-            return True
-        else:
-            # Navigation command is not complete yet.
-            return False
+        return NavigationDriver.is_finished(status.status)
 
-    def _match_edge(self, current_edges, waypoint1, waypoint2):
+    def _match_edge(self, waypoint1, waypoint2):
         """Find an edge in the graph that is between two waypoint ids."""
-        # Return the correct edge id as soon as it's found.
-        for edge_to_id in current_edges:
-            for edge_from_id in current_edges[edge_to_id]:
-                if (waypoint1 == edge_to_id) and (waypoint2 == edge_from_id):
-                    # This edge matches the pair of waypoints! Add it the edge list and continue.
-                    return map_pb2.Edge.Id(from_waypoint=waypoint2, to_waypoint=waypoint1)
-                elif (waypoint2 == edge_to_id) and (waypoint1 == edge_from_id):
-                    # This edge matches the pair of waypoints! Add it the edge list and continue.
-                    return map_pb2.Edge.Id(from_waypoint=waypoint1, to_waypoint=waypoint2)
-        return None
+        if self._current_graph is None:
+            return None
+        return graph_nav_util.GraphIndex.for_graph(self._current_graph).match_edge(
+            waypoint1, waypoint2)
 
     def return_lease(self):
         """Shutdown lease keep-alive and return lease."""
-        self._lease_keepalive.shutdown()
-        self._lease_client.return_lease(self._lease)
+        self._lease_manager.return_lease()
+        print(self._lease_manager.metrics)
 
     def _on_quit(self):
         """Cleanup on quit from the command line interface."""
         # Sit the robot down + power off after the navigation command is complete.
         if self._powered_on and not self._started_powered_on:
+            self._lease = self._lease_manager.lease()
             self._robot_command_client.robot_command(RobotCommandBuilder.safe_power_off_command(),
                                                      end_time_secs=time.time())
         self.return_lease()
@@ -949,16 +1084,23 @@ class GraphNavInterface(object):
             (2) Initialize localization to the nearest fiducial (must be in sight of a fiducial).
             (3) Initialize localization to a specific waypoint (must be exactly at the waypoint)."""
                   """
+                Given a seed frame [x, y] or [x, y, yaw] instead, localize to the nearest anchored
+                waypoint.
             (4) List the waypoint ids and edge ids of the map on the robot.
             (5) Upload the graph and its snapshots.
             (6) Navigate to. The destination waypoint id is the second argument.
             (7) Navigate route. The (in-order) waypoint ids of the route are the arguments.
+                Waypoints that are not adjacent are joined by the shortest route; with a single
+                waypoint, the route starts from the waypoint the robot is localized to.
             (8) Navigate to in seed frame. The following options are accepted for arguments: [x, y],
                 [x, y, yaw], [x, y, z, yaw], [x, y, z, qw, qx, qy, qz]. (Don't type the braces).
                 When a value for z is not specified, we use the current z height.
                 When only yaw is specified, the quaternion is constructed from the yaw.
                 When yaw is not specified, an identity quaternion is used.
             (9) Clear the current graph.
+            (10) Run a mission: goals separated by ';', each 'waypoint <id>', 'route <ids>' or
+                'anchor <x> <y> ...' (the arguments of (8)). The robot stays powered on and
+                standing between the goals, and each goal starts as soon as the previous is reached.
             (q) Exit.
             """)
             try:
@@ -0,0 +1,181 @@
+"""Locate grasp targets in 3D from one color and aligned depth capture.
+
+PickObjectInImage sends a pixel and leaves it to the robot to find the 3D point behind it, so a
+pixel on the background or out of reach is only found out once the grasp fails. Here the color
+image and the depth image aligned to it (hand_depth_in_hand_color_frame) are requested in the
+same get_image_from_sources call, the candidate pixels are back-projected through the pinhole
+model of the color camera in one NumPy operation, and the first candidate with a valid depth in
+reach is sent as a PickObject: a 3D point in the vision frame.
+
+    capture = capture_color_and_depth(image_client)
+    candidates = detector.detect(capture.color, k=10)
+    targets = capture.locate([(row, col) for row, col, _ in candidates])
+    target = first_valid(targets)
+    if target is not None:
+        request = build_pick_object_request(target)
+"""
+
+import numpy as np
+
+from bosdyn.api import geometry_pb2, manipulation_api_pb2
+from bosdyn.client.frame_helpers import VISION_FRAME_NAME, get_a_tform_b
+
+from utils.image_decode import ImageDecoder
+
+COLOR_SOURCE = "hand_color_image"
+DEPTH_SOURCE = "hand_depth_in_hand_color_frame"
+
+_DECODER = ImageDecoder()
+
+
+def pinhole_intrinsics(image_source):
+    """Return (fx, fy, cx, cy, skew_x, skew_y) of an image_pb2.ImageSource with a pinhole model."""
+    if not image_source.HasField("pinhole"):
+        raise ValueError("Image source {} has no pinhole model".format(image_source.name))
+    intrinsics = image_source.pinhole.intrinsics
+    return (intrinsics.focal_length.x, intrinsics.focal_length.y, intrinsics.principal_point.x,
+            intrinsics.principal_point.y, intrinsics.skew.x, intrinsics.skew.y)
+
+
+def sample_depth(depth, rows, cols, depth_scale, window=5):
+    """Return the depth in meters at each (rows[i], cols[i]) of a U16 depth image.
+
+    The depth of a pixel is the median of the valid (non-zero) depths in the window x window
+    square around it, which fills the holes of the depth image at edges; NaN when the square has
+    no valid depth.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    offsets = np.arange(window) - window // 2
+    # (N, window, window) indices of the square around every pixel, clipped to the image.
+    square_rows = np.clip(rows[:, None, None] + offsets[None, :, None], 0, depth.shape[0] - 1)
+    square_cols = np.clip(cols[:, None, None] + offsets[None, None, :], 0, depth.shape[1] - 1)
+    squares = depth[square_rows, square_cols].reshape(len(rows), -1).astype(np.float64)
+    squares[squares == 0] = np.nan
+    with np.errstate(all="ignore"):
+        valid = ~np.all(np.isnan(squares), axis=1)
+        meters = np.full(len(rows), np.nan)
+        if valid.any():
+            meters[valid] = np.nanmedian(squares[valid], axis=1) / depth_scale
+    return meters
+
+
+def backproject(rows, cols, depths, intrinsics):
+    """Return the (N, 3) points in the camera frame of pixels (rows, cols) at depths in meters.
+
+    The camera frame has x right, y down and z along the optical axis.
+    """
+    fx, fy, cx, cy, skew_x, skew_y = intrinsics
+    rows = np.asarray(rows, dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.float64)
+    depths = np.asarray(depths, dtype=np.float64)
+    # Invert u = fx * x / z + skew_x * y / z + cx and v = skew_y * x / z + fy * y / z + cy.
+    determinant = fx * fy - skew_x * skew_y
+    u = cols - cx
+    v = rows - cy
+    x = (fy * u - skew_x * v) / determinant
+    y = (fx * v - skew_y * u) / determinant
+    return np.stack([x * depths, y * depths, depths], axis=-1)
+
+
+class GraspTarget(object):
+    """A candidate pixel back-projected to 3D."""
+
+    def __init__(self, row, col, depth, camera_point, vision_point, valid, reason=None):
+        self.row = row
+        self.col = col
+        self.depth = depth  # meters along the optical axis, NaN without a valid depth
+        self.camera_point = camera_point  # (x, y, z) in the camera frame
+        self.vision_point = vision_point  # (x, y, z) in the vision frame
+        self.valid = valid
+        self.reason = reason  # why the target is not valid
+
+    def __str__(self):
+        if not self.valid:
+            return "pixel ({}, {}): invalid, {}".format(self.row, self.col, self.reason)
+        return "pixel ({}, {}): {:.3f} m, vision ({:.3f}, {:.3f}, {:.3f})".format(
+            self.row, self.col, self.depth, *self.vision_point)
+
+
+class ColorDepthCapture(object):
+    """A color image and the depth image aligned to it, from the same request.
+
+    params:
+    + color_response: image_pb2.ImageResponse of the color camera
+    + depth_response: image_pb2.ImageResponse of the depth in the color camera frame
+    """
+
+    def __init__(self, color_response, depth_response):
+        self.color_response = color_response
+        self.depth_response = depth_response
+        self.color = _DECODER.decode(color_response)
+        self.depth = _DECODER.decode(depth_response)
+        if self.depth.shape[:2] != self.color.shape[:2]:
+            raise ValueError("The depth image ({}) is not aligned to the color image ({})".format(
+                self.depth.shape[:2], self.color.shape[:2]))
+
+    def vision_tform_camera(self):
+        """Return the SE3Pose of the color camera in the vision frame, at the acquisition time."""
+        shot = self.color_response.shot
+        return get_a_tform_b(shot.transforms_snapshot, VISION_FRAME_NAME,
+                             shot.frame_name_image_sensor)
+
+    def locate(self, pixels, window=5, min_depth=0.1, max_depth=1.5):
+        """Back-project (row, col) pixels to GraspTarget, in the order given.
+
+        A target is valid when its depth is known and between min_depth and max_depth meters,
+        by default about the reach of the arm from the hand camera.
+        """
+        if not len(pixels):
+            return []
+        pixels = np.asarray(pixels, dtype=np.intp).reshape(-1, 2)
+        rows, cols = pixels[:, 0], pixels[:, 1]
+        depth_scale = self.depth_response.source.depth_scale or 1000.0
+        depths = sample_depth(self.depth, rows, cols, depth_scale, window)
+        camera_points = backproject(rows, cols, depths,
+                                    pinhole_intrinsics(self.color_response.source))
+        vision_tform_camera = self.vision_tform_camera()
+        rotation = vision_tform_camera.rotation.to_matrix()
+        translation = np.array([vision_tform_camera.x, vision_tform_camera.y,
+                                vision_tform_camera.z])
+        vision_points = camera_points @ rotation.T + translation
+        targets = []
+        for i in range(len(rows)):
+            reason = None
+            if np.isnan(depths[i]):
+                reason = "no depth"
+            elif depths[i] < min_depth:
+                reason = "{:.2f} m is too close".format(depths[i])
+            elif depths[i] > max_depth:
+                reason = "{:.2f} m is out of reach".format(depths[i])
+            targets.append(
+                GraspTarget(int(rows[i]), int(cols[i]), float(depths[i]),
+                            tuple(camera_points[i]), tuple(vision_points[i]), reason is None,
+                            reason))
+        return targets
+
+
+def capture_color_and_depth(image_client, color_source=COLOR_SOURCE, depth_source=DEPTH_SOURCE):
+    """Request the color image and its aligned depth in one call, returning a ColorDepthCapture."""
+    responses = image_client.get_image_from_sources([color_source, depth_source])
+    by_source = {response.source.name: response for response in responses}
+    if color_source not in by_source or depth_source not in by_source:
+        raise ValueError("Expected images from {} and {}, got {}".format(
+            color_source, depth_source, sorted(by_source)))
+    return ColorDepthCapture(by_source[color_source], by_source[depth_source])
+
+
+def first_valid(targets):
+    """Return the first valid GraspTarget, None if there is none."""
+    for target in targets:
+        if target.valid:
+            return target
+    return None
+
+
+def build_pick_object_request(target):
+    """Return the ManipulationApiRequest grasping the vision frame point of a GraspTarget."""
+    x, y, z = target.vision_point
+    grasp = manipulation_api_pb2.PickObject(frame_name=VISION_FRAME_NAME,
+                                            object_rt_frame=geometry_pb2.Vec3(x=x, y=y, z=z))
+    return manipulation_api_pb2.ManipulationApiRequest(pick_object=grasp)
@@ -0,0 +1,153 @@
+"""Decode the pixels of Spot image responses into NumPy arrays with as few copies as possible.
+
+  - RAW images are returned as read-only np.frombuffer views on the response data, reshaped to
+    (rows, cols) or (rows, cols, channels); nothing is copied.
+  - JPEG images are decoded by OpenCV straight from a view on the response data (the compressed
+    bytes are not copied first), optionally at a reduced resolution. They are not pooled: OpenCV
+    cannot decode into a given buffer, so every decode allocates a new image, as large as the
+    copying decode did at full resolution. Only a reduced resolution shrinks that allocation.
+  - Color images are returned in OpenCV's BGR(A) channel order by default, as cv2.imdecode gives
+    them. Spot's RAW color images are RGB(A), so they are converted into preallocated buffers
+    taken from a BufferPool instead of a new array every frame.
+
+Only the RAW color conversions (and the RGB conversion of a JPEG when bgr is False) reuse
+buffers. Views and pooled buffers are only valid for a while: a view lives as long as the response it
+points into, and a pooled buffer is reused pool_size decodes of the same shape later. Copy the
+array to keep it longer.
+
+The protobuf runtime itself hands out a new bytes object every time image.data is read; that one
+copy is the floor, the decoder reads it once and makes no other.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+from bosdyn.api import image_pb2
+
+_PIXEL_FORMATS = {
+    # pixel format: (dtype, channels)
+    image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8: (np.uint8, 1),
+    image_pb2.Image.PIXEL_FORMAT_RGB_U8: (np.uint8, 3),
+    image_pb2.Image.PIXEL_FORMAT_RGBA_U8: (np.uint8, 4),
+    image_pb2.Image.PIXEL_FORMAT_DEPTH_U16: (np.uint16, 1),
+    image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U16: (np.uint16, 1),
+}
+
+# cv2.imdecode flags giving an image at 1/reduce of the full resolution.
+_REDUCED_FLAGS = {
+    (1, True): cv2.IMREAD_COLOR,
+    (2, True): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, True): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, True): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, False): cv2.IMREAD_GRAYSCALE,
+    (2, False): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, False): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, False): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def raw_format(image):
+    """Return the (dtype, channels) of a RAW image_pb2.Image.
+
+    The pixel format is guessed from the data size when it is PIXEL_FORMAT_UNKNOWN.
+    """
+    if image.pixel_format in _PIXEL_FORMATS:
+        return _PIXEL_FORMATS[image.pixel_format]
+    bytes_per_pixel = len(image.data) // max(1, image.rows * image.cols)
+    if bytes_per_pixel == 2:
+        return np.uint16, 1
+    if bytes_per_pixel in (1, 3, 4):
+        return np.uint8, bytes_per_pixel
+    raise ValueError("Cannot guess the pixel format of a {}x{} image of {} bytes".format(
+        image.rows, image.cols, len(image.data)))
+
+
+class BufferPool(object):
+    """Preallocated arrays, handed out round robin per (shape, dtype).
+
+    params:
+    + pool_size (optional): number of buffers per (shape, dtype); a buffer is handed out again
+                            after pool_size other requests of the same shape
+    """
+
+    def __init__(self, pool_size=2):
+        self._pool_size = pool_size
+        self._buffers = dict()  # maps (shape, dtype) to [list of arrays, next index]
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def get(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            entry = self._buffers.get(key)
+            if entry is None:
+                entry = self._buffers[key] = [[], 0]
+            buffers, index = entry
+            if len(buffers) < self._pool_size:
+                buffers.append(np.empty(key[0], dtype=key[1]))
+                self.allocations += 1
+                index = len(buffers) - 1
+            entry[1] = (index + 1) % self._pool_size
+            return buffers[index]
+
+
+class ImageDecoder(object):
+    """Decodes image_pb2.Image (or ImageResponse) pixels.
+
+    params:
+    + bgr (optional): return color images in BGR(A) order, as OpenCV uses, rather than RGB(A)
+    + pool_size (optional): buffers kept per output shape for the color conversions
+    """
+
+    def __init__(self, bgr=True, pool_size=2):
+        self.bgr = bgr
+        self.pool = BufferPool(pool_size)
+
+    def _convert(self, pixels, code):
+        out = self.pool.get(pixels.shape, pixels.dtype)
+        return cv2.cvtColor(pixels, code, dst=out)
+
+    def decode_raw(self, image):
+        """Return a read-only view on the pixels of a RAW image, converted to BGR(A) if asked."""
+        dtype, channels = raw_format(image)
+        pixels = np.frombuffer(image.data, dtype=dtype)
+        if channels == 1:
+            return pixels.reshape(image.rows, image.cols)
+        pixels = pixels.reshape(image.rows, image.cols, channels)
+        if self.bgr:
+            return self._convert(pixels,
+                                 cv2.COLOR_RGB2BGR if channels == 3 else cv2.COLOR_RGBA2BGRA)
+        return pixels
+
+    def decode_jpeg(self, image, reduce=1):
+        """Decode a JPEG image, at 1/reduce of its resolution (reduce in 1, 2, 4, 8)."""
+        data = np.frombuffer(image.data, dtype=np.uint8)
+        if image.pixel_format == image_pb2.Image.PIXEL_FORMAT_RGBA_U8 and reduce == 1:
+            # Only the unchanged mode keeps an alpha channel.
+            pixels = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        else:
+            color = image.pixel_format != image_pb2.Image.PIXEL_FORMAT_GREYSCALE_U8
+            pixels = cv2.imdecode(data, _REDUCED_FLAGS[(reduce, color)])
+        if pixels is None:
+            raise ValueError("Could not decode the JPEG image")
+        if not self.bgr and pixels.ndim == 3:
+            return self._convert(pixels, cv2.COLOR_BGR2RGB
+                                 if pixels.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+        return pixels
+
+    def decode(self, image, reduce=1):
+        """Return the pixels of an image_pb2.Image or ImageResponse as a NumPy array.
+
+        Greyscale and depth images are (rows, cols), color images (rows, cols, channels). reduce
+        only applies to JPEG images.
+        """
+        if hasattr(image, "shot"):
+            image = image.shot.image
+        if image.format == image_pb2.Image.FORMAT_RAW:
+            return self.decode_raw(image)
+        if image.format == image_pb2.Image.FORMAT_JPEG:
+            return self.decode_jpeg(image, reduce)
+        raise ValueError("Unsupported image format {}".format(
+            image_pb2.Image.Format.Name(image.format)))
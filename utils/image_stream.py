@@ -0,0 +1,277 @@
+"""Stream camera images in the background, keeping the latest frames of every source.
+
+get_image_from_sources blocks for a round trip every time a consumer needs an image. ImageStream
+instead keeps requesting images from one or more sources with async RPCs, decodes the responses
+in a worker pool (see ImageDecoder) and stores the frames, with their timestamps, in a fixed-size
+FrameRing per source. A consumer such as the handle detector takes the newest frame without
+waiting for an RPC:
+
+    with ImageStream(image_client, ["hand_color_image", "hand_depth_in_hand_color_frame"]) as stream:
+        frame = stream.wait_for_frame("hand_color_image", timeout=2.0)
+        pixels = frame.pixels
+
+Frames are dropped rather than queued: a ring keeps the last capacity frames, and at most
+max_in_flight requests, decodes included, are outstanding, so a slow consumer or a slow decode
+never grows memory. The pixels of a frame are views on its response or pooled buffers; they stay
+valid while the frame is in its ring and for a few frames after, copy them to keep them longer.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+from bosdyn.api import image_pb2
+from bosdyn.client.image import build_image_request
+
+from utils.image_decode import ImageDecoder
+
+
+class Frame(object):
+    """One decoded image of a source.
+
+    params:
+    + source: name of the image source
+    + response: image_pb2.ImageResponse the frame was decoded from
+    + pixels: decoded pixels, see ImageDecoder.decode
+    + received: time.time() at which the response arrived
+    """
+
+    def __init__(self, source, response, pixels, received):
+        self.source = source
+        self.response = response
+        self.pixels = pixels
+        self.received = received
+        acquisition_time = response.shot.acquisition_time
+        # Robot clock seconds; compare to other robot timestamps, not to time.time().
+        self.acquisition_time = acquisition_time.seconds + acquisition_time.nanos * 1e-9
+        self.sequence = None  # set by FrameRing.put
+
+    @property
+    def age(self):
+        """Seconds since the response arrived."""
+        return time.time() - self.received
+
+
+class FrameRing(object):
+    """Fixed-size ring of the latest frames of one source.
+
+    params:
+    + capacity (optional): number of frames kept; the oldest is overwritten by a new one
+    """
+
+    def __init__(self, capacity=4):
+        self._frames = [None] * capacity
+        self._count = 0  # number of frames put so far, the sequence of the next one
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return min(self._count, len(self._frames))
+
+    def put(self, frame):
+        """Store frame, returning it; returns None and drops it if it is older than the latest."""
+        with self._condition:
+            latest = self._latest()
+            if latest is not None and frame.acquisition_time < latest.acquisition_time:
+                # Decoded after a more recent frame of the same source.
+                return None
+            frame.sequence = self._count
+            self._frames[self._count % len(self._frames)] = frame
+            self._count += 1
+            self._condition.notify_all()
+            return frame
+
+    def _latest(self):
+        return self._frames[(self._count - 1) % len(self._frames)] if self._count else None
+
+    def latest(self):
+        """Return the newest frame, None before the first one."""
+        with self._condition:
+            return self._latest()
+
+    def wait_newer(self, sequence=None, timeout=None):
+        """Return the newest frame once its sequence is above sequence (any frame when None).
+
+        Returns None if no such frame arrives within timeout seconds.
+        """
+        sequence = -1 if sequence is None else sequence
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._count - 1 > sequence, timeout):
+                return None
+            return self._latest()
+
+    def frames(self):
+        """Return the frames in the ring, oldest first."""
+        with self._condition:
+            start = max(0, self._count - len(self._frames))
+            return [self._frames[i % len(self._frames)] for i in range(start, self._count)]
+
+
+class ImageStream(object):
+    """Requests images in a background thread and keeps the latest frames of each source.
+
+    params:
+    + image_client: ImageClient of the robot
+    + sources: image source names, or image_pb2.ImageRequest for a given format or quality
+    + capacity (optional): frames kept per source
+    + max_in_flight (optional): requests outstanding at the same time, their decodes included
+    + decode_workers (optional): threads decoding the responses
+    + period (optional): minimum seconds between two requests, 0 to request as fast as they return
+    + retry_delay (optional): seconds to wait after a failed request
+    """
+
+    def __init__(self, image_client, sources, capacity=4, max_in_flight=2, decode_workers=2,
+                 period=0.0, retry_delay=0.5):
+        self._image_client = image_client
+        self._requests = [
+            source if isinstance(source, image_pb2.ImageRequest) else build_image_request(source)
+            for source in sources
+        ]
+        self._rings = {
+            request.image_source_name: FrameRing(capacity) for request in self._requests
+        }
+        self._max_in_flight = max_in_flight
+        self._decode_workers = decode_workers
+        self._period = period
+        self._retry_delay = retry_delay
+        # Sources of the same image size share pooled buffers; keep enough of them that a frame's
+        # pixels are not reused while the frame is in its ring or being decoded.
+        self._decoder = ImageDecoder(pool_size=capacity * len(self._rings) + max_in_flight + 1)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._retry_at = 0.0
+        self._statuses = dict()  # maps source to its last image status
+        self.requests_sent = 0
+        self.errors = 0
+        self.last_error = None
+
+    @property
+    def sources(self):
+        return list(self._rings)
+
+    def ring(self, source=None):
+        """Return the FrameRing of a source, the first one by default."""
+        return self._rings[source if source is not None else self._requests[0].image_source_name]
+
+    def latest(self, source=None):
+        """Return the newest Frame of a source (the first one by default), None before the first."""
+        return self.ring(source).latest()
+
+    def wait_for_frame(self, source=None, newer_than=None, received_after=None, timeout=None):
+        """Return the newest Frame of a source, waiting for one if needed.
+
+        The frame is newer than the Frame newer_than and was received after the time.time()
+        received_after, when they are given. Returns None on timeout.
+        """
+        ring = self.ring(source)
+        sequence = newer_than.sequence if newer_than is not None else None
+        end_time = time.time() + timeout if timeout is not None else None
+        while True:
+            remaining = max(0.0, end_time - time.time()) if end_time is not None else None
+            frame = ring.wait_newer(sequence, remaining)
+            if frame is None or received_after is None or frame.received >= received_after:
+                return frame
+            sequence = frame.sequence
+
+    def start(self):
+        """Start requesting images; returns self."""
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._decode_workers)
+        self._thread = threading.Thread(target=self._request_loop, name="ImageStream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop requesting images and wait for the outstanding requests and decodes."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # Wait for every slot to come back, so no callback submits to a closed executor.
+        for _ in range(self._max_in_flight):
+            self._slots.acquire()
+        for _ in range(self._max_in_flight):
+            self._slots.release()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _request_loop(self):
+        next_request = 0.0
+        while not self._stop.is_set():
+            wake_up = max(next_request, self._retry_at)
+            if wake_up > time.time():
+                self._stop.wait(wake_up - time.time())
+                continue
+            if not self._slots.acquire(timeout=0.1):
+                continue
+            next_request = time.time() + self._period
+            try:
+                future = self._image_client.get_image_async(self._requests)
+            except Exception as err:  # pylint: disable=broad-except
+                self._slots.release()
+                self._failed(err)
+                continue
+            self.requests_sent += 1
+            future.add_done_callback(self._on_response)
+
+    def _failed(self, err):
+        self.errors += 1
+        if self.last_error is None or type(err) is not type(self.last_error):
+            print("Image request failed: {}".format(err))
+        self.last_error = err
+        self._retry_at = time.time() + self._retry_delay
+
+    def _on_response(self, future):
+        # Called on a gRPC thread: hand the decoding over to the workers.
+        received = time.time()
+        try:
+            responses = future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            self._slots.release()
+            self._failed(err)
+            return
+        if not responses:
+            self._slots.release()
+            return
+        remaining = [len(responses)]
+        lock = threading.Lock()
+
+        def decode(response):
+            try:
+                self._publish(response, received)
+            except Exception as err:  # pylint: disable=broad-except
+                print("Could not decode the {} image: {}".format(response.source.name, err))
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    done = not remaining[0]
+                if done:
+                    self._slots.release()
+
+        for response in responses:
+            self._executor.submit(decode, response)
+
+    def _publish(self, response, received):
+        ring = self._rings.get(response.source.name)
+        if ring is None:
+            return
+        # Print when a source fails and when it recovers, not for every frame.
+        ok = image_pb2.ImageResponse.STATUS_OK
+        if response.status != self._statuses.get(response.source.name, ok):
+            print("Image source {} returned {}".format(
+                response.source.name, image_pb2.ImageResponse.Status.Name(response.status)))
+        self._statuses[response.source.name] = response.status
+        if response.status != image_pb2.ImageResponse.STATUS_OK:
+            return
+        ring.put(Frame(response.source.name, response, self._decoder.decode(response), received))
@@ -0,0 +1,94 @@
+"""Keep one lease keep-alive and one GraphNav sublease across consecutive navigation commands.
+
+Every navigation command used to stop the LeaseKeepAlive, advance the lease, create a sublease
+for GraphNav, navigate, then advance the lease again and start a new LeaseKeepAlive: two advances
+and a keep-alive thread stopped and started, with its first RetainLease, for every goal. A
+LeaseManager keeps one keep-alive running for as long as the lease is held, and gives the same
+sublease to every navigation command until a command needs the lease itself:
+
+    lease_client.acquire()
+    lease_manager = LeaseManager(lease_client)
+    sublease = lease_manager.sublease()  # advances the lease once and creates the sublease
+    graph_nav_client.navigate_to(waypoint_id, 1.0, leases=[sublease.lease_proto])
+    sublease = lease_manager.sublease()  # the same sublease, no advance
+    lease = lease_manager.lease()  # advances once, so the lease is newer than the sublease
+    ...
+    lease_manager.return_lease()
+    print(lease_manager.metrics)
+
+The keep-alive retains the lease the sublease was created from, which keeps the sublease alive
+as well, so it does not have to stop while GraphNav holds the sublease.
+"""
+
+import threading
+
+from bosdyn.client.lease import LeaseKeepAlive
+
+
+class LeaseChurnMetrics(object):
+    """Lease operations of a LeaseManager."""
+
+    def __init__(self):
+        self.advances = 0
+        self.subleases_created = 0
+        self.subleases_reused = 0
+        self.keepalives_started = 0
+
+    def __str__(self):
+        return ("Lease churn: {} advances, {} subleases created, {} reused, "
+                "{} keep-alives started".format(self.advances, self.subleases_created,
+                                                self.subleases_reused, self.keepalives_started))
+
+
+class LeaseManager(object):
+    """Hands out the lease of a resource and a sublease of it, advancing only when required.
+
+    params:
+    + lease_client: LeaseClient whose lease wallet holds the acquired lease
+    + resource (optional): resource of the lease
+    """
+
+    def __init__(self, lease_client, resource='body'):
+        self._lease_client = lease_client
+        self._lease_wallet = lease_client.lease_wallet
+        self._resource = resource
+        self._sublease = None
+        self._lock = threading.Lock()
+        self.metrics = LeaseChurnMetrics()
+        self._keepalive = LeaseKeepAlive(lease_client, resource=resource)
+        self.metrics.keepalives_started += 1
+
+    def sublease(self):
+        """Return the sublease for GraphNav commands, creating it if no sublease is current.
+
+        Creating it advances the lease first, so that taking the lease back with lease() revokes
+        the sublease and nothing else.
+        """
+        with self._lock:
+            if self._sublease is not None:
+                self.metrics.subleases_reused += 1
+                return self._sublease
+            lease = self._lease_wallet.advance(self._resource)
+            self.metrics.advances += 1
+            self._sublease = lease.create_sublease()
+            self.metrics.subleases_created += 1
+            return self._sublease
+
+    def lease(self):
+        """Return the lease, for commands sent with it (power, uploads, clearing the graph).
+
+        If a sublease was given out, the lease is advanced so it is newer than the sublease; the
+        next call of sublease() creates a new one.
+        """
+        with self._lock:
+            if self._sublease is not None:
+                self._lease_wallet.advance(self._resource)
+                self.metrics.advances += 1
+                self._sublease = None
+            return self._lease_wallet.get_lease(self._resource)
+
+    def return_lease(self):
+        """Stop the keep-alive and return the lease to the robot."""
+        lease = self.lease()
+        self._keepalive.shutdown()
+        self._lease_client.return_lease(lease)
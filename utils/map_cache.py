@@ -0,0 +1,250 @@
+"""Persistent on-disk index of a GraphNav map, keyed by the content hash of the map files.
+
+The cache directory sits next to the map (`<MAP_DIR>/downloaded_graph.map_cache`) and holds:
+  - manifest.json: size, modification time and sha1 of every map file, plus their combined hash.
+  - index.json: waypoints, edges, anchors and anchored world objects as plain values, together
+    with the serialized fiducial of every (wo, waypoint, fiducial) tuple load_map builds.
+
+Building the index parses the waypoint snapshots once; later runs only parse the small graph
+file. The cache is rebuilt as soon as a file hash changes. File hashes are only recomputed for
+files whose size or modification time differ from the manifest. For a map container the hashes
+stored in its index are used, under the names the files have in a map directory.
+"""
+
+import base64
+import hashlib
+import json
+import os
+
+from bosdyn.api import world_object_pb2
+
+import graph_nav_util
+from utils.map_container import GRAPH, MapContainer, is_container
+from utils.map_loader import EDGE_SNAPSHOT_DIR, WAYPOINT_SNAPSHOT_DIR
+
+CACHE_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+INDEX_FILE_NAME = "index.json"
+
+
+def default_cache_dir(path):
+    """Return the cache directory used for the map at path."""
+    return os.path.normpath(path) + ".map_cache"
+
+
+def hash_file(file_name):
+    """Return the sha1 hex digest of a file."""
+    sha1 = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def se3_pose_to_list(pose):
+    """Convert a geometry_pb2.SE3Pose into [x, y, z, qw, qx, qy, qz]."""
+    return [
+        pose.position.x, pose.position.y, pose.position.z, pose.rotation.w, pose.rotation.x,
+        pose.rotation.y, pose.rotation.z
+    ]
+
+
+class MapIndex(object):
+    """Compact, protobuf free description of a map, as stored in the cache."""
+
+    def __init__(self, content_hash, data):
+        self.content_hash = content_hash
+        # Maps waypoint id to dict(name, snapshot_id, short_code, creation_time).
+        self.waypoints = data["waypoints"]
+        # List of dict(from_waypoint, to_waypoint, snapshot_id, cost).
+        self.edges = data["edges"]
+        # Maps waypoint id to seed_tform_waypoint as [x, y, z, qw, qx, qy, qz].
+        self.anchors = data["anchors"]
+        # Maps object id to dict(seed_tform_object, waypoint_id, fiducial), the last two are None
+        # if no waypoint snapshot saw the fiducial.
+        self.anchored_objects = data["anchored_objects"]
+
+    def anchored_world_objects(self, graph):
+        """Rebuild the {id: (wo,) or (wo, waypoint, fiducial)} dictionary load_map returns."""
+        waypoints = {waypoint.id: waypoint for waypoint in graph.waypoints}
+        anchored_world_objects = {}
+        for anchored_world_object in graph.anchoring.objects:
+            entry = self.anchored_objects.get(anchored_world_object.id)
+            if entry is None or entry["waypoint_id"] not in waypoints:
+                anchored_world_objects[anchored_world_object.id] = (anchored_world_object,)
+                continue
+            fiducial = world_object_pb2.WorldObject()
+            fiducial.ParseFromString(base64.b64decode(entry["fiducial"]))
+            anchored_world_objects[anchored_world_object.id] = (anchored_world_object,
+                                                                waypoints[entry["waypoint_id"]],
+                                                                fiducial)
+        return anchored_world_objects
+
+    @staticmethod
+    def from_map_loader(map_loader, content_hash):
+        """Build the index from a MapLoader; this parses the waypoint snapshots."""
+        graph = map_loader.graph
+        waypoints = {}
+        for waypoint in graph.waypoints:
+            creation_time = waypoint.annotations.creation_time
+            waypoints[waypoint.id] = {
+                "name": waypoint.annotations.name,
+                "snapshot_id": waypoint.snapshot_id,
+                "short_code": graph_nav_util.id_to_short_code(waypoint.id),
+                "creation_time": creation_time.seconds + creation_time.nanos / 1e9,
+            }
+        edges = [{
+            "from_waypoint": edge.id.from_waypoint,
+            "to_waypoint": edge.id.to_waypoint,
+            "snapshot_id": edge.snapshot_id,
+            "cost": edge.annotations.cost.value,
+        } for edge in graph.edges]
+        anchors = {
+            anchor.id: se3_pose_to_list(anchor.seed_tform_waypoint)
+            for anchor in graph.anchoring.anchors
+        }
+        anchored_objects = {}
+        for object_id, entry in map_loader.anchored_world_objects().items():
+            anchored_objects[object_id] = {
+                "seed_tform_object": se3_pose_to_list(entry[0].seed_tform_object),
+                "waypoint_id": entry[1].id if len(entry) == 3 else None,
+                "fiducial": (base64.b64encode(entry[2].SerializeToString()).decode("ascii")
+                             if len(entry) == 3 else None),
+            }
+        return MapIndex(
+            content_hash, {
+                "waypoints": waypoints,
+                "edges": edges,
+                "anchors": anchors,
+                "anchored_objects": anchored_objects,
+            })
+
+    def to_dict(self):
+        return {
+            "waypoints": self.waypoints,
+            "edges": self.edges,
+            "anchors": self.anchors,
+            "anchored_objects": self.anchored_objects,
+        }
+
+
+class MapCache(object):
+    """Cache directory for the map stored at path."""
+
+    def __init__(self, path, cache_dir=None):
+        self._path = path
+        self._cache_dir = cache_dir if cache_dir is not None else default_cache_dir(path)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def _map_files(self):
+        """Return the paths, relative to the map directory, of every file of the map."""
+        map_files = ["graph"]
+        for directory in (WAYPOINT_SNAPSHOT_DIR, EDGE_SNAPSHOT_DIR):
+            full_directory = os.path.join(self._path, directory)
+            if os.path.isdir(full_directory):
+                map_files.extend(
+                    os.path.join(directory, file_name)
+                    for file_name in sorted(os.listdir(full_directory)))
+        return map_files
+
+    def _read_json(self, file_name):
+        try:
+            with open(os.path.join(self._cache_dir, file_name), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, file_name, data):
+        # Write to a temporary file first so an interrupted run never leaves a truncated cache.
+        full_name = os.path.join(self._cache_dir, file_name)
+        with open(full_name + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(full_name + ".tmp", full_name)
+
+    def file_hashes(self, previous=None):
+        """Map every map file to [size, mtime_ns, sha1].
+
+        Hashes from a previous manifest are reused for files whose size and mtime are unchanged.
+        """
+        if is_container(self._path):
+            return self._container_file_hashes()
+        previous = previous or {}
+        file_hashes = {}
+        for relative_name in self._map_files():
+            stat = os.stat(os.path.join(self._path, relative_name))
+            old = previous.get(relative_name)
+            if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                file_hashes[relative_name] = old
+            else:
+                file_hashes[relative_name] = [
+                    stat.st_size, stat.st_mtime_ns,
+                    hash_file(os.path.join(self._path, relative_name))
+                ]
+        return file_hashes
+
+    def _container_file_hashes(self):
+        mtime_ns = os.stat(self._path).st_mtime_ns
+        with MapContainer(self._path) as container:
+            file_hashes = {GRAPH: [container.entry(GRAPH)[2], mtime_ns, container.entry(GRAPH)[4]]}
+            for directory in (WAYPOINT_SNAPSHOT_DIR, EDGE_SNAPSHOT_DIR):
+                for snapshot_id in container.snapshot_ids(directory):
+                    _, _, size, _, sha1 = container.entry(directory, snapshot_id)
+                    file_hashes[os.path.join(directory, snapshot_id)] = [size, mtime_ns, sha1]
+        return file_hashes
+
+    @staticmethod
+    def content_hash(file_hashes):
+        """Combine the per-file hashes into one hash for the whole map."""
+        sha1 = hashlib.sha1()
+        for relative_name in sorted(file_hashes):
+            sha1.update("{}:{}\n".format(relative_name, file_hashes[relative_name][2]).encode())
+        return sha1.hexdigest()
+
+    def load(self):
+        """Return the cached MapIndex, or None if there is no cache or the map changed."""
+        manifest = self._read_json(MANIFEST_FILE_NAME)
+        if not manifest or manifest.get("version") != CACHE_VERSION:
+            return None
+        content_hash = self.content_hash(self.file_hashes(manifest["files"]))
+        if content_hash != manifest["content_hash"]:
+            return None
+        index = self._read_json(INDEX_FILE_NAME)
+        if not index or index.get("content_hash") != content_hash:
+            return None
+        return MapIndex(content_hash, index["map"])
+
+    def build(self, map_loader):
+        """Build the MapIndex from map_loader and write it to the cache directory, if writable."""
+        previous = self._read_json(MANIFEST_FILE_NAME) or {}
+        file_hashes = self.file_hashes(previous.get("files"))
+        content_hash = self.content_hash(file_hashes)
+        map_index = MapIndex.from_map_loader(map_loader, content_hash)
+
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            self._write_json(INDEX_FILE_NAME, {
+                "content_hash": content_hash,
+                "map": map_index.to_dict()
+            })
+            # The manifest is written last; it is what marks the cache as valid.
+            self._write_json(MANIFEST_FILE_NAME, {
+                "version": CACHE_VERSION,
+                "content_hash": content_hash,
+                "files": file_hashes
+            })
+        except OSError as err:
+            # A read-only map still loads; the index is then built again on every run.
+            print("Could not write the map cache in {}: {}".format(self._cache_dir, err))
+        return map_index
+
+    def get(self, map_loader):
+        """Return the cached MapIndex, building it from map_loader if the cache is not valid."""
+        map_index = self.load()
+        if map_index is None:
+            print("Map cache is missing or out of date, building it in {}".format(
+                self._cache_dir))
+            map_index = self.build(map_loader)
+        return map_index
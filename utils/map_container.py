@@ -0,0 +1,228 @@
+"""Single-file container for a GraphNav map.
+
+A `downloaded_graph` directory holds a `graph` file plus one file per snapshot. A container packs
+the same serialized protobufs into one file, so a map is copied, hashed and opened as a single
+file:
+
+    header   magic, version, offset and size of the index (fixed size, see _HEADER)
+    blobs    the serialized graph and snapshots, one after another, each optionally compressed
+    index    JSON: for the graph and every snapshot, [offset, stored size, size, compression, sha1]
+
+The index is written after the blobs, so a container is written in one pass without holding the
+snapshots in memory. Readers mmap the file and only touch the blobs they parse; an uncompressed
+blob is handed to protobuf as a view on the mapping, without copying it.
+
+MapLoader accepts a container wherever it accepts a map directory. To convert a map:
+
+    python -m utils.map_container pack maps/cit121/downloaded_graph /tmp/cit121.gnmap
+    python -m utils.map_container unpack /tmp/cit121.gnmap /tmp/cit121
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+CONTAINER_EXTENSION = ".gnmap"
+CONTAINER_VERSION = 1
+GRAPH = "graph"
+WAYPOINT_SNAPSHOTS = "waypoint_snapshots"
+EDGE_SNAPSHOTS = "edge_snapshots"
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+
+_MAGIC = b"GNAVMAP\0"
+# magic, version, index offset, index size.
+_HEADER = struct.Struct("<8sIQQ")
+
+
+def is_container(path):
+    """Return True if path is a map container file rather than a map directory."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+class MapContainerWriter(object):
+    """Write a container in one pass: add the graph and the snapshots, then close it.
+
+    params:
+    + file_name: container to write, it only replaces an existing file once closed
+    + compression (optional): COMPRESSION_NONE or COMPRESSION_ZLIB, applied to every snapshot
+    + level (optional): zlib compression level
+    """
+
+    def __init__(self, file_name, compression=COMPRESSION_NONE, level=6):
+        if compression not in (COMPRESSION_NONE, COMPRESSION_ZLIB):
+            raise ValueError("Unknown compression {}".format(compression))
+        self._file_name = file_name
+        self._compression = compression
+        self._level = level
+        self._index = {GRAPH: None, WAYPOINT_SNAPSHOTS: {}, EDGE_SNAPSHOTS: {}}
+        # Write to a temporary file first so an interrupted run never leaves a truncated file.
+        self._file = open(file_name + ".tmp", "wb")
+        self._file.write(b"\0" * _HEADER.size)
+
+    def _write_blob(self, data, compression):
+        data = bytes(data)
+        stored = zlib.compress(data, self._level) if compression == COMPRESSION_ZLIB else data
+        if len(stored) >= len(data):
+            # Incompressible, keep it as is so it can be read without a copy.
+            stored, compression = data, COMPRESSION_NONE
+        offset = self._file.tell()
+        self._file.write(stored)
+        return [offset, len(stored), len(data), compression, hashlib.sha1(data).hexdigest()]
+
+    def add_graph(self, data):
+        """Add the serialized map_pb2.Graph; it is never compressed, it is read on every load."""
+        self._index[GRAPH] = self._write_blob(data, COMPRESSION_NONE)
+
+    def add_snapshot(self, kind, snapshot_id, data):
+        """Add a serialized snapshot of kind WAYPOINT_SNAPSHOTS or EDGE_SNAPSHOTS."""
+        self._index[kind][snapshot_id] = self._write_blob(data, self._compression)
+
+    def close(self):
+        if self._index[GRAPH] is None:
+            raise ValueError("A map container needs a graph")
+        index_offset = self._file.tell()
+        index = json.dumps(self._index, separators=(",", ":")).encode()
+        self._file.write(index)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(_MAGIC, CONTAINER_VERSION, index_offset, len(index)))
+        self._file.close()
+        os.replace(self._file_name + ".tmp", self._file_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._file_name + ".tmp")
+
+
+class MapContainer(object):
+    """Read-only, memory-mapped view of a container file."""
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+        with open(file_name, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset, index_size = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError("{} is not a map container".format(file_name))
+        if version != CONTAINER_VERSION:
+            raise ValueError("Unsupported map container version {}".format(version))
+        self._index = json.loads(bytes(self._mmap[index_offset:index_offset + index_size]))
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def snapshot_ids(self, kind):
+        return list(self._index[kind])
+
+    def entry(self, kind, snapshot_id=None):
+        """Return [offset, stored size, size, compression, sha1] of the graph or a snapshot."""
+        if kind == GRAPH:
+            return self._index[GRAPH]
+        return self._index[kind][snapshot_id]
+
+    def __contains__(self, key):
+        kind, snapshot_id = key
+        return snapshot_id in self._index[kind]
+
+    def read(self, kind, snapshot_id=None):
+        """Return the serialized graph or snapshot.
+
+        Uncompressed blobs are returned as a memoryview on the mapping; parse it and drop it,
+        the container cannot be closed while a view is alive.
+        """
+        offset, stored_size, _, compression, _ = self.entry(kind, snapshot_id)
+        data = memoryview(self._mmap)[offset:offset + stored_size]
+        if compression == COMPRESSION_ZLIB:
+            return zlib.decompress(data)
+        return data
+
+    def verify(self):
+        """Return the ids of the blobs whose content does not match their sha1."""
+        corrupted = []
+        keys = [(GRAPH, None)] + [(kind, snapshot_id) for kind in (WAYPOINT_SNAPSHOTS,
+                                                                   EDGE_SNAPSHOTS)
+                                  for snapshot_id in self._index[kind]]
+        for kind, snapshot_id in keys:
+            if hashlib.sha1(self.read(kind, snapshot_id)).hexdigest() != self.entry(
+                    kind, snapshot_id)[4]:
+                corrupted.append(snapshot_id or GRAPH)
+        return corrupted
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def pack_map(path, file_name, compression=COMPRESSION_NONE):
+    """Write the map at path, a directory or a container, into the container file_name."""
+    # Imported here, map_loader itself depends on this module.
+    from utils.map_loader import MapLoader
+    map_loader = MapLoader(path)
+    with MapContainerWriter(file_name, compression) as writer:
+        writer.add_graph(map_loader.graph_data())
+        for kind, snapshots in ((WAYPOINT_SNAPSHOTS, map_loader.waypoint_snapshots),
+                                (EDGE_SNAPSHOTS, map_loader.edge_snapshots)):
+            for snapshot_id in snapshots:
+                writer.add_snapshot(kind, snapshot_id, snapshots.raw(snapshot_id))
+    return file_name
+
+
+def unpack_map(file_name, path):
+    """Write the container file_name as a map directory at path, in the downloaded_graph layout."""
+    with MapContainer(file_name) as container:
+        for kind in (WAYPOINT_SNAPSHOTS, EDGE_SNAPSHOTS):
+            os.makedirs(os.path.join(path, kind), exist_ok=True)
+        for kind, snapshot_id, relative_name in [(GRAPH, None, GRAPH)] + [
+                (kind, snapshot_id, os.path.join(kind, snapshot_id))
+                for kind in (WAYPOINT_SNAPSHOTS, EDGE_SNAPSHOTS)
+                for snapshot_id in container.snapshot_ids(kind)]:
+            with open(os.path.join(path, relative_name), "wb") as f:
+                f.write(container.read(kind, snapshot_id))
+    return path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help='Pack a map directory into a container.')
+    pack_parser.add_argument('path', help='Map directory.')
+    pack_parser.add_argument('file_name', help='Container to write.')
+    pack_parser.add_argument('--compression', choices=[COMPRESSION_NONE, COMPRESSION_ZLIB],
+                             default=COMPRESSION_NONE, help='Compression of the snapshots.')
+    unpack_parser = subparsers.add_parser('unpack', help='Unpack a container into a directory.')
+    unpack_parser.add_argument('file_name', help='Container to read.')
+    unpack_parser.add_argument('path', help='Map directory to write.')
+    options = parser.parse_args(argv)
+
+    if options.command == 'pack':
+        pack_map(options.path, options.file_name, options.compression)
+        print("Packed {} ({} bytes)".format(options.file_name,
+                                            os.path.getsize(options.file_name)))
+    else:
+        unpack_map(options.file_name, options.path)
+        print("Unpacked {}".format(options.path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
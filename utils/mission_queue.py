@@ -0,0 +1,189 @@
+"""Navigate to a list of goals back to back, keeping the robot powered on and standing.
+
+Every navigation command of GraphNavInterface powers the robot on, and a robot that was powered
+off at start sits down and powers off again once the goal is reached, so a sequence of goals
+repeats power on, stand and sit cycles. A MissionQueue takes waypoint, route and anchor goals,
+resolves all of them (waypoint ids, planned routes, checked seed frame poses) before the robot
+moves, powers the robot on once and sends the command of each goal as soon as the feedback of the
+previous one reports STATUS_REACHED_GOAL. An anchor goal given without z takes the z height of
+the robot when its leg starts, as the previous legs may have taken the robot to another floor:
+
+    mission = MissionQueue(graph_nav_interface)
+    mission.add_waypoint("ab")
+    mission.add_route(["cd", "ef"])
+    mission.add_anchor([1.0, 2.0, 0.5])  # [x, y], [x, y, yaw], ... as for navigate to anchor
+    report = mission.run()
+    print(report)  # time of every goal and the idle time between them
+
+All the goals share one lease sublease (see utils/lease_manager.py). The robot is powered off at
+the end of the mission if it was off at start. The mission stops at the first goal not reached,
+unless stop_on_failure is False.
+"""
+
+import time
+
+import graph_nav_util
+from utils.navigation_driver import GoalMetrics
+from utils.rpc_tracing import traced
+from utils.spatial_index import AnchoringIndex
+
+WAYPOINT = "waypoint"
+ROUTE = "route"
+ANCHOR = "anchor"
+
+
+class MissionGoal(object):
+    """One goal of a mission.
+
+    params:
+    + kind: WAYPOINT, ROUTE or ANCHOR
+    + target: waypoint id or short code, list of them for a route, or the seed frame values of
+              an anchor goal ([x, y], [x, y, yaw], [x, y, z, yaw] or [x, y, z, qw, qx, qy, qz])
+    """
+
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+
+    def __str__(self):
+        if self.kind == ROUTE:
+            return "route {}".format(" ".join(str(waypoint) for waypoint in self.target))
+        if self.kind == ANCHOR:
+            return "anchor ({})".format(", ".join("{:.2f}".format(float(value))
+                                                  for value in self.target))
+        return "waypoint {}".format(self.target)
+
+
+class MissionReport(object):
+    """Result of a mission: the GoalMetrics of every goal driven, in order."""
+
+    def __init__(self, goals):
+        self.goals = goals
+        self.metrics = []
+        self.error = None
+        self.seconds = 0.0
+
+    @property
+    def complete(self):
+        return (self.error is None and len(self.metrics) == len(self.goals) and
+                all(metrics.reached_goal for metrics in self.metrics))
+
+    @property
+    def idle_seconds(self):
+        """Seconds between the terminal status of a goal and the first command of the next."""
+        return sum(max(0.0, metrics.start_time - previous.end_time)
+                   for previous, metrics in zip(self.metrics, self.metrics[1:]))
+
+    def __str__(self):
+        lines = ["Mission {} after {:.2f}s ({:.1f}ms idle between goals):".format(
+            "complete" if self.complete else "incomplete", self.seconds, 1000 * self.idle_seconds)]
+        for metrics in self.metrics:
+            lines.append("  {}".format(metrics))
+        for goal in self.goals[len(self.metrics):]:
+            lines.append("  {}: not run".format(goal))
+        if self.error is not None:
+            lines.append("  {}".format(self.error))
+        return "\n".join(lines)
+
+
+class MissionQueue(object):
+    """Drives the goals of a mission one after the other with a GraphNavInterface.
+
+    params:
+    + graph_nav_interface: GraphNavInterface with the map uploaded and the robot localized
+    + goals (optional): list of MissionGoal
+    + stop_on_failure (optional): stop the mission at the first goal that is not reached
+    """
+
+    def __init__(self, graph_nav_interface, goals=None, stop_on_failure=True):
+        self._interface = graph_nav_interface
+        self.goals = list(goals or [])
+        self.stop_on_failure = stop_on_failure
+
+    def add_waypoint(self, waypoint):
+        self.goals.append(MissionGoal(WAYPOINT, waypoint))
+
+    def add_route(self, waypoints):
+        self.goals.append(MissionGoal(ROUTE, list(waypoints)))
+
+    def add_anchor(self, values):
+        self.goals.append(MissionGoal(ANCHOR, list(values)))
+
+    def _resolve(self, goal, start_waypoint):
+        """Return (function of the leases driving the goal, waypoint it ends at), None if invalid.
+
+        start_waypoint is where the previous goal ends, the start of a route to a single waypoint.
+        """
+        interface = self._interface
+        driver = interface._navigation_driver
+        if goal.kind == WAYPOINT:
+            waypoint_id = graph_nav_util.find_unique_waypoint_id(
+                goal.target, interface._current_graph, interface._current_annotation_name_to_wp_id)
+            if not waypoint_id:
+                return None
+            return (lambda leases: driver.navigate_to(waypoint_id, leases=leases)), waypoint_id
+        if goal.kind == ROUTE:
+            route = interface._route_goal(goal.target, start_waypoint)
+            if route is None:
+                return None
+            return (lambda leases: driver.navigate_route(route, leases=leases)), \
+                route.waypoint_id[-1]
+        if goal.kind == ANCHOR:
+            seed_T_goal = interface._anchor_goal(goal.target, current_z=False)
+            if seed_T_goal is None:
+                return None
+            end_waypoint = None
+            if interface._current_graph is not None and len(
+                    interface._current_graph.anchoring.anchors):
+                end_waypoint, _ = AnchoringIndex.for_graph(
+                    interface._current_graph).waypoints.nearest(seed_T_goal.x, seed_T_goal.y)[0]
+            if len(goal.target) in [4, 7]:
+                seed_tform_goal = seed_T_goal.to_proto()
+                return (lambda leases: driver.navigate_to_anchor(seed_tform_goal,
+                                                                 leases=leases)), end_waypoint
+
+            def drive(leases):
+                # The z height is only known once the previous leg has ended.
+                seed_T_goal.z = interface._current_z()
+                if seed_T_goal.z is None:
+                    metrics = GoalMetrics(str(goal))
+                    metrics.end_time = metrics.start_time
+                    return metrics
+                return driver.navigate_to_anchor(seed_T_goal.to_proto(), leases=leases)
+
+            return drive, end_waypoint
+        print("Unknown goal {}.".format(goal.kind))
+        return None
+
+    @traced("mission")
+    def run(self):
+        """Resolve every goal, then drive them back to back; returns the MissionReport."""
+        report = MissionReport(self.goals)
+        start = time.time()
+        # Every goal is checked and planned before the robot moves, so nothing but the command
+        # is sent between two goals.
+        steps = []
+        end_waypoint = None
+        for goal in self.goals:
+            step = self._resolve(goal, end_waypoint)
+            if step is None:
+                report.error = "Invalid goal: {}".format(goal)
+                report.seconds = time.time() - start
+                return report
+            drive, end_waypoint = step
+            steps.append(drive)
+
+        with self._interface.navigation_batch():
+            if not self._interface.toggle_power(should_power_on=True):
+                report.error = "Failed to power on the robot."
+                report.seconds = time.time() - start
+                return report
+            for drive in steps:
+                # The sublease stays the same while only navigation commands are sent.
+                sublease = self._interface._lease_manager.sublease()
+                metrics = drive([sublease.lease_proto])
+                report.metrics.append(metrics)
+                if not metrics.reached_goal and self.stop_on_failure:
+                    break
+        report.seconds = time.time() - start
+        return report
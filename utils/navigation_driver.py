@@ -0,0 +1,175 @@
+"""Drive GraphNav navigation commands to completion without fixed sleeps.
+
+GraphNav commands are issued with a short duration so that stopping the program stops the robot;
+they have to be refreshed until the goal is reached. The helpers used to refresh the command,
+sleep half a second and only then poll the feedback. NavigationDriver instead refreshes the
+command every command_period seconds and polls the feedback in between, both through the async
+RPCs so a refresh and a poll overlap, and returns as soon as a terminal status is observed.
+
+The feedback period adapts to the remaining route length: the next poll is scheduled halfway to
+the estimated arrival time, clamped between min_feedback_period and command_period. Without an
+estimate the feedback is polled every command_period, or every min_feedback_period when the
+robot is already close to the goal or the remaining length is unknown.
+"""
+
+import time
+
+from bosdyn.api.graph_nav import graph_nav_pb2
+from bosdyn.client.exceptions import ResponseError
+
+from utils.rpc_tracing import traced_sleep
+
+_FEEDBACK = graph_nav_pb2.NavigationFeedbackResponse
+
+
+class GoalMetrics(object):
+    """Latency metrics of one navigation goal."""
+
+    def __init__(self, goal):
+        self.goal = goal
+        self.status = None
+        self.start_time = time.time()
+        self.end_time = None
+        self.first_command_latency = None
+        self.commands_sent = 0
+        self.feedback_polls = 0
+
+    @property
+    def seconds(self):
+        """Seconds from the first command to the terminal status (or until now)."""
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def reached_goal(self):
+        return self.status == _FEEDBACK.STATUS_REACHED_GOAL
+
+    def __str__(self):
+        status = _FEEDBACK.Status.Name(self.status) if self.status is not None else "NO STATUS"
+        return "Goal {}: {} after {:.2f}s ({} commands, {} feedback polls)".format(
+            self.goal, status, self.seconds, self.commands_sent, self.feedback_polls)
+
+
+class NavigationDriver(object):
+    """Issues a navigation command and follows it until it reaches a terminal status.
+
+    params:
+    + graph_nav_client: GraphNavClient used to send the commands
+    + cmd_duration (optional): seconds each command is valid for
+    + command_period (optional): seconds between command refreshes, must be below cmd_duration
+    + min_feedback_period (optional): minimum seconds between feedback polls
+    + near_goal_distance (optional): remaining route length, in meters, under which the feedback
+                            is polled every min_feedback_period until the arrival time can
+                            be estimated
+    """
+
+    def __init__(self, graph_nav_client, cmd_duration=1.0, command_period=0.5,
+                 min_feedback_period=0.05, near_goal_distance=1.0):
+        self._graph_nav_client = graph_nav_client
+        self.cmd_duration = cmd_duration
+        self.command_period = command_period
+        self.min_feedback_period = min_feedback_period
+        self.near_goal_distance = near_goal_distance
+        self.metrics = []  # GoalMetrics of every goal driven so far
+
+    def navigate_to(self, destination_waypoint, leases=None):
+        """Navigate to a waypoint id, returning the GoalMetrics."""
+        return self.run(
+            lambda command_id: self._graph_nav_client.navigate_to_async(
+                destination_waypoint, self.cmd_duration, leases=leases, command_id=command_id),
+            destination_waypoint)
+
+    def navigate_route(self, route, leases=None):
+        """Navigate a route built with GraphNavClient.build_route, returning the GoalMetrics."""
+        return self.run(
+            lambda command_id: self._graph_nav_client.navigate_route_async(
+                route, cmd_duration=self.cmd_duration, leases=leases, command_id=command_id),
+            route.waypoint_id[-1] if route.waypoint_id else None)
+
+    def navigate_to_anchor(self, seed_tform_goal, leases=None):
+        """Navigate to a geometry_pb2.SE3Pose in the seed frame, returning the GoalMetrics."""
+        return self.run(
+            lambda command_id: self._graph_nav_client.navigate_to_anchor_async(
+                seed_tform_goal, self.cmd_duration, leases=leases, command_id=command_id),
+            "seed ({:.2f}, {:.2f})".format(seed_tform_goal.position.x,
+                                           seed_tform_goal.position.y))
+
+    def _feedback_period(self, feedback, previous):
+        """Return how long to wait before the next feedback poll.
+
+        previous is the (time, remaining_route_length) of the previous poll, used to estimate the
+        time left to reach the goal; the next poll is scheduled halfway there.
+        """
+        remaining = getattr(feedback, "remaining_route_length", 0.0)
+        if remaining <= 0.0:
+            return self.min_feedback_period
+        if previous is not None:
+            elapsed = time.time() - previous[0]
+            travelled = previous[1] - remaining
+            if elapsed > 0 and travelled > 0:
+                time_to_goal = remaining * elapsed / travelled
+                return max(self.min_feedback_period, min(self.command_period, time_to_goal / 2))
+        if remaining < self.near_goal_distance:
+            return self.min_feedback_period
+        return self.command_period
+
+    @staticmethod
+    def is_finished(status):
+        """Return True for a terminal navigation status, printing why the robot stopped."""
+        if status == _FEEDBACK.STATUS_REACHED_GOAL:
+            # Successfully completed the navigation commands!
+            return True
+        elif status == _FEEDBACK.STATUS_LOST:
+            print("Robot got lost when navigating the route, the robot will now sit down.")
+            return True
+        elif status == _FEEDBACK.STATUS_STUCK:
+            print("Robot got stuck when navigating the route, the robot will now sit down.")
+            return True
+        elif status == _FEEDBACK.STATUS_ROBOT_IMPAIRED:
+            print("Robot is impaired.")
+            return True
+        # Navigation command is not complete yet.
+        return False
+
+    def run(self, send_command, goal=None):
+        """Follow a navigation command until it finishes.
+
+        send_command(command_id) must issue the command asynchronously and return the future of
+        its command id; command_id is None for the first call.
+        """
+        metrics = GoalMetrics(goal)
+        self.metrics.append(metrics)
+        try:
+            command_id = send_command(None).result()
+        except ResponseError as e:
+            print("Error while navigating {}".format(e))
+            metrics.end_time = time.time()
+            return metrics
+        metrics.commands_sent += 1
+        metrics.first_command_latency = time.time() - metrics.start_time
+        next_refresh = metrics.start_time + self.command_period
+        previous = None
+
+        while True:
+            now = time.time()
+            # Refresh the command and poll the feedback at the same time.
+            command_future = None
+            if now >= next_refresh:
+                command_future = send_command(command_id)
+                next_refresh = now + self.command_period
+            feedback = self._graph_nav_client.navigation_feedback_async(command_id).result()
+            metrics.feedback_polls += 1
+            if command_future is not None:
+                try:
+                    command_future.result()
+                    metrics.commands_sent += 1
+                except ResponseError as e:
+                    print("Error while navigating {}".format(e))
+                    break
+            metrics.status = feedback.status
+            if self.is_finished(feedback.status):
+                break
+            wake_up = min(next_refresh, now + self._feedback_period(feedback, previous))
+            previous = (now, getattr(feedback, "remaining_route_length", 0.0))
+            traced_sleep(max(0.0, wake_up - time.time()), "wait for navigation feedback")
+        metrics.end_time = time.time()
+        return metrics
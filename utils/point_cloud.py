@@ -0,0 +1,136 @@
+"""Point clouds of the waypoint snapshots of a GraphNav map, as NumPy arrays in the seed frame.
+
+Every waypoint snapshot holds the point cloud the robot saw at that waypoint, expressed in the
+frame of its sensor. cloud_points decodes it without copying, seed_tform_cloud places it in the
+seed frame through the waypoint's anchor, and voxel_downsample keeps one point (the centroid) per
+occupied voxel.
+
+build_map_cloud merges the clouds of every anchored waypoint into a single downsampled cloud of
+the whole map. Decoding is dominated by protobuf parsing, which holds the GIL, so the snapshots
+are parsed and processed in a process pool, each worker returning an already downsampled cloud.
+"""
+
+import concurrent.futures
+import os
+
+import numpy as np
+
+from bosdyn.api import point_cloud_pb2
+from bosdyn.api.graph_nav import map_pb2
+from bosdyn.client.frame_helpers import ODOM_FRAME_NAME, get_a_tform_b
+from bosdyn.client.math_helpers import SE3Pose
+
+from utils.map_loader import get_map_loader
+
+
+def cloud_points(point_cloud):
+    """Return the (N, 3) float32 points of a point_cloud_pb2.PointCloud, in its sensor frame.
+
+    The array is a read-only view on the message data, no copy is made.
+    """
+    if point_cloud.encoding != point_cloud_pb2.PointCloud.ENCODING_XYZ_32F:
+        raise ValueError("Unsupported point cloud encoding {}".format(
+            point_cloud_pb2.PointCloud.Encoding.Name(point_cloud.encoding)))
+    points = np.frombuffer(point_cloud.data, dtype=np.float32)
+    if points.size != 3 * point_cloud.num_points:
+        raise ValueError("Point cloud holds {} values for {} points".format(
+            points.size, point_cloud.num_points))
+    return points.reshape(-1, 3)
+
+
+def seed_tform_cloud(waypoint, seed_tform_waypoint, point_cloud):
+    """Return the SE3Pose of a waypoint snapshot's point cloud in the seed frame.
+
+    params:
+    + waypoint: map_pb2.Waypoint the snapshot belongs to
+    + seed_tform_waypoint: geometry_pb2.SE3Pose of the waypoint's anchor
+    + point_cloud: point_cloud_pb2.PointCloud of the snapshot
+    """
+    odom_tform_cloud = get_a_tform_b(point_cloud.source.transforms_snapshot, ODOM_FRAME_NAME,
+                                     point_cloud.source.frame_name_sensor)
+    waypoint_tform_odom = SE3Pose.from_proto(waypoint.waypoint_tform_ko)
+    return SE3Pose.from_proto(seed_tform_waypoint) * waypoint_tform_odom * odom_tform_cloud
+
+
+def transform_points(a_tform_b, points):
+    """Return the (N, 3) float32 points, given in frame b, expressed in frame a."""
+    matrix = a_tform_b.to_matrix()
+    return (points @ matrix[:3, :3].T.astype(np.float32)) + matrix[:3, 3].astype(np.float32)
+
+
+def voxel_downsample(points, voxel_size):
+    """Return the centroid of the points of every occupied voxel of side voxel_size."""
+    if not voxel_size or len(points) == 0:
+        return points
+    voxels = np.floor(points / voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=0)
+    # Pack the three voxel coordinates into one integer key, 21 bits each.
+    keys = (voxels[:, 0] << 42) | (voxels[:, 1] << 21) | voxels[:, 2]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    centroids = np.empty((len(counts), 3), dtype=np.float32)
+    for axis in range(3):
+        centroids[:, axis] = np.bincount(inverse, weights=points[:, axis]) / counts
+    return centroids
+
+
+def waypoint_cloud(waypoint, seed_tform_waypoint, waypoint_snapshot, voxel_size=None):
+    """Return the points of a waypoint snapshot in the seed frame, optionally downsampled."""
+    point_cloud = waypoint_snapshot.point_cloud
+    points = transform_points(seed_tform_cloud(waypoint, seed_tform_waypoint, point_cloud),
+                              cloud_points(point_cloud))
+    return voxel_downsample(points, voxel_size)
+
+
+def _waypoint_cloud_from_snapshot(args):
+    """Process pool task: parse a waypoint snapshot of the map at path and return its seed frame
+    cloud."""
+    waypoint_data, seed_tform_waypoint_data, path, snapshot_id, voxel_size = args
+    waypoint = map_pb2.Waypoint()
+    waypoint.ParseFromString(waypoint_data)
+    anchor = map_pb2.Anchor()
+    anchor.ParseFromString(seed_tform_waypoint_data)
+    waypoint_snapshot = map_pb2.WaypointSnapshot()
+    # Only the raw snapshot is read, the parsed one is not kept in the worker's MapLoader.
+    waypoint_snapshot.ParseFromString(get_map_loader(path).waypoint_snapshots.raw(snapshot_id))
+    return waypoint.id, waypoint_cloud(waypoint, anchor.seed_tform_waypoint, waypoint_snapshot,
+                                       voxel_size)
+
+
+def load_waypoint_clouds(path, voxel_size=None, max_workers=None, map_loader=None,
+                         waypoint_ids=None):
+    """Map the id of every anchored waypoint of the map at path to its seed frame cloud.
+
+    params:
+    + path: root directory of the map
+    + voxel_size (optional): side of the voxels each cloud is downsampled to, in meters
+    + max_workers (optional): number of processes, 1 processes the snapshots in this process
+    + map_loader (optional): MapLoader of the map, the shared one for path by default
+    + waypoint_ids (optional): only load the clouds of these waypoints
+    """
+    map_loader = map_loader if map_loader is not None else get_map_loader(path)
+    tasks = [(waypoint.SerializeToString(),
+              map_loader.anchors[waypoint.id].SerializeToString(), path, waypoint.snapshot_id,
+              voxel_size)
+             for waypoint in map_loader.graph.waypoints
+             if waypoint.id in map_loader.anchors and
+             waypoint.snapshot_id in map_loader.waypoint_snapshots and
+             (waypoint_ids is None or waypoint.id in waypoint_ids)]
+    if max_workers == 1 or len(tasks) <= 1:
+        return dict(map(_waypoint_cloud_from_snapshot, tasks))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Hand the tasks out in chunks to keep the inter-process overhead low.
+        chunksize = max(1, len(tasks) // (4 * (max_workers or os.cpu_count() or 1)))
+        return dict(executor.map(_waypoint_cloud_from_snapshot, tasks, chunksize=chunksize))
+
+
+def build_map_cloud(path, voxel_size=0.05, max_workers=None, map_loader=None):
+    """Return the (N, 3) float32 cloud of the whole map at path, in the seed frame.
+
+    Each waypoint cloud is downsampled to voxel_size, then the merged cloud is downsampled again
+    so overlapping waypoints do not add duplicate points.
+    """
+    clouds = load_waypoint_clouds(path, voxel_size, max_workers, map_loader)
+    if not clouds:
+        return np.empty((0, 3), dtype=np.float32)
+    return voxel_downsample(np.concatenate(list(clouds.values())), voxel_size)
@@ -0,0 +1,226 @@
+"""Shortest routes between waypoints of a GraphNav map, planned on the client.
+
+RoutePlanner searches the map_pb2.Graph for the cheapest sequence of edges between two waypoints,
+using edge.annotations.cost (or, when an edge has no cost, the distance between its anchored
+waypoints). It runs A* with the straight line distance between anchored waypoints as the
+heuristic, scaled down so it never overestimates the edge costs of the map; without anchoring it
+falls back to Dijkstra.
+
+Results are cached: every planned (start, goal) pair is kept, and precompute() runs Dijkstra
+from some or all waypoints so any route starting or ending there is rebuilt from its shortest
+path tree without searching, e.g. for patrols that repeat the same stops.
+
+    planner = RoutePlanner.for_graph(graph)
+    waypoint_ids, edge_ids = planner.plan(start_waypoint_id, goal_waypoint_id)
+    route = graph_nav_client.build_route(waypoint_ids, edge_ids)
+
+order_stops() orders the stops of a tour so the route through them is short: a nearest neighbour
+tour over the planned route costs, improved with 2-opt moves.
+"""
+
+import heapq
+import math
+
+import graph_nav_util
+
+
+class RoutePlanner(object):
+    """Plans routes over the edges of a map_pb2.Graph.
+
+    params:
+    + graph: map_pb2.Graph to plan on
+    + default_cost (optional): cost of an edge without cost annotation between waypoints that
+                            are not both anchored
+    """
+
+    # The most recently built planner, returned again by for_graph for the same graph.
+    _last = None
+
+    def __init__(self, graph, default_cost=1.0):
+        self.graph = graph
+        self.graph_index = graph_nav_util.GraphIndex.for_graph(graph)
+        # Maps waypoint id to its (x, y, z) position in the seed frame.
+        self.positions = {
+            anchor.id: (anchor.seed_tform_waypoint.position.x,
+                        anchor.seed_tform_waypoint.position.y,
+                        anchor.seed_tform_waypoint.position.z)
+            for anchor in graph.anchoring.anchors
+        }
+        # Maps waypoint id to list((neighbor id, cost)).
+        self.neighbors = {waypoint_id: [] for waypoint_id in self.graph_index.waypoints}
+        # The largest factor the straight line distance can be scaled by without exceeding the
+        # cost of any edge, which keeps A* optimal.
+        self.heuristic_scale = 1.0
+        for edge in graph.edges:
+            from_waypoint, to_waypoint = edge.id.from_waypoint, edge.id.to_waypoint
+            distance = self.distance(from_waypoint, to_waypoint)
+            if edge.annotations.HasField("cost"):
+                cost = edge.annotations.cost.value
+            else:
+                cost = distance if distance is not None else default_cost
+            if distance:
+                self.heuristic_scale = min(self.heuristic_scale, cost / distance)
+            # Edges can be traversed in both directions.
+            self.neighbors.setdefault(from_waypoint, []).append((to_waypoint, cost))
+            self.neighbors.setdefault(to_waypoint, []).append((from_waypoint, cost))
+        self.heuristic_scale = max(0.0, self.heuristic_scale)
+        self._routes = dict()  # maps (start, goal) to (waypoint ids, cost)
+        self._trees = dict()  # maps source to (cost to source, previous waypoint) dicts
+
+    @classmethod
+    def for_graph(cls, graph):
+        """Return the planner of graph, reusing the last one built if it is for the same graph."""
+        last = cls._last
+        if last is None or last.graph_index is not graph_nav_util.GraphIndex.for_graph(graph):
+            last = cls._last = cls(graph)
+        return last
+
+    def distance(self, waypoint1, waypoint2):
+        """Return the straight line distance between two anchored waypoints, or None."""
+        position1 = self.positions.get(waypoint1)
+        position2 = self.positions.get(waypoint2)
+        if position1 is None or position2 is None:
+            return None
+        return math.sqrt(sum((a - b)**2 for a, b in zip(position1, position2)))
+
+    def _heuristic(self, waypoint_id, goal):
+        distance = self.distance(waypoint_id, goal)
+        return distance * self.heuristic_scale if distance is not None else 0.0
+
+    def _search(self, start, goal=None):
+        """A* from start to goal, or Dijkstra over the whole graph if goal is None.
+
+        Returns the (cost to start, previous waypoint) dictionaries of the search.
+        """
+        costs = {start: 0.0}
+        previous = {start: None}
+        done = set()
+        queue = [(0.0, 0.0, start)]
+        while queue:
+            _, cost, waypoint_id = heapq.heappop(queue)
+            if waypoint_id in done:
+                continue
+            done.add(waypoint_id)
+            if waypoint_id == goal:
+                break
+            for neighbor, edge_cost in self.neighbors.get(waypoint_id, ()):
+                new_cost = cost + edge_cost
+                if neighbor not in costs or new_cost < costs[neighbor]:
+                    costs[neighbor] = new_cost
+                    previous[neighbor] = waypoint_id
+                    estimate = new_cost + (self._heuristic(neighbor, goal) if goal else 0.0)
+                    heapq.heappush(queue, (estimate, new_cost, neighbor))
+        return costs, previous
+
+    @staticmethod
+    def _path(previous, goal):
+        path = [goal]
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path
+
+    def precompute(self, sources=None):
+        """Compute the shortest path trees of sources (by default every waypoint).
+
+        Routes from or to these waypoints are then planned without searching the graph.
+        """
+        for source in (sources if sources is not None else self.graph_index.waypoints):
+            if source not in self._trees:
+                self._trees[source] = self._search(source)
+
+    def plan_waypoints(self, start, goal):
+        """Return (waypoint ids, cost) of the cheapest route, or (None, None) if there is none."""
+        if (start, goal) in self._routes:
+            return self._routes[(start, goal)]
+        if start not in self.neighbors or goal not in self.neighbors:
+            return None, None
+        if start in self._trees:
+            costs, previous = self._trees[start]
+            route = (self._path(previous, goal), costs[goal]) if goal in costs else (None, None)
+        elif goal in self._trees:
+            # Edges are traversed in both directions, so the route from the goal can be reversed.
+            costs, previous = self._trees[goal]
+            route = ((list(reversed(self._path(previous, start))), costs[start])
+                     if start in costs else (None, None))
+        else:
+            costs, previous = self._search(start, goal)
+            route = (self._path(previous, goal), costs[goal]) if goal in costs else (None, None)
+        self._routes[(start, goal)] = route
+        return route
+
+    def plan(self, start, goal):
+        """Return the (waypoint ids, edge ids) to give to GraphNavClient.build_route.
+
+        Both are None if the waypoints are not connected.
+        """
+        waypoint_ids, _ = self.plan_waypoints(start, goal)
+        if waypoint_ids is None:
+            return None, None
+        edge_ids = [
+            self.graph_index.match_edge(waypoint1, waypoint2)
+            for waypoint1, waypoint2 in zip(waypoint_ids[:-1], waypoint_ids[1:])
+        ]
+        return waypoint_ids, edge_ids
+
+    def plan_stops(self, stops):
+        """Return the (waypoint ids, edge ids) of a route visiting every stop in order.
+
+        Both are None if two consecutive stops are not connected.
+        """
+        waypoint_ids = stops[:1]
+        edge_ids = []
+        for start, goal in zip(stops[:-1], stops[1:]):
+            leg_waypoint_ids, leg_edge_ids = self.plan(start, goal)
+            if leg_waypoint_ids is None:
+                return None, None
+            waypoint_ids.extend(leg_waypoint_ids[1:])
+            edge_ids.extend(leg_edge_ids)
+        return waypoint_ids, edge_ids
+
+    def _cost(self, start, goal):
+        _, cost = self.plan_waypoints(start, goal)
+        return cost if cost is not None else float("inf")
+
+    def order_stops(self, stops, start=None):
+        """Return the indices of stops in the order that makes the route through them short.
+
+        The route starts at the start waypoint if given, otherwise at the first stop. Stops are
+        waypoint ids and may repeat.
+        """
+        if not stops:
+            return []
+        self.precompute(set(stops))
+        remaining = list(range(len(stops)))
+        # Number of waypoints before the first of order in the tour, i.e. the given start.
+        offset = 0 if start is None else 1
+        if start is None:
+            start = stops[remaining.pop(0)]
+            order = [0]
+        else:
+            order = []
+        # Nearest neighbour tour.
+        current = start
+        while remaining:
+            nearest = min(remaining, key=lambda i: self._cost(current, stops[i]))
+            remaining.remove(nearest)
+            order.append(nearest)
+            current = stops[nearest]
+
+        # 2-opt: reverse segments of the tour while that shortens it. The start stays first.
+        path = ([start] if offset else []) + [stops[i] for i in order]
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, len(path) - 1):
+                for j in range(i + 1, len(path)):
+                    before = self._cost(path[i - 1], path[i])
+                    after = self._cost(path[i - 1], path[j])
+                    if j + 1 < len(path):
+                        before += self._cost(path[j], path[j + 1])
+                        after += self._cost(path[i], path[j + 1])
+                    if after < before - 1e-9:
+                        path[i:j + 1] = reversed(path[i:j + 1])
+                        order[i - offset:j + 1 - offset] = reversed(order[i - offset:j + 1 - offset])
+                        improved = True
+        return order
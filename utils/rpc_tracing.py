@@ -0,0 +1,492 @@
+"""Trace the RPCs and the waits of a mission, to see where its time goes.
+
+An RpcTracer records a span for every RPC of the clients it instruments: the service and method,
+start time and duration, calling thread, request and response sizes in bytes, gRPC status code and,
+for responses with a status field, the name of that status (e.g. STATUS_REACHED_GOAL). Our own
+waits and steps are recorded with traced_sleep and span, and the GraphNavInterface commands are traced
+with @traced:
+
+    tracer = RpcTracer()
+    with tracer:
+        tracer.instrument_robot(robot)
+        graph_nav_interface = GraphNavInterface(robot, map_path)
+        graph_nav_interface._upload_graph_and_snapshots()
+        with span("tour"):
+            ...
+    tracer.print_summary()  # count, p50/p90/p99 and payload sizes of every RPC and span
+    tracer.write_chrome_trace("mission.trace.json")  # open in chrome://tracing or Perfetto
+
+RPCs are traced by gRPC client interceptors installed on the clients' channels, so blocking,
+async and streaming calls are all seen. Nothing is installed while no tracer is used:
+traced_sleep then is time.sleep, and span and @traced only check for the active tracer, so a
+run without tracing costs the same as before.
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+import grpc
+
+# The tracer spans and sleeps are recorded to, between RpcTracer.start and stop.
+_active = None
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Span(object):
+    """One traced RPC, wait or step.
+
+    params:
+    + name: method of an RPC, or name of the wait or step
+    + category: service of an RPC, "sleep" or "span"
+    + start: time.perf_counter() at which it started
+    + duration: seconds it took
+    + thread: identifier of the thread that started it
+    + args (optional): dict of details, e.g. request_bytes, response_bytes, code and status
+    """
+
+    def __init__(self, name, category, start, duration, thread, args=None):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.duration = duration
+        self.thread = thread
+        self.args = args or dict()
+
+
+class LatencyHistogram(object):
+    """Durations of the spans of one name, in buckets growing by a factor of two.
+
+    params:
+    + first_bucket (optional): upper bound, in seconds, of the first bucket
+    + num_buckets (optional): number of buckets, the last one holds everything above the others
+    """
+
+    def __init__(self, first_bucket=0.0001, num_buckets=21):
+        self.bounds = [first_bucket * 2 ** i for i in range(num_buckets - 1)]
+        self.counts = [0] * num_buckets
+        self._durations = []
+        self._sorted = True
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(self.bounds, duration)] += 1
+        self._durations.append(duration)
+        self._sorted = False
+
+    @property
+    def count(self):
+        return len(self._durations)
+
+    @property
+    def total(self):
+        return sum(self._durations)
+
+    def percentile(self, q):
+        """Return the duration below which q percent of the durations are (nearest rank)."""
+        if not self._durations:
+            return 0.0
+        if not self._sorted:
+            self._durations.sort()
+            self._sorted = True
+        rank = max(1, int(math.ceil(q / 100.0 * len(self._durations))))
+        return self._durations[rank - 1]
+
+    def buckets(self):
+        """Return (upper bound in seconds, count) of the non-empty buckets, None for the last."""
+        bounds = self.bounds + [None]
+        return [(bound, count) for bound, count in zip(bounds, self.counts) if count]
+
+
+class RpcTracer(object):
+    """Records the spans of the instrumented clients and of the code run while it is active.
+
+    params:
+    + max_spans (optional): spans kept for the trace file, the histograms count all of them
+    """
+
+    def __init__(self, max_spans=1000000):
+        self.spans = []
+        self.dropped_spans = 0
+        self.histograms = dict()  # maps (category, name) to LatencyHistogram
+        self.payload_bytes = dict()  # maps (category, name) to [request bytes, response bytes]
+        self.errors = dict()  # maps (category, name) to the number of failed RPCs
+        self._max_spans = max_spans
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._interceptor = _TracingInterceptor(self)
+        self._previous = None
+        # The instrumented channels keep their interceptor; it only records while this is set.
+        self.recording = False
+
+    def start(self):
+        """Make this the tracer spans, sleeps and RPCs are recorded to, until stop. Returns self."""
+        global _active
+        self._previous, _active = _active, self
+        self.recording = True
+        return self
+
+    def stop(self):
+        """Stop recording; RPCs still running are not recorded when they end.
+
+        Spans passed to record directly are still recorded.
+        """
+        global _active
+        self.recording = False
+        if _active is self:
+            _active = self._previous
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def record(self, name, category, start, duration, thread=None, args=None):
+        """Record a span that started at time.perf_counter() start and took duration seconds."""
+        span = Span(name, category, start, duration,
+                    thread if thread is not None else threading.get_ident(), args)
+        key = (category, name)
+        with self._lock:
+            if len(self.spans) < self._max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(duration)
+            if 'request_bytes' in span.args:
+                payload = self.payload_bytes.setdefault(key, [0, 0])
+                payload[0] += span.args['request_bytes']
+                payload[1] += span.args.get('response_bytes', 0)
+            if span.args.get('code', 'OK') != 'OK':
+                self.errors[key] = self.errors.get(key, 0) + 1
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, category="span"):
+        """Context manager recording the time its block takes as a span."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start)
+
+    def instrument_client(self, client):
+        """Trace every RPC of an SDK client, e.g. one returned by robot.ensure_client.
+
+        The client's channel is replaced by one going through the tracer's interceptor; a channel
+        the SDK creates again after an error is intercepted as well. Returns the client.
+        """
+        if getattr(client, '_rpc_tracer', None) is self:
+            return client
+        client._rpc_tracer = self
+        client.channel = _InterceptedChannel(client.channel, self._interceptor)
+        reset_channel = getattr(client, '_channel_reset_fn', None)
+        if reset_channel is not None:
+            client._channel_reset_fn = lambda: _InterceptedChannel(reset_channel(),
+                                                                   self._interceptor)
+        return client
+
+    def instrument_robot(self, robot):
+        """Trace the RPCs of every client the robot has created and will create.
+
+        Works with a bosdyn.client.robot.Robot or a utils.fake_robot.FakeRobot. Returns the robot.
+        """
+        for client in list(getattr(robot, 'service_clients_by_name', dict()).values()):
+            self.instrument_client(client)
+        ensure_client = robot.ensure_client
+
+        @functools.wraps(ensure_client)
+        def traced_ensure_client(*args, **kwargs):
+            return self.instrument_client(ensure_client(*args, **kwargs))
+
+        robot.ensure_client = traced_ensure_client
+        return robot
+
+    def summary(self):
+        """Return a dict mapping "category/name" to the statistics of its spans, in seconds."""
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda item: -item[1].total)
+            stats = dict()
+            for key, histogram in items:
+                # None for the spans that are not RPCs.
+                request_bytes, response_bytes = self.payload_bytes.get(key, (None, None))
+                stats["{}/{}".format(*key)] = dict(
+                    count=histogram.count, total=histogram.total,
+                    p50=histogram.percentile(50), p90=histogram.percentile(90),
+                    p99=histogram.percentile(99), max=histogram.percentile(100),
+                    request_bytes=request_bytes, response_bytes=response_bytes,
+                    errors=self.errors.get(key, 0), buckets=histogram.buckets())
+        return stats
+
+    def print_summary(self):
+        """Print the statistics of every span name, the longest total first."""
+        print("{:<48}{:>7}{:>10}{:>9}{:>9}{:>9}{:>12}{:>12}{:>7}".format(
+            "span", "count", "total (s)", "p50 ms", "p90 ms", "p99 ms", "sent B", "received B",
+            "errors"))
+        for name, stats in self.summary().items():
+            is_rpc = stats['request_bytes'] is not None
+            print("{:<48}{:>7}{:>10.3f}{:>9.2f}{:>9.2f}{:>9.2f}{:>12}{:>12}{:>7}".format(
+                name[-48:], stats['count'], stats['total'], 1000 * stats['p50'],
+                1000 * stats['p90'], 1000 * stats['p99'],
+                stats['request_bytes'] if is_rpc else "-",
+                stats['response_bytes'] if is_rpc else "-", stats['errors'] if is_rpc else "-"))
+        if self.dropped_spans:
+            print("{} spans were not kept for the trace file.".format(self.dropped_spans))
+
+    def write_chrome_trace(self, path):
+        """Write the spans as a Chrome trace event file, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events = [
+            dict(name=span.name, cat=span.category, ph="X", pid=pid, tid=span.thread,
+                 ts=round(1e6 * (span.start - self._origin), 3),
+                 dur=round(1e6 * span.duration, 3), args=span.args) for span in spans
+        ]
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms",
+                           otherData=dict(summary=self.summary())), f)
+
+
+def span(name, category="span"):
+    """Context manager recording its block as a span of the active tracer, if there is one."""
+    if _active is None:
+        return _NULL_SPAN
+    return _active.span(name, category)
+
+
+def traced_sleep(seconds, name="sleep"):
+    """time.sleep, recorded as a span of the active tracer, if there is one."""
+    if _active is None:
+        time.sleep(seconds)
+        return
+    start = time.perf_counter()
+    time.sleep(seconds)
+    _active.record(name, "sleep", start, time.perf_counter() - start)
+
+
+def traced(name):
+    """Decorator recording every call of a function as a span of the active tracer."""
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with _active.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _split_method(method):
+    # "/bosdyn.api.graph_nav.GraphNavService/NavigateTo" -> ("GraphNavService", "NavigateTo")
+    if isinstance(method, bytes):
+        method = method.decode()
+    service, _, name = method.rpartition('/')
+    return service.rpartition('.')[2], name
+
+
+def _status_name(response):
+    # The outcome the robot reports, for responses with a status enum such as NavigateToResponse.
+    field = response.DESCRIPTOR.fields_by_name.get('status')
+    if field is None or field.enum_type is None:
+        return None
+    value = field.enum_type.values_by_number.get(getattr(response, 'status'))
+    return value.name if value is not None else None
+
+
+class _NamedMethod(object):
+    """A method of an intercepted channel, with the name in bytes the SDK logs it by."""
+
+    def __init__(self, multi_callable, method):
+        self._multi_callable = multi_callable
+        self._method = method.encode() if isinstance(method, str) else method
+
+    def __call__(self, *args, **kwargs):
+        return self._multi_callable(*args, **kwargs)
+
+    def with_call(self, *args, **kwargs):
+        return self._multi_callable.with_call(*args, **kwargs)
+
+    def future(self, *args, **kwargs):
+        return self._multi_callable.future(*args, **kwargs)
+
+
+# The SDK tells streaming requests apart by the type of the method.
+class _UnaryUnaryMethod(_NamedMethod, grpc.UnaryUnaryMultiCallable):
+    pass
+
+
+class _UnaryStreamMethod(_NamedMethod, grpc.UnaryStreamMultiCallable):
+    pass
+
+
+class _StreamUnaryMethod(_NamedMethod, grpc.StreamUnaryMultiCallable):
+    pass
+
+
+class _StreamStreamMethod(_NamedMethod, grpc.StreamStreamMultiCallable):
+    pass
+
+
+class _InterceptedChannel(object):
+    """grpc.intercept_channel, whose methods keep the _method attribute of a grpc.Channel's."""
+
+    def __init__(self, channel, interceptor):
+        self._channel = grpc.intercept_channel(channel, interceptor)
+
+    def unary_unary(self, method, *args, **kwargs):
+        return _UnaryUnaryMethod(self._channel.unary_unary(method, *args, **kwargs), method)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return _UnaryStreamMethod(self._channel.unary_stream(method, *args, **kwargs), method)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return _StreamUnaryMethod(self._channel.stream_unary(method, *args, **kwargs), method)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return _StreamStreamMethod(self._channel.stream_stream(method, *args, **kwargs), method)
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class _CountedRequests(object):
+    """Iterator over the requests of a client stream, adding up their sizes."""
+
+    def __init__(self, requests):
+        self._requests = iter(requests)
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        request = next(self._requests)
+        self.bytes += request.ByteSize()
+        return request
+
+
+class _TracedResponses(object):
+    """The call of a server stream, recording its span once the last response was read."""
+
+    def __init__(self, call, finish):
+        self._call = call
+        self._finish = finish
+        self._bytes = 0
+        self._last = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response = next(self._call)
+        except StopIteration:
+            self._finish(self._bytes, self._last, None)
+            raise
+        except grpc.RpcError as err:
+            self._finish(self._bytes, None, err)
+            raise
+        self._bytes += response.ByteSize()
+        self._last = response
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+class _TracingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                          grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+    """Records a span of the tracer for every RPC going through the channels it intercepts."""
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def _record(self, method, start, thread, request_bytes, response_bytes, response, error):
+        if not self._tracer.recording:
+            return
+        category, name = _split_method(method)
+        args = dict(request_bytes=request_bytes, response_bytes=response_bytes)
+        if error is not None:
+            code = error.code() if hasattr(error, 'code') else None
+            args['code'] = code.name if code is not None else type(error).__name__
+        else:
+            args['code'] = 'OK'
+            status = _status_name(response) if response is not None else None
+            if status is not None:
+                args['status'] = status
+        self._tracer.record(name, category, start, time.perf_counter() - start, thread, args)
+
+    def _on_done(self, method, start, thread, request_bytes):
+
+        def done(future):
+            request_size = request_bytes() if callable(request_bytes) else request_bytes
+            try:
+                error = future.exception()
+            except grpc.FutureCancelledError as err:
+                error = err
+            response = None if error is not None else future.result()
+            self._record(method, start, thread, request_size,
+                         response.ByteSize() if response is not None else 0, response, error)
+
+        return done
+
+    def _on_stream_end(self, method, start, thread, request_bytes):
+
+        def finish(response_bytes, last_response, error):
+            request_size = request_bytes() if callable(request_bytes) else request_bytes
+            self._record(method, start, thread, request_size, response_bytes, last_response,
+                         error)
+
+        return finish
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        if not self._tracer.recording:
+            return continuation(client_call_details, request)
+        start, thread = time.perf_counter(), threading.get_ident()
+        call = continuation(client_call_details, request)
+        call.add_done_callback(
+            self._on_done(client_call_details.method, start, thread, request.ByteSize()))
+        return call
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        if not self._tracer.recording:
+            return continuation(client_call_details, request)
+        start, thread = time.perf_counter(), threading.get_ident()
+        call = continuation(client_call_details, request)
+        return _TracedResponses(
+            call, self._on_stream_end(client_call_details.method, start, thread,
+                                      request.ByteSize()))
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        if not self._tracer.recording:
+            return continuation(client_call_details, request_iterator)
+        start, thread = time.perf_counter(), threading.get_ident()
+        requests = _CountedRequests(request_iterator)
+        call = continuation(client_call_details, requests)
+        call.add_done_callback(
+            self._on_done(client_call_details.method, start, thread, lambda: requests.bytes))
+        return call
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        if not self._tracer.recording:
+            return continuation(client_call_details, request_iterator)
+        start, thread = time.perf_counter(), threading.get_ident()
+        requests = _CountedRequests(request_iterator)
+        call = continuation(client_call_details, requests)
+        return _TracedResponses(
+            call, self._on_stream_end(client_call_details.method, start, thread,
+                                      lambda: requests.bytes))
@@ -0,0 +1,206 @@
+"""Simulated drawer and arm, for exercising constrained manipulation without a robot.
+
+SimulatedDrawer is a one dimensional drawer held by the hand. It answers the RobotCommandClient
+and RobotStateClient calls the constrained manipulation code makes, in process and with an
+optional latency, so a controller can be run against it unchanged:
+
+    drawer = SimulatedDrawer(travel_limit=0.35, friction=15.0)
+    controller = ConstrainedManipulationController(drawer.command_client(), drawer.state_client(),
+                                                   drawer.time_sync)
+    result = controller.run()
+
+The hand moves along the odom x axis at the commanded tangential speed, scaled down by the share
+of the force limit the friction takes and lagging behind the command by time_constant seconds.
+Once the drawer reaches travel_limit, or when the friction exceeds the force limit, the hand
+stops and the estimated force rises to the force limit; the feedback reports ARM_IS_STUCK at the
+end of the travel. A command stops the hand at its end_time.
+"""
+
+import concurrent.futures
+import itertools
+import math
+import threading
+import time
+
+from bosdyn.api import basic_command_pb2, robot_command_pb2, robot_state_pb2
+from bosdyn.client.frame_helpers import BODY_FRAME_NAME, HAND_FRAME_NAME, ODOM_FRAME_NAME
+from bosdyn.client.math_helpers import Quat, SE3Pose
+
+from utils.fake_graph_nav import FakeTimeSyncEndpoint
+
+_Feedback = basic_command_pb2.ConstrainedManipulationCommand.Feedback
+
+
+class SimulatedDrawer(object):
+    """A drawer pulled by the hand along the odom x axis.
+
+    params:
+    + travel_limit (optional): meters the drawer can open
+    + friction (optional): newtons needed to move the drawer
+    + time_constant (optional): seconds the hand speed takes to follow the command
+    + latency (optional): seconds added to every call
+    + hand_x (optional): odom x of the hand when the drawer is closed
+    + lose_grasp_at (optional): opening in meters at which the handle slips out of the gripper
+    """
+
+    def __init__(self, travel_limit=0.35, friction=15.0, time_constant=0.1, latency=0.0,
+                 hand_x=0.8, lose_grasp_at=None):
+        self.travel_limit = travel_limit
+        self.friction = friction
+        self.time_constant = time_constant
+        self.latency = latency
+        self.hand_x = hand_x
+        self.lose_grasp_at = lose_grasp_at
+        self.time_sync = FakeTimeSyncEndpoint()
+        self.opening = 0.0  # meters the drawer is open
+        self.speed = 0.0  # signed speed of the hand along odom x, meters per second
+        self.force = 0.0
+        self.grasp_lost = False
+        self.commands = []  # (time.time(), RobotCommand) of every command received
+        self._command = None
+        self._command_end_time = 0.0
+        self._command_ids = itertools.count(1)
+        self._command_id = 0
+        self._last_update = time.time()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def _update(self, now, max_step=0.005):
+        """Integrate the drawer from the last update to now, in steps of at most max_step."""
+        while self._last_update < now:
+            dt = min(max_step, now - self._last_update)
+            self._last_update += dt
+            self._step(self._last_update, dt)
+
+    def _step(self, now, dt):
+        commanded_speed = 0.0
+        force_limit = 0.0
+        if self._command is not None and now < self._command_end_time and not self.grasp_lost:
+            request = self._command.full_body_command.constrained_manipulation_request
+            commanded_speed = request.tangential_speed
+            force_limit = request.force_limit.value
+        # The share of the force left once the friction is overcome drives the hand.
+        drive = max(0.0, 1.0 - self.friction / force_limit) if force_limit else 0.0
+        target_speed = commanded_speed * drive
+        self.speed += (target_speed - self.speed) * (1.0 - math.exp(-dt / self.time_constant))
+        # A negative velocity pulls the hand back, opening the drawer.
+        opening = self.opening - self.speed * dt
+        if not 0.0 < opening < self.travel_limit:
+            self.speed = 0.0
+        self.opening = min(max(opening, 0.0), self.travel_limit)
+        blocked = (commanded_speed < 0.0 and self.opening >= self.travel_limit) or (
+            commanded_speed > 0.0 and self.opening <= 0.0)
+        if commanded_speed and (blocked or not drive):
+            # Pushing against the end of the travel, or unable to overcome the friction.
+            self.force = force_limit
+        elif abs(self.speed) > 1e-3:
+            self.force = self.friction
+        else:
+            self.force = 0.0
+        if self.lose_grasp_at is not None and self.opening >= self.lose_grasp_at:
+            self.grasp_lost = True
+
+    def _status(self, now):
+        if self._command is None:
+            return _Feedback.STATUS_UNKNOWN
+        if self.grasp_lost:
+            return _Feedback.STATUS_GRASP_IS_LOST
+        if now < self._command_end_time and self.opening >= self.travel_limit:
+            return _Feedback.STATUS_ARM_IS_STUCK
+        return _Feedback.STATUS_RUNNING
+
+    def _call(self, function, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            now = time.time()
+            self._update(now)
+            return function(now, *args)
+
+    def _async(self, function, *args):
+        return self._executor.submit(self._call, function, *args)
+
+    def _robot_command(self, now, command, end_time_secs=None):
+        self.commands.append((now, command))
+        if not command.HasField("full_body_command") or not command.full_body_command.HasField(
+                "constrained_manipulation_request"):
+            # Any other command ends the constrained manipulation.
+            self._command = None
+        else:
+            self._command = robot_command_pb2.RobotCommand()
+            self._command.CopyFrom(command)
+            end_time = command.full_body_command.constrained_manipulation_request.end_time
+            self._command_end_time = (end_time.seconds + end_time.nanos * 1e-9 if
+                                      end_time.seconds else now + 10.0)
+        self._command_id = next(self._command_ids)
+        return self._command_id
+
+    def _robot_command_feedback(self, now, command_id):
+        response = robot_command_pb2.RobotCommandFeedbackResponse()
+        feedback = response.feedback.full_body_feedback.constrained_manipulation_feedback
+        if command_id == self._command_id:
+            feedback.status = self._status(now)
+        else:
+            feedback.status = _Feedback.STATUS_UNKNOWN
+        return response
+
+    def _robot_state(self, now):
+        state = robot_state_pb2.RobotState()
+        snapshot = state.kinematic_state.transforms_snapshot
+        snapshot.child_to_parent_edge_map[ODOM_FRAME_NAME].parent_frame_name = ""
+        body = snapshot.child_to_parent_edge_map[BODY_FRAME_NAME]
+        body.parent_frame_name = ODOM_FRAME_NAME
+        body.parent_tform_child.rotation.w = 1.0
+        hand = snapshot.child_to_parent_edge_map[HAND_FRAME_NAME]
+        hand.parent_frame_name = BODY_FRAME_NAME
+        hand.parent_tform_child.CopyFrom(
+            SE3Pose(self.hand_x - self.opening, 0.0, 0.5, Quat()).to_proto())
+        manipulator_state = state.manipulator_state
+        manipulator_state.is_gripper_holding_item = not self.grasp_lost
+        manipulator_state.estimated_end_effector_force_in_hand.x = self.force
+        manipulator_state.velocity_of_hand_in_odom.linear.x = self.speed
+        return state
+
+    def command_client(self):
+        """Return an object with the RobotCommandClient methods used by the controller."""
+        return _SimulatedCommandClient(self)
+
+    def state_client(self):
+        """Return an object with the RobotStateClient methods used by the controller."""
+        return _SimulatedStateClient(self)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class _SimulatedCommandClient(object):
+
+    def __init__(self, drawer):
+        self._drawer = drawer
+
+    def robot_command(self, command, end_time_secs=None, **kwargs):
+        return self._drawer._call(self._drawer._robot_command, command, end_time_secs)
+
+    def robot_command_async(self, command, end_time_secs=None, **kwargs):
+        # Copied now, like the SDK builds its request before returning.
+        copy = robot_command_pb2.RobotCommand()
+        copy.CopyFrom(command)
+        return self._drawer._async(self._drawer._robot_command, copy, end_time_secs)
+
+    def robot_command_feedback(self, robot_command_id, **kwargs):
+        return self._drawer._call(self._drawer._robot_command_feedback, robot_command_id)
+
+    def robot_command_feedback_async(self, robot_command_id, **kwargs):
+        return self._drawer._async(self._drawer._robot_command_feedback, robot_command_id)
+
+
+class _SimulatedStateClient(object):
+
+    def __init__(self, drawer):
+        self._drawer = drawer
+
+    def get_robot_state(self, **kwargs):
+        return self._drawer._call(self._drawer._robot_state)
+
+    def get_robot_state_async(self, **kwargs):
+        return self._drawer._async(self._drawer._robot_state)
@@ -0,0 +1,166 @@
+"""Run a robot skill as a pipeline of timed stages.
+
+A skill is a list of Stage. Stages run one after another, but while a stage runs the inputs of the
+next one (an image, the robot state, a command to build) are fetched in a background thread, so
+the next stage starts with them ready. Stages wait for robot feedback with wait_until instead of
+sleeping for a fixed time, and every stage has a timeout after which the skill stops.
+
+    executor = SkillExecutor([
+        Stage("grasp", grasp, timeout=15.0, prefetch=capture_image),
+        Stage("stow", stow, timeout=5.0),
+    ])
+    report = executor.run()
+    print(report)  # per stage breakdown: run time and time spent waiting on the prefetch
+
+A stage is called as run(context, prefetched, deadline): context is a dict shared by the stages
+of one run, prefetched the value returned by its prefetch function (None without one) and deadline
+the time.time() by which the stage must be done.
+"""
+
+import concurrent.futures
+import time
+
+from utils.rpc_tracing import span, traced_sleep
+
+
+class StageTimeout(Exception):
+    """A stage did not complete before its deadline."""
+
+
+class StageFailed(Exception):
+    """A stage completed but the robot reported a failure."""
+
+
+def wait_until(check, deadline, period=0.05, description="condition"):
+    """Call check() every period seconds until it returns a true value, which is returned.
+
+    Raises StageTimeout once deadline (a time.time()) has passed.
+    """
+    while True:
+        value = check()
+        if value:
+            return value
+        now = time.time()
+        if now >= deadline:
+            raise StageTimeout("Timed out waiting for {}".format(description))
+        traced_sleep(min(period, deadline - now), "wait for " + description)
+
+
+class Stage(object):
+    """One step of a skill.
+
+    params:
+    + name: name of the stage in the report
+    + run: called as run(context, prefetched, deadline), its return value is stored in
+           context[name]
+    + timeout (optional): seconds the stage may take, prefetch wait included
+    + prefetch (optional): called as prefetch(context) in a background thread while the previous
+                           stage runs, its return value is passed to run
+    """
+
+    def __init__(self, name, run, timeout=10.0, prefetch=None):
+        self.name = name
+        self.run = run
+        self.timeout = timeout
+        self.prefetch = prefetch
+
+
+class StageTiming(object):
+    """Timing of one stage of a run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.prefetch_wait = 0.0  # seconds spent waiting for the prefetch to finish
+        self.seconds = 0.0  # seconds from the start of the stage to its end, wait included
+        self.status = "not run"
+
+
+class SkillReport(object):
+    """Outcome of one SkillExecutor.run call."""
+
+    def __init__(self, names):
+        self.stages = [StageTiming(name) for name in names]
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def complete(self):
+        return self.error is None
+
+    def __str__(self):
+        lines = ["{:<28}{:>10}{:>14}  {}".format("stage", "time (s)", "prefetch (s)", "status")]
+        for timing in self.stages:
+            lines.append("{:<28}{:>10.2f}{:>14.2f}  {}".format(timing.name, timing.seconds,
+                                                             timing.prefetch_wait, timing.status))
+        lines.append("{:<28}{:>10.2f}".format("total", self.seconds))
+        if self.error is not None:
+            lines.append("Stopped: {}".format(self.error))
+        return "\n".join(lines)
+
+
+class SkillExecutor(object):
+    """Runs the stages of a skill, prefetching the inputs of each stage during the previous one.
+
+    params:
+    + stages: list of Stage, in order
+    + max_workers (optional): threads running the prefetch functions
+    """
+
+    def __init__(self, stages, max_workers=2):
+        self.stages = stages
+        self._max_workers = max_workers
+
+    def run(self, context=None):
+        """Run every stage, returning the SkillReport.
+
+        A stage raising (StageTimeout, StageFailed or an SDK error) stops the skill; the
+        exception is stored in report.error and the report is returned.
+        """
+        context = context if context is not None else dict()
+        report = SkillReport([stage.name for stage in self.stages])
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+
+            def submit_prefetch(index):
+                if index < len(self.stages) and self.stages[index].prefetch is not None:
+                    stage = self.stages[index]
+
+                    def prefetch_stage():
+                        with span("prefetch " + stage.name):
+                            return stage.prefetch(context)
+
+                    return executor.submit(prefetch_stage)
+                return None
+
+            prefetch = submit_prefetch(0)
+            for index, stage in enumerate(self.stages):
+                timing = report.stages[index]
+                stage_start = time.time()
+                deadline = stage_start + stage.timeout
+                try:
+                    prefetched = None
+                    if prefetch is not None:
+                        prefetched = prefetch.result(timeout=max(0.0, deadline - time.time()))
+                    timing.prefetch_wait = time.time() - stage_start
+                    # Start on the inputs of the next stage while this one runs.
+                    prefetch = submit_prefetch(index + 1)
+                    with span(stage.name):
+                        context[stage.name] = stage.run(context, prefetched, deadline)
+                    timing.status = "ok"
+                except concurrent.futures.TimeoutError:
+                    timing.status = "timeout"
+                    report.error = StageTimeout("Timed out waiting for the inputs of {}".format(
+                        stage.name))
+                except StageTimeout as err:
+                    timing.status = "timeout"
+                    report.error = err
+                except Exception as err:  # pylint: disable=broad-except
+                    timing.status = "failed"
+                    report.error = err
+                timing.seconds = time.time() - stage_start
+                if report.error is not None:
+                    if prefetch is not None:
+                        prefetch.cancel()
+                    break
+        report.seconds = time.time() - start
+        return report
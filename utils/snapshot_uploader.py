@@ -0,0 +1,236 @@
+"""Incremental, resumable upload of a map's waypoint and edge snapshots.
+
+upload_graph tells us which snapshots the robot does not have yet. Only those are read from
+disk and uploaded, several at a time over a bounded window of in-flight RPCs, with retries.
+An UploadManifest records, per robot serial number, the snapshot ids the robot accepted, so a
+failed upload can be resumed and reported on. The robot stays the source of truth: ids it
+reports as unknown are uploaded again even if the manifest lists them.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+from bosdyn.client.exceptions import Error as SdkError
+
+from utils.map_cache import default_cache_dir
+
+WAYPOINT_SNAPSHOT = "waypoint_snapshots"
+EDGE_SNAPSHOT = "edge_snapshots"
+UPLOAD_MANIFEST_FILE_NAME = "upload_manifest.json"
+
+
+class UploadManifest(object):
+    """Snapshot ids accepted by each robot, keyed by robot serial number, saved as JSON."""
+
+    def __init__(self, file_name, save_every=10):
+        self._file_name = file_name
+        self._save_every = save_every
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._robots = dict()
+        self._save_failed = False
+        try:
+            with open(file_name, "r") as f:
+                for serial, kinds in json.load(f).items():
+                    self._robots[serial] = {kind: set(ids) for kind, ids in kinds.items()}
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def for_map(path):
+        """Return the manifest stored in the map cache directory of the map at path."""
+        return UploadManifest(os.path.join(default_cache_dir(path), UPLOAD_MANIFEST_FILE_NAME))
+
+    def _ids(self, serial, kind):
+        return self._robots.setdefault(serial, {}).setdefault(kind, set())
+
+    def accepted(self, serial, kind):
+        """Return the set of snapshot ids of the given kind the robot has accepted."""
+        with self._lock:
+            return set(self._ids(serial, kind))
+
+    def record(self, serial, kind, snapshot_id):
+        """Mark a snapshot as accepted by the robot, saving the manifest every few records."""
+        with self._lock:
+            self._ids(serial, kind).add(snapshot_id)
+            self._unsaved += 1
+            should_save = self._unsaved >= self._save_every
+        if should_save:
+            self.save()
+
+    def forget(self, serial, kind, snapshot_ids):
+        """Remove snapshot ids the robot no longer has."""
+        with self._lock:
+            self._ids(serial, kind).difference_update(snapshot_ids)
+            self._unsaved += 1
+
+    def save(self):
+        with self._lock:
+            data = {
+                serial: {kind: sorted(ids) for kind, ids in kinds.items()}
+                for serial, kinds in self._robots.items()
+            }
+            self._unsaved = 0
+            if self._save_failed:
+                return
+            try:
+                directory = os.path.dirname(self._file_name)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Write to a temporary file first so an interrupted run never leaves a truncated
+                # file.
+                with open(self._file_name + ".tmp", "w") as f:
+                    json.dump(data, f)
+                os.replace(self._file_name + ".tmp", self._file_name)
+            except OSError as err:
+                # The upload does not need the manifest; it is then only kept in memory.
+                print("Could not write the upload manifest {}: {}".format(self._file_name, err))
+                self._save_failed = True
+
+
+class UploadReport(object):
+    """Outcome of one SnapshotUploader.upload call."""
+
+    def __init__(self):
+        self.uploaded = []  # list of (kind, snapshot_id)
+        self.failed = []  # list of (kind, snapshot_id, exception)
+        self.already_on_robot = 0
+        self.previously_recorded = 0
+        self.seconds = 0.0
+
+    @property
+    def complete(self):
+        return not self.failed
+
+    def __str__(self):
+        return ("Uploaded {} snapshots in {:.2f}s ({} already on the robot, {} were recorded as "
+                "uploaded but missing, {} failed)".format(len(self.uploaded), self.seconds,
+                                                         self.already_on_robot,
+                                                         self.previously_recorded,
+                                                         len(self.failed)))
+
+
+def _print_uploaded(kind, snapshot_id, done, total):
+    print("Uploaded {}".format(snapshot_id))
+
+
+class SnapshotUploader(object):
+    """Uploads a map to one robot, only sending the snapshots it is missing.
+
+    params:
+    + graph_nav_client: GraphNavClient of the robot
+    + map_loader: MapLoader of the map to upload
+    + robot_serial: serial number of the robot, used as the manifest key
+    + manifest (optional): UploadManifest, by default the one stored next to the map
+    + max_in_flight (optional): maximum number of snapshot uploads running at the same time
+    + max_retries (optional): number of times a failed snapshot upload is retried
+    + retry_delay (optional): seconds to wait before the first retry, doubled on every retry
+    + progress (optional): called as progress(kind, snapshot_id, done, total) after every accepted
+                           snapshot, by default prints the snapshot id
+    """
+
+    def __init__(self, graph_nav_client, map_loader, robot_serial, manifest=None,
+                 max_in_flight=4, max_retries=3, retry_delay=0.5, progress=None):
+        self._graph_nav_client = graph_nav_client
+        self._map_loader = map_loader
+        self._robot_serial = robot_serial
+        self._manifest = manifest if manifest is not None else UploadManifest.for_map(
+            map_loader.path)
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._progress = progress if progress is not None else _print_uploaded
+        self._progress_lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+
+    def _snapshots(self, kind):
+        if kind == WAYPOINT_SNAPSHOT:
+            return self._map_loader.waypoint_snapshots
+        return self._map_loader.edge_snapshots
+
+    def _upload_one(self, kind, snapshot_id):
+        # Parsing happens here, in the worker, so it overlaps with the other uploads in flight.
+        snapshot = self._snapshots(kind)[snapshot_id]
+        delay = self._retry_delay
+        for attempt in range(self._max_retries + 1):
+            try:
+                if kind == WAYPOINT_SNAPSHOT:
+                    self._graph_nav_client.upload_waypoint_snapshot(snapshot)
+                else:
+                    self._graph_nav_client.upload_edge_snapshot(snapshot)
+                break
+            except SdkError:
+                if attempt == self._max_retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+        self._manifest.record(self._robot_serial, kind, snapshot_id)
+        with self._progress_lock:
+            self._done += 1
+            done = self._done
+        self._progress(kind, snapshot_id, done, self._total)
+
+    def upload_snapshots(self, unknown_waypoint_snapshot_ids, unknown_edge_snapshot_ids,
+                         report=None):
+        """Upload the given snapshots, returning an UploadReport.
+
+        Failures do not stop the other uploads; they are listed in report.failed and the snapshots
+        will be reported as unknown again by the next upload_graph call.
+        """
+        report = report if report is not None else UploadReport()
+        start = time.time()
+        pending = []
+        for kind, snapshot_ids in ((WAYPOINT_SNAPSHOT, unknown_waypoint_snapshot_ids),
+                                   (EDGE_SNAPSHOT, unknown_edge_snapshot_ids)):
+            snapshot_ids = list(snapshot_ids)
+            stale = self._manifest.accepted(self._robot_serial, kind).intersection(snapshot_ids)
+            if stale:
+                # The robot lost these (e.g. its graph was cleared), so they must be resent.
+                report.previously_recorded += len(stale)
+                self._manifest.forget(self._robot_serial, kind, stale)
+            pending.extend((kind, snapshot_id) for snapshot_id in snapshot_ids)
+        with self._progress_lock:
+            self._done, self._total = 0, len(pending)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._max_in_flight) as executor:
+                futures = {
+                    executor.submit(self._upload_one, kind, snapshot_id): (kind, snapshot_id)
+                    for kind, snapshot_id in pending
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    kind, snapshot_id = futures[future]
+                    exception = future.exception()
+                    if exception is None:
+                        report.uploaded.append((kind, snapshot_id))
+                    else:
+                        report.failed.append((kind, snapshot_id, exception))
+        finally:
+            self._manifest.save()
+            report.seconds += time.time() - start
+        return report
+
+    def upload(self, lease=None, generate_new_anchoring=None):
+        """Upload the graph, then the snapshots the robot does not have yet.
+
+        If the robot already has the whole map this costs a single upload_graph call. Calling
+        upload again after a failure resumes with the snapshots that are still missing.
+        """
+        graph = self._map_loader.graph
+        if generate_new_anchoring is None:
+            generate_new_anchoring = not len(graph.anchoring.anchors)
+        start = time.time()
+        response = self._graph_nav_client.upload_graph(
+            lease=lease, graph=graph, generate_new_anchoring=generate_new_anchoring)
+        report = UploadReport()
+        report.seconds = time.time() - start
+        report.already_on_robot = (
+            len(self._map_loader.waypoint_snapshots) + len(self._map_loader.edge_snapshots) -
+            len(response.unknown_waypoint_snapshot_ids) - len(response.unknown_edge_snapshot_ids))
+        return self.upload_snapshots(response.unknown_waypoint_snapshot_ids,
+                                     response.unknown_edge_snapshot_ids, report)
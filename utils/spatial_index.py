@@ -0,0 +1,150 @@
+"""Nearest neighbour and radius queries over the anchored waypoints and objects of a map.
+
+SpatialIndex buckets points of the seed frame into a uniform grid of square cells, so a query
+only looks at the cells around the query point instead of every anchor. Distances are measured
+in the horizontal (x, y) plane of the seed frame, which is how seed frame goals are given.
+
+    anchoring_index = AnchoringIndex.for_graph(graph)
+    for waypoint_id, distance in anchoring_index.waypoints.nearest(x, y, k=3):
+        ...
+    fiducials_nearby = anchoring_index.objects.within(x, y, radius=2.0)
+"""
+
+import collections
+
+import numpy as np
+
+
+class SpatialIndex(object):
+    """Uniform grid over 2D points, each with an id.
+
+    params:
+    + ids: list of point ids
+    + positions: (N, 2) array-like of the x, y position of each point
+    + cell_size (optional): side of a grid cell, in meters
+    """
+
+    def __init__(self, ids, positions, cell_size=2.0):
+        self.ids = list(ids)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        cells = collections.defaultdict(list)
+        for i, cell in enumerate(map(tuple, np.floor(self.positions / self.cell_size).astype(int))):
+            cells[cell].append(i)
+        # Maps (column, row) of a cell to the array of indices of the points in it.
+        self._cells = {cell: np.array(indices) for cell, indices in cells.items()}
+        if self._cells:
+            cell_array = np.array(list(self._cells))
+            self._min_cell = cell_array.min(axis=0)
+            self._max_cell = cell_array.max(axis=0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _ring(self, center, radius):
+        """Return the indices of the points in the cells at Chebyshev distance radius of center."""
+        cx, cy = center
+        if radius == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(cx + dx, cy + dy) for dx in range(-radius, radius + 1)
+                     for dy in (-radius, radius)]
+            cells.extend((cx + dx, cy + dy) for dx in (-radius, radius)
+                         for dy in range(-radius + 1, radius))
+        found = [self._cells[cell] for cell in cells if cell in self._cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=int)
+
+    def _results(self, indices, distances):
+        order = np.lexsort((indices, distances))
+        return [(self.ids[indices[i]], float(distances[i])) for i in order]
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        """Return up to k (id, distance) of the points closest to (x, y), closest first."""
+        if not self.ids or k < 1:
+            return []
+        point = np.array([x, y], dtype=np.float64)
+        center = tuple(np.floor(point / self.cell_size).astype(int))
+        # Rings past this one are empty.
+        max_radius = int(
+            max(np.abs(self._min_cell - center).max(), np.abs(self._max_cell - center).max()))
+        candidates = []
+        radius = 0
+        while radius <= max_radius:
+            ring = self._ring(center, radius)
+            if len(ring):
+                candidates.append(ring)
+            radius += 1
+            if sum(len(c) for c in candidates) >= k:
+                indices = np.concatenate(candidates)
+                distances = np.linalg.norm(self.positions[indices] - point, axis=1)
+                kth = np.partition(distances, k - 1)[k - 1]
+                # Every point outside the rings searched so far is at least this far away.
+                if kth <= (radius - 1) * self.cell_size + self._distance_to_cell_border(point):
+                    break
+        if not candidates:
+            return []
+        indices = np.concatenate(candidates)
+        distances = np.linalg.norm(self.positions[indices] - point, axis=1)
+        results = self._results(indices, distances)[:k]
+        if max_distance is not None:
+            results = [result for result in results if result[1] <= max_distance]
+        return results
+
+    def _distance_to_cell_border(self, point):
+        """Return the distance from point to the closest border of its cell."""
+        offset = point - np.floor(point / self.cell_size) * self.cell_size
+        return float(min(offset.min(), (self.cell_size - offset).min()))
+
+    def within(self, x, y, radius):
+        """Return the (id, distance) of every point at most radius away from (x, y), closest first."""
+        if not self.ids:
+            return []
+        point = np.array([x, y], dtype=np.float64)
+        low = np.floor((point - radius) / self.cell_size).astype(int)
+        high = np.floor((point + radius) / self.cell_size).astype(int)
+        found = [
+            self._cells[(cx, cy)] for cx in range(low[0], high[0] + 1)
+            for cy in range(low[1], high[1] + 1) if (cx, cy) in self._cells
+        ]
+        if not found:
+            return []
+        indices = np.concatenate(found)
+        distances = np.linalg.norm(self.positions[indices] - point, axis=1)
+        inside = distances <= radius
+        return self._results(indices[inside], distances[inside])
+
+
+class AnchoringIndex(object):
+    """Spatial indices of the anchored waypoints and objects of a map_pb2.Graph."""
+
+    # The most recently built index, returned again by for_graph for the same graph.
+    _last = None
+
+    def __init__(self, graph, cell_size=2.0):
+        self.graph = graph
+        self._size = (len(graph.anchoring.anchors), len(graph.anchoring.objects))
+        # Maps waypoint id to seed_tform_waypoint, and object id to seed_tform_object.
+        self.seed_tform_waypoints = {
+            anchor.id: anchor.seed_tform_waypoint for anchor in graph.anchoring.anchors
+        }
+        self.seed_tform_objects = {
+            anchored_object.id: anchored_object.seed_tform_object
+            for anchored_object in graph.anchoring.objects
+        }
+        self.waypoints = SpatialIndex(
+            list(self.seed_tform_waypoints),
+            [(pose.position.x, pose.position.y) for pose in self.seed_tform_waypoints.values()],
+            cell_size)
+        self.objects = SpatialIndex(
+            list(self.seed_tform_objects),
+            [(pose.position.x, pose.position.y) for pose in self.seed_tform_objects.values()],
+            cell_size)
+
+    @classmethod
+    def for_graph(cls, graph):
+        """Return the index of graph, reusing the last one built if it is for the same graph."""
+        last = cls._last
+        if (last is None or last.graph is not graph or
+                last._size != (len(graph.anchoring.anchors), len(graph.anchoring.objects))):
+            last = cls._last = cls(graph)
+        return last